@@ -0,0 +1,265 @@
+"""動物病院口コミ分析 - 分析リクエストの受付制御（アドミッション制御）
+
+- コスト見積もり: 行数・テキスト長・モデル数・ブートストラップ回数から「コスト単位」を計算
+- 同時実行数とコスト予算（全体 / クライアントごと）の範囲で実行し、超える分は待ち行列に入れる
+- 待ち行列はクライアントごとのラウンドロビン（重いユーザーが他のユーザーを待たせ続けない）
+- 待ち行列が満杯・待ち時間の見積もりが上限を超える場合は AdmissionRejected（429 + Retry-After）
+
+予算・待ち行列はワーカープロセスごと（gunicorn の sync ワーカーは1プロセスで同時に1リクエストなので、
+同じプロセス内で競合するのは先行スコア計算のスレッドと実行中のリクエスト）。ワーカーが複数なら全体の上限は
+ワーカー数倍になる。待ち時間の上限はワーカーのタイムアウト（WORKER_TIMEOUT）より短く抑える。
+クライアントは接続元アドレスで識別する（X-Client-Id などのヘッダーは自己申告のため使わない）。
+リバースプロキシの後ろでは ADMISSION_TRUSTED_PROXIES にプロキシの段数を設定すると、
+X-Forwarded-For のうちプロキシが付け加えたアドレスだけを使う。
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# gunicorn のワーカータイムアウト（gunicorn.conf.py と同じ環境変数）と、待ち時間の上限に残す余裕
+WORKER_TIMEOUT = int(os.environ.get('WORKER_TIMEOUT', 30))
+WORKER_TIMEOUT_MARGIN = 10
+
+ADMISSION_SETTINGS = {
+    'max_concurrent': int(os.environ.get('ADMISSION_MAX_CONCURRENT', 2)),
+    'max_concurrent_per_client': int(os.environ.get('ADMISSION_MAX_CONCURRENT_PER_CLIENT', 1)),
+    # 同時に実行できるコストの合計と、1クライアントが使える割合
+    'token_budget': float(os.environ.get('ADMISSION_TOKEN_BUDGET', 200000)),
+    'client_token_share': float(os.environ.get('ADMISSION_CLIENT_TOKEN_SHARE', 0.5)),
+    'max_queue': int(os.environ.get('ADMISSION_MAX_QUEUE', 16)),
+    'max_queue_per_client': int(os.environ.get('ADMISSION_MAX_QUEUE_PER_CLIENT', 2)),
+    # 秒（ワーカーのタイムアウトで待っている間に強制終了されないように、タイムアウトより短く抑える）
+    'max_wait': min(float(os.environ.get('ADMISSION_MAX_WAIT', 15)),
+                    max(1.0, WORKER_TIMEOUT - WORKER_TIMEOUT_MARGIN)),
+    # 接続元の前にある信頼できるリバースプロキシの段数（0 なら X-Forwarded-For を使わない）
+    'trusted_proxies': int(os.environ.get('ADMISSION_TRUSTED_PROXIES', 0)),
+    # 処理速度（コスト単位/秒）の初期値。完了したリクエストの実測で更新する
+    'initial_rate': float(os.environ.get('ADMISSION_INITIAL_RATE', 2000))
+}
+
+# コストの係数: 1行1モデルの推論 = 1 + 文字数 / CHARS_PER_UNIT、ブートストラップは1万（行×回）= 1
+CHARS_PER_UNIT = 100
+BOOTSTRAP_ROW_ITERATIONS_PER_UNIT = 10000
+
+
+def estimate_cost(n_rows, total_chars, n_models, n_bootstrap=0, bootstrap_rows=0, n_bootstrap_tests=0):
+    """リクエストのコスト見積もり（推論 + ブートストラップ）"""
+    inference = n_models * (n_rows + total_chars / CHARS_PER_UNIT)
+    bootstrap = n_bootstrap * bootstrap_rows * n_bootstrap_tests / BOOTSTRAP_ROW_ITERATIONS_PER_UNIT
+    return float(inference + bootstrap)
+
+
+def client_id_from_request(request, trusted_proxies=None):
+    """クライアントの識別子（接続元アドレス。信頼できるプロキシの後ろではプロキシが記録したアドレス）
+
+    X-Forwarded-For の先頭はクライアントが自由に書けるため、末尾から trusted_proxies 番目
+    （最も外側の信頼できるプロキシが付け加えた値）だけを使う。
+    """
+    trusted_proxies = ADMISSION_SETTINGS['trusted_proxies'] if trusted_proxies is None else trusted_proxies
+    if trusted_proxies > 0:
+        forwarded = [addr.strip() for addr in request.headers.get('X-Forwarded-For', '').split(',') if addr.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.remote_addr or 'unknown'
+
+
+class AdmissionRejected(Exception):
+    """受付拒否（retry_after: 再試行までの秒数）"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class Ticket:
+    """1リクエスト分の受付（wait で実行可能になるまで待ち、release で予算を返す）"""
+    def __init__(self, controller, client_id, cost, seq):
+        self.controller = controller
+        self.client_id = client_id
+        self.cost = cost
+        self.seq = seq
+        self.admitted = False
+        self.released = False
+        self.started = None
+
+    def position(self):
+        return self.controller.position(self)
+
+    def wait_steps(self, timeout=None, poll=2.0):
+        """実行可能になるまで待つ。待っている間は poll 秒ごとに待ち順を返す（SSEの進捗通知用）
+
+        timeout を過ぎたら待ち行列から外して AdmissionRejected。途中で閉じられた場合も待ち行列から外す。
+        """
+        controller = self.controller
+        timeout = controller.settings['max_wait'] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                with controller.cond:
+                    if self.admitted:
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        controller.cancel(self)
+                        raise AdmissionRejected('待ち時間が上限を超えました', controller.estimated_wait())
+                    controller.cond.wait(min(remaining, poll))
+                    if self.admitted:
+                        return
+                    position = controller.position(self)
+                yield position
+        finally:
+            if not self.admitted:
+                controller.cancel(self)
+
+    def wait(self, timeout=None):
+        for _ in self.wait_steps(timeout):
+            pass
+
+    def release(self):
+        self.controller.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdmissionController:
+    """同時実行数・コスト予算の管理と、クライアントごとのラウンドロビン待ち行列"""
+    def __init__(self, settings=None):
+        self.settings = dict(ADMISSION_SETTINGS, **(settings or {}))
+        self.cond = threading.Condition()
+        self.running = {}             # クライアント -> 実行中の Ticket のリスト
+        self.queues = OrderedDict()   # クライアント -> 待ち行列（順序 = ラウンドロビンの順）
+        self.used_tokens = 0.0
+        self.rate = self.settings['initial_rate']
+        self.seq = 0
+        self.counters = {'admitted': 0, 'queued': 0, 'rejected': 0, 'completed': 0}
+
+    def _running_count(self):
+        return sum(len(tickets) for tickets in self.running.values())
+
+    def _queued(self):
+        return [ticket for queue in self.queues.values() for ticket in queue]
+
+    def _fits(self, ticket):
+        """実行中のリクエストに加えて実行できるか（予算より大きい要求も、空いていれば単独で実行する）"""
+        settings = self.settings
+        running = self.running.get(ticket.client_id, [])
+        if self._running_count() >= settings['max_concurrent']:
+            return False
+        if len(running) >= settings['max_concurrent_per_client']:
+            return False
+        if self.used_tokens > 0 and self.used_tokens + ticket.cost > settings['token_budget']:
+            return False
+        client_used = sum(t.cost for t in running)
+        client_budget = settings['token_budget'] * settings['client_token_share']
+        if client_used > 0 and client_used + ticket.cost > client_budget:
+            return False
+        return True
+
+    def _admit(self, ticket):
+        ticket.admitted = True
+        ticket.started = time.monotonic()
+        self.running.setdefault(ticket.client_id, []).append(ticket)
+        self.used_tokens += ticket.cost
+        self.counters['admitted'] += 1
+
+    def _dispatch(self):
+        """待ち行列の先頭をクライアントごとに順番に確認し、実行できるものを開始"""
+        progressed = True
+        while progressed and self.queues:
+            progressed = False
+            for client_id in list(self.queues):
+                queue = self.queues[client_id]
+                if not self._fits(queue[0]):
+                    continue
+                self._admit(queue.popleft())
+                # 実行したクライアントは順番の最後に回す
+                if queue:
+                    self.queues.move_to_end(client_id)
+                else:
+                    del self.queues[client_id]
+                progressed = True
+        self.cond.notify_all()
+
+    def estimated_wait(self, extra_cost=0.0):
+        """実行中・待ち行列のコストと処理速度の実測からの待ち時間の見積もり（秒）"""
+        queued_cost = sum(ticket.cost for ticket in self._queued())
+        return (self.used_tokens + queued_cost + extra_cost) / max(self.rate, 1e-9)
+
+    def submit(self, client_id, cost):
+        """受付。すぐに実行できなければ待ち行列に入れる（満杯・待ち時間超過なら AdmissionRejected）"""
+        settings = self.settings
+        with self.cond:
+            self.seq += 1
+            ticket = Ticket(self, client_id, float(cost), self.seq)
+            if not self.queues and self._fits(ticket):
+                self._admit(ticket)
+                return ticket
+
+            queued = self._queued()
+            reason = None
+            if len(queued) >= settings['max_queue']:
+                reason = '待ち行列が満杯です'
+            elif len(self.queues.get(client_id, ())) >= settings['max_queue_per_client']:
+                reason = 'このクライアントの待ち件数が上限に達しています'
+            elif self.estimated_wait() > settings['max_wait']:
+                reason = '待ち時間の見積もりが上限を超えています'
+            if reason is not None:
+                self.counters['rejected'] += 1
+                print(f"受付拒否: {client_id} ({reason}, コスト {cost:.0f})")
+                raise AdmissionRejected(reason, self.estimated_wait())
+
+            self.queues.setdefault(client_id, deque()).append(ticket)
+            self.counters['queued'] += 1
+            self._dispatch()
+            return ticket
+
+    def cancel(self, ticket):
+        with self.cond:
+            queue = self.queues.get(ticket.client_id)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self.queues[ticket.client_id]
+                self._dispatch()
+
+    def release(self, ticket):
+        with self.cond:
+            if not ticket.admitted or ticket.released:
+                return
+            ticket.released = True
+            running = self.running.get(ticket.client_id, [])
+            if ticket in running:
+                running.remove(ticket)
+                if not running:
+                    del self.running[ticket.client_id]
+            self.used_tokens = max(0.0, self.used_tokens - ticket.cost)
+            self.counters['completed'] += 1
+            # 処理速度（コスト単位/秒）の指数移動平均
+            elapsed = time.monotonic() - ticket.started
+            if elapsed > 0 and ticket.cost > 0:
+                self.rate = 0.8 * self.rate + 0.2 * (ticket.cost / elapsed)
+            self._dispatch()
+
+    def position(self, ticket):
+        """待ち順（1始まり、実行中は0）。先に受け付けた待ちリクエストの数で近似"""
+        with self.cond:
+            if ticket.admitted:
+                return 0
+            return 1 + sum(1 for queued in self._queued() if queued.seq < ticket.seq)
+
+    def status(self):
+        with self.cond:
+            return {
+                'settings': self.settings,
+                'running': {client_id: len(tickets) for client_id, tickets in self.running.items()},
+                'queued': {client_id: len(queue) for client_id, queue in self.queues.items()},
+                'used_tokens': self.used_tokens,
+                'rate': self.rate,
+                'estimated_wait': self.estimated_wait(),
+                'counters': dict(self.counters)
+            }
@@ -1,31 +1,56 @@
 import os
 import pandas as pd
 import numpy as np
-from flask import Flask, render_template, request, jsonify, send_file
-import plotly
-import plotly.graph_objs as go
-import plotly.express as px
-from sklearn.metrics import mean_absolute_error
-from scipy.stats import pearsonr
-from scipy import stats
+from flask import Flask, render_template, request, jsonify, send_file, Response
 import json
 import re
-import io
-import base64
 from werkzeug.utils import secure_filename
 import random
 import logging
+import threading
+import importlib.util
+import time
+import hashlib
+import contextlib
+
+from embedding_index import EmbeddingStore, EmbeddingIndex
+from admission import AdmissionController, AdmissionRejected, client_id_from_request, estimate_cost
+from model_registry import PRECISIONS, check_num_labels, load_model_registry, models_dict, sentiment_from_probabilities
+from upload_formats import REQUIRED_COLUMNS, MissingColumnsError, UploadFormatError, read_reviews
+from request_profiler import ProfileStore, ProfilingMiddleware, admin_authorized
 
 # フルBERTモデル版：実際のTransformersライブラリを使用
-try:
-    from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
-    import torch
-    BERT_AVAILABLE = True
+# torch / transformers の読み込みは数秒かかるため、インストール確認だけ行い初回使用時に読み込む
+BERT_AVAILABLE = all(importlib.util.find_spec(name) is not None for name in ('torch', 'transformers'))
+if BERT_AVAILABLE:
     print("✅ BERT モデルライブラリが利用可能です")
-except ImportError as e:
-    print(f"❌ BERT モデルライブラリが見つかりません: {e}")
+else:
+    print("❌ BERT モデルライブラリが見つかりません")
     print("pip install torch transformers を実行してください")
-    BERT_AVAILABLE = False
+
+torch = None
+AutoTokenizer = None
+AutoModelForSequenceClassification = None
+
+def import_bert_libraries():
+    """torch / transformers を初回のみ読み込む"""
+    global torch, AutoTokenizer, AutoModelForSequenceClassification, BERT_AVAILABLE
+    
+    if torch is not None or not BERT_AVAILABLE:
+        return BERT_AVAILABLE
+    
+    try:
+        import torch as torch_module
+        from transformers import AutoTokenizer as tokenizer_class, AutoModelForSequenceClassification as model_class
+    except ImportError as e:
+        print(f"❌ BERT モデルライブラリが見つかりません: {e}")
+        BERT_AVAILABLE = False
+        return False
+    
+    torch = torch_module
+    AutoTokenizer = tokenizer_class
+    AutoModelForSequenceClassification = model_class
+    return True
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -51,51 +76,151 @@ def convert_numpy_types(obj):
         return obj
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# アップロードできる行数の上限
+UPLOAD_MAX_ROWS = 10000
+
+# 埋め込み（プーリング済みの最終隠れ層）の保存先（モデル・データセットごとのファイル）と、モデルごとに残すデータセット数
+EMBEDDINGS_DIR = os.environ.get('EMBEDDINGS_DIR', 'embeddings')
+EMBEDDINGS_KEEP_DATASETS = int(os.environ.get('EMBEDDINGS_KEEP_DATASETS', 4))
+# モック分析時の埋め込み次元（文字2-gramのハッシュ）
+MOCK_EMBEDDING_DIM = 256
 
 # グローバル変数
 uploaded_data = None
 analysis_results = None
+embedding_results = None
+
+# 推論リクエストの受付制御（同時実行数・コスト予算・待ち行列）
+admission = AdmissionController()
+
+# リクエスト単位のプロファイリング（PROFILE_TOKEN 設定時、X-Profile-Token 付きのリクエストだけを計測）
+profiles = ProfileStore()
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profiles)
+
+# 使用するBERTモデル（models.json の full_bert プロファイル、MODEL_CONFIG で別の設定ファイルを指定可能）
+MODEL_SPECS = {spec.model_id: spec for spec in load_model_registry('full_bert')}
+MODELS = models_dict(MODEL_SPECS.values())
+
+# 推論精度: モデル設定の precision（MODEL_PRECISION で全モデルを上書き可能）
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION')
+if MODEL_PRECISION and MODEL_PRECISION not in PRECISIONS:
+    print(f"⚠️ MODEL_PRECISION={MODEL_PRECISION} は不明な値のため無視します（{', '.join(PRECISIONS)}）")
+    MODEL_PRECISION = None
+# 精度を下げたときのスコア（-2〜+2）の許容差。校正用テキストでの最大差が超えたら fp32 に戻す
+PRECISION_MAX_SCORE_DELTA = float(os.environ.get('PRECISION_MAX_SCORE_DELTA', 0.1))
+# 校正用テキスト（review_text 列のCSV）。未指定なら下の固定文
+PRECISION_CALIBRATION_FILE = os.environ.get('PRECISION_CALIBRATION_FILE')
+PRECISION_CALIBRATION_SIZE = 64
+CALIBRATION_TEXTS = [
+    '先生がとても親切で、待ち時間も短く安心して任せられる動物病院でした。',
+    '説明が丁寧で、費用も事前に教えてもらえたので安心できました。',
+    '受付の対応が悪く、待ち時間も長くて不安になりました。',
+    '料金が高いわりに説明が不十分で、二度と行きたくないです。',
+    '駐車場が狭くて不便ですが、治療は的確でした。',
+    '院内は清潔で、スタッフの方も優しかったです。',
+    '普通の病院だと思います。特に良くも悪くもありません。',
+    '夜間にも対応していただき、本当に頼りになる先生です。'
+]
+
+def cpu_flags():
+    """CPUの命令セットのフラグ（/proc/cpuinfo、取得できない環境では空）"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def detect_precision_support():
+    """デバイスごとに使える推論精度（bf16 / fp16 はCPUの専用命令がある場合のみ）"""
+    flags = cpu_flags()
+    support = {'cpu': {
+        'fp32': True,
+        'bf16': bool(flags & {'avx512_bf16', 'amx_bf16'}),
+        'fp16': bool(flags & {'avx512_fp16', 'amx_fp16'})
+    }}
+    if torch is not None and torch.cuda.is_available():
+        support['cuda'] = {'fp32': True, 'bf16': bool(torch.cuda.is_bf16_supported()), 'fp16': True}
+    return support
+
+def load_calibration_texts():
+    if PRECISION_CALIBRATION_FILE:
+        try:
+            texts = pd.read_csv(PRECISION_CALIBRATION_FILE, usecols=['review_text'])['review_text']
+            texts = [str(text) for text in texts.dropna().head(PRECISION_CALIBRATION_SIZE)]
+            if texts:
+                return texts
+        except Exception as e:
+            print(f"⚠️ 校正用テキストの読み込み失敗（固定文を使用）: {e}")
+    return CALIBRATION_TEXTS
 
-# 使用する3つの実際のBERTモデル
-MODELS = {
-    'cl-tohoku/bert-base-japanese-whole-word-masking': 'Model A (Tohoku BERT)',
-    'llm-book/bert-base-japanese-v3': 'Model B (LLM-book)',
-    'Mizuiro-sakura/luke-japanese-base-finetuned-vet': 'Model C (Mizuiro Vet)'
-}
+# 起動時に判定（CUDA の判定は torch の読み込み後に load_models で更新）
+PRECISION_SUPPORT = detect_precision_support()
+print(f"推論精度の対応状況: {PRECISION_SUPPORT}")
 
 class FullBertSentimentAnalyzer:
     def __init__(self):
         self.models = {}
         self.tokenizers = {}
-        self.load_models()
+        self.precisions = {}  # モデル -> 実際に使う推論精度
+        self.loaded = False
+        self.warmup_finished = False  # ウォームアップの処理が終わった（成功・失敗とも）
+        self._load_lock = threading.Lock()
+        # モデルごとの状態（/readyz で返す）
+        self.model_status = {
+            display_name: {'state': 'not_loaded', 'backend': None}
+            for display_name in MODELS.values()
+        }
+    
+    def ensure_loaded(self):
+        """モデルを初回使用時（またはウォームアップ時）に一度だけ読み込む"""
+        if self.loaded:
+            return
+        with self._load_lock:
+            if not self.loaded:
+                try:
+                    self.load_models()
+                except Exception as e:
+                    print(f"❌ モデル読み込み処理の失敗: {e}")
+                    self.mark_unfinished_failed(str(e))
+                finally:
+                    # 失敗しても読み込みは繰り返さない（読み込めなかったモデルはモック分析で応答）
+                    self.loaded = True
+    
+    def mark_unfinished_failed(self, error):
+        """途中で止まったモデル（読み込み中・ウォームアップ中など）の状態を failed にする"""
+        for status in self.model_status.values():
+            if status['state'] in ('not_loaded', 'loading', 'warming'):
+                status.update({'state': 'failed', 'error': error})
     
     def load_models(self):
         """実際のBERTモデルを読み込み"""
-        if not BERT_AVAILABLE:
+        global PRECISION_SUPPORT
+        
+        if not import_bert_libraries():
             print("❌ BERTライブラリが利用できません。pip install torch transformers を実行してください。")
+            for status in self.model_status.values():
+                status.update({'state': 'mock', 'backend': 'mock'})
             return
+        PRECISION_SUPPORT = detect_precision_support()
         
         for model_name, display_name in MODELS.items():
+            status = self.model_status[display_name]
+            spec = MODEL_SPECS[model_name]
+            if spec.backend == 'mock':
+                status.update({'state': 'mock', 'backend': 'mock'})
+                continue
             try:
                 print(f"📥 {display_name} を読み込み中...")
+                status['state'] = 'loading'
+                load_start = time.perf_counter()
                 
-                # モデルによって異なる設定を使用
-                if 'tohoku' in model_name:
-                    # 東北大学BERTの場合
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-                elif 'llm-book' in model_name:
-                    # LLM-bookBERTの場合  
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-                elif 'Mizuiro' in model_name:
-                    # Mizuiro獣医特化BERTの場合
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSequenceClassification.from_pretrained(model_name)
-                else:
-                    # デフォルト設定
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForSequenceClassification.from_pretrained(model_name)
+                tokenizer = AutoTokenizer.from_pretrained(model_name)
+                model = AutoModelForSequenceClassification.from_pretrained(model_name)
+                # 出力クラス数が labels と違うとスコアが意味を持たないため、読み込み失敗としてモックに切り替える
+                check_num_labels(spec, model.config.num_labels)
                 
                 # GPU利用可能な場合は使用
                 if torch.cuda.is_available():
@@ -104,15 +229,207 @@ class FullBertSentimentAnalyzer:
                 else:
                     print(f"💻 {display_name} をCPUに読み込みました")
                 
+                model.eval()
                 self.tokenizers[model_name] = tokenizer
                 self.models[model_name] = model
+                status.update({
+                    'state': 'loaded',
+                    'backend': 'cuda' if next(model.parameters()).is_cuda else 'cpu',
+                    'load_seconds': round(time.perf_counter() - load_start, 2)
+                })
                 
                 print(f"✅ {display_name} の読み込み完了")
+                self.apply_precision(model_name)
                 
             except Exception as e:
                 print(f"❌ {display_name} の読み込み失敗: {e}")
                 # フォールバック：モック分析を使用
                 print(f"🔄 {display_name} はモック分析にフォールバック")
+                status.update({'state': 'mock', 'backend': 'mock', 'error': str(e)})
+    
+    def precision_context(self, model_name):
+        """推論時の精度（bf16 は autocast、fp16 は重み自体を変換済み）"""
+        if self.precisions.get(model_name) == 'bf16':
+            device = next(self.models[model_name].parameters()).device
+            return torch.autocast(device_type=device.type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+    
+    def infer_batch(self, model_name, texts, return_embedding=False):
+        """1バッチの推論: クラス確率（行=口コミ）と、return_embedding なら最終隠れ層の平均プーリング
+
+        リクエストの推論（analyze_batch）と校正・ウォームアップ（score_texts）が共通で使う。
+        """
+        spec = MODEL_SPECS[model_name]
+        tokenizer = self.tokenizers[model_name]
+        model = self.models[model_name]
+        device = next(model.parameters()).device
+        inputs = tokenizer(
+            list(texts),
+            return_tensors="pt",
+            truncation=True,
+            padding=True,
+            max_length=spec.max_length
+        )
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        # 埋め込みが必要な場合も同じ1回の推論で隠れ層を取得。softmax は常に fp32
+        with torch.no_grad(), self.precision_context(model_name):
+            outputs = model(**inputs, output_hidden_states=return_embedding)
+            probabilities = torch.nn.functional.softmax(outputs.logits.float(), dim=-1).cpu().numpy()
+            embeddings = None
+            if return_embedding:
+                hidden = outputs.hidden_states[-1].float()
+                mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+                embeddings = pooled.cpu().numpy()
+        return probabilities, embeddings
+    
+    def score_texts(self, model_name, texts):
+        """バッチ推論（batch_size 件ずつ）の口コミスコア（P(pos) * 2 - P(neg) * 2）と所要時間（秒）"""
+        spec = MODEL_SPECS[model_name]
+        scores = []
+        start = time.perf_counter()
+        for batch_start in range(0, len(texts), spec.batch_size):
+            probabilities, _ = self.infer_batch(model_name, texts[batch_start:batch_start + spec.batch_size])
+            for row in probabilities:
+                sentiment = sentiment_from_probabilities(row, spec.labels)
+                scores.append(sentiment['positive'] * 2 - sentiment['negative'] * 2)
+        return np.asarray(scores), time.perf_counter() - start
+    
+    def apply_precision(self, model_name):
+        """設定の推論精度を適用し、校正用テキストで fp32 とのスコア差をログに出す
+
+        デバイスが対応していない・校正や推論に失敗した・スコア差が PRECISION_MAX_SCORE_DELTA を超えた場合は fp32 に戻す。
+        """
+        spec = MODEL_SPECS[model_name]
+        display_name = MODELS[model_name]
+        status = self.model_status[display_name]
+        model = self.models[model_name]
+        device = next(model.parameters()).device.type
+        requested = MODEL_PRECISION or spec.precision
+        self.precisions[model_name] = 'fp32'
+        
+        if requested == 'fp32':
+            status['precision'] = {'requested': requested, 'active': 'fp32'}
+            return
+        if not PRECISION_SUPPORT.get(device, {}).get(requested):
+            print(f"💡 {display_name}: {device} は {requested} 非対応のため fp32 で推論します")
+            status['precision'] = {'requested': requested, 'active': 'fp32', 'fallback': 'unsupported'}
+            return
+        
+        # 校正の失敗（校正用ファイルの読み込み・fp32 の推論）は読み込み済みのモデルを fp32 のまま使う
+        try:
+            texts = load_calibration_texts()
+            # 速度比の計測に初回のオーバーヘッドを含めないよう、それぞれ1バッチ流してから計測
+            self.score_texts(model_name, texts[:spec.batch_size])
+            reference, fp32_seconds = self.score_texts(model_name, texts)
+        except Exception as e:
+            print(f"⚠️ {display_name}: 校正に失敗したため fp32 で推論します: {e}")
+            status['precision'] = {'requested': requested, 'active': 'fp32', 'fallback': f'calibration: {e}'}
+            return
+        try:
+            if requested == 'fp16':
+                model.half()  # 行列演算の累積は fp32（oneDNN / cuBLAS）
+            self.precisions[model_name] = requested
+            self.score_texts(model_name, texts[:spec.batch_size])
+            scores, seconds = self.score_texts(model_name, texts)
+        except Exception as e:
+            print(f"⚠️ {display_name}: {requested} 推論に失敗したため fp32 に戻します: {e}")
+            model.float()
+            self.precisions[model_name] = 'fp32'
+            status['precision'] = {'requested': requested, 'active': 'fp32', 'fallback': str(e)}
+            return
+        
+        deltas = np.abs(scores - reference)
+        calibration = {
+            'requested': requested,
+            'active': requested,
+            'calibration_texts': len(texts),
+            'mean_abs_delta': round(float(deltas.mean()), 5),
+            'max_abs_delta': round(float(deltas.max()), 5),
+            'speedup': round(fp32_seconds / seconds, 2) if seconds > 0 else None
+        }
+        print(f"🎯 {display_name}: {requested} の fp32 とのスコア差 平均={calibration['mean_abs_delta']:.4f} "
+              f"最大={calibration['max_abs_delta']:.4f}（{len(texts)}件）, 速度 x{calibration['speedup']}")
+        if calibration['max_abs_delta'] > PRECISION_MAX_SCORE_DELTA:
+            print(f"⚠️ {display_name}: スコア差が許容値 {PRECISION_MAX_SCORE_DELTA} を超えたため fp32 に戻します")
+            model.float()
+            self.precisions[model_name] = 'fp32'
+            calibration.update({'active': 'fp32', 'fallback': 'score_delta'})
+        status['precision'] = calibration
+    
+    def warm_up(self, seq_lengths=(16, 64, 128, 512)):
+        """合成バッチを各系列長で流し、初回のトークナイザー初期化・メモリ確保・スレッドプール起動を済ませる
+
+        バッチサイズはモデル設定の batch_size、系列長はモデル設定の max_length まで。
+        """
+        try:
+            self.ensure_loaded()
+            self._warm_up_models(seq_lengths)
+        except Exception as e:
+            print(f"❌ ウォームアップ処理の失敗: {e}")
+            self.mark_unfinished_failed(str(e))
+        finally:
+            self.warmup_finished = True
+    
+    def _warm_up_models(self, seq_lengths):
+        sample_text = '先生がとても親切で、待ち時間も短く安心して任せられる動物病院でした。'
+        
+        for model_name, display_name in MODELS.items():
+            status = self.model_status[display_name]
+            if model_name not in self.models:
+                continue
+            spec = MODEL_SPECS[model_name]
+            batch_size = spec.batch_size
+            
+            status['state'] = 'warming'
+            tokenizer = self.tokenizers[model_name]
+            model = self.models[model_name]
+            device = next(model.parameters()).device
+            warmup_start = time.perf_counter()
+            throughput = {}
+            
+            try:
+                for seq_len in [length for length in seq_lengths if length <= spec.max_length]:
+                    texts = [sample_text * (seq_len // len(sample_text) + 1)] * batch_size
+                    inputs = tokenizer(
+                        texts,
+                        return_tensors="pt",
+                        truncation=True,
+                        padding='max_length',
+                        max_length=seq_len
+                    )
+                    inputs = {k: v.to(device) for k, v in inputs.items()}
+                    with torch.no_grad(), self.precision_context(model_name):
+                        model(**inputs)  # 初回（コールド）
+                        batch_start = time.perf_counter()
+                        model(**inputs)  # 計測（ウォーム）
+                        batch_seconds = time.perf_counter() - batch_start
+                    throughput[str(seq_len)] = {
+                        'batch_ms': round(batch_seconds * 1000, 1),
+                        'texts_per_second': round(batch_size / batch_seconds, 1)
+                    }
+            except Exception as e:
+                print(f"⚠️ {display_name} のウォームアップ失敗: {e}")
+                status.update({'state': 'failed', 'warmup_error': str(e)})
+                continue
+            
+            status.update({
+                'state': 'ready',
+                'warmup_ms': round((time.perf_counter() - warmup_start) * 1000, 1),
+                'batch_size': batch_size,
+                'throughput': throughput
+            })
+            print(f"🔥 {display_name} ウォームアップ完了: {status['warmup_ms']:.0f}ms")
+    
+    def is_ready(self):
+        """全モデルが読み込み・ウォームアップ済み（またはモックで応答可能）か
+
+        読み込み・ウォームアップに失敗したモデル（failed）は推論も失敗する可能性が高いため準備未完了とする。
+        読み込みに失敗してモックに切り替えたモデル（mock、error に理由）は応答できるため準備完了に含める。
+        """
+        return self.warmup_finished and all(
+            status['state'] in ('ready', 'mock') for status in self.model_status.values()
+        )
     
     def preprocess_text(self, text):
         """テキストの前処理"""
@@ -133,62 +450,39 @@ class FullBertSentimentAnalyzer:
         
         return text
     
-    def analyze_sentiment_real(self, text, model_name):
-        """実際のBERTモデルで感情分析"""
+    def analyze_sentiment_real(self, text, model_name, return_embedding=False):
+        """実際のBERTモデルで感情分析（return_embedding: 同じ推論の最終隠れ層の平均プーリングも返す）"""
         try:
             if model_name not in self.models:
-                return self.analyze_sentiment_mock(text, model_name)
-            
-            tokenizer = self.tokenizers[model_name]
-            model = self.models[model_name]
-            
-            # テキストをトークン化
-            inputs = tokenizer(
-                text, 
-                return_tensors="pt", 
-                truncation=True, 
-                padding=True, 
-                max_length=512
-            )
-            
-            # GPU利用可能な場合
-            if torch.cuda.is_available() and next(model.parameters()).is_cuda:
-                inputs = {k: v.cuda() for k, v in inputs.items()}
-            
-            # 推論実行
-            with torch.no_grad():
-                outputs = model(**inputs)
-                predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
-            
-            # CPUに移動して numpy変換
-            predictions = predictions.cpu().numpy()[0]
+                return self.analyze_sentiment_mock(text, model_name, return_embedding)
             
-            # 2クラス分類の場合（negative, positive）
-            if len(predictions) == 2:
-                return {
-                    'negative': float(predictions[0]),
-                    'positive': float(predictions[1])
-                }
-            # 3クラス分類の場合（negative, neutral, positive）
-            elif len(predictions) == 3:
-                return {
-                    'negative': float(predictions[0]),
-                    'neutral': float(predictions[1]),
-                    'positive': float(predictions[2])
-                }
-            else:
-                # 予期しないクラス数の場合
-                return {'positive': 0.5, 'negative': 0.5}
+            probabilities, embeddings = self.infer_batch(model_name, [text], return_embedding)
+            # 出力クラスの順番はモデル設定の labels（例: negative, neutral, positive）
+            result = sentiment_from_probabilities(probabilities[0], MODEL_SPECS[model_name].labels)
+            if return_embedding:
+                result['embedding'] = embeddings[0]
+            return result
                 
         except Exception as e:
             print(f"実BERT分析エラー ({model_name}): {str(e)}")
-            return self.analyze_sentiment_mock(text, model_name)
+            return self.analyze_sentiment_mock(text, model_name, return_embedding)
+    
+    def mock_embedding(self, text):
+        """フォールバック用の埋め込み（文字2-gramのハッシュ特徴、プロセス間で再現可能）"""
+        vector = np.zeros(MOCK_EMBEDDING_DIM, dtype=np.float32)
+        for i in range(max(len(text) - 1, 1)):
+            digest = hashlib.md5(text[i:i + 2].encode('utf-8')).digest()
+            vector[int.from_bytes(digest[:4], 'little') % MOCK_EMBEDDING_DIM] += 1.0
+        return vector
     
-    def analyze_sentiment_mock(self, text, model_name):
+    def analyze_sentiment_mock(self, text, model_name, return_embedding=False):
         """フォールバック用モック分析"""
         processed_text = self.preprocess_text(text)
         if not processed_text:
-            return {'positive': 0.5, 'negative': 0.5}
+            result = {'positive': 0.5, 'negative': 0.5}
+            if return_embedding:
+                result['embedding'] = None
+            return result
         
         # ポジティブ/ネガティブキーワード検出
         positive_words = ['良い', 'よい', '親切', '丁寧', '安心', '素晴らしい', '優しい', '清潔', '的確', '頼り']
@@ -197,14 +491,9 @@ class FullBertSentimentAnalyzer:
         positive_count = sum(1 for word in positive_words if word in processed_text)
         negative_count = sum(1 for word in negative_words if word in processed_text)
         
-        # モデルごとに異なる特性を持たせる
-        model_variants = {
-            'cl-tohoku/bert-base-japanese-whole-word-masking': 0.0,
-            'llm-book/bert-base-japanese-v3': 0.1, 
-            'Mizuiro-sakura/luke-japanese-base-finetuned-vet': -0.05
-        }
-        
-        variant = model_variants.get(model_name, 0.0)
+        # モデルごとに異なる特性を持たせる（モデル設定の mock_bias）
+        spec = MODEL_SPECS.get(model_name)
+        variant = spec.mock_bias if spec is not None else 0.0
         
         # 基本スコア計算
         base_positive = 0.4 + (positive_count * 0.15) - (negative_count * 0.1) + variant
@@ -226,50 +515,161 @@ class FullBertSentimentAnalyzer:
         positive_prob = max(0.0, min(1.0, positive_prob + noise))
         negative_prob = 1.0 - positive_prob
         
-        return {
+        result = {
             'positive': positive_prob,
             'negative': negative_prob
         }
+        if return_embedding:
+            result['embedding'] = self.mock_embedding(processed_text)
+        return result
     
-    def analyze_sentiment(self, text, model_name):
-        """感情分析（実BERT優先、失敗時モック）"""
+    def analyze_sentiment(self, text, model_name, return_embedding=False):
+        """感情分析（実BERT優先、失敗時モック）。return_embedding で埋め込みも返す"""
         processed_text = self.preprocess_text(text)
         if not processed_text:
-            return {'positive': 0.5, 'negative': 0.5}
+            result = {'positive': 0.5, 'negative': 0.5}
+            if return_embedding:
+                result['embedding'] = None
+            return result
         
+        self.ensure_loaded()
         if BERT_AVAILABLE and model_name in self.models:
-            return self.analyze_sentiment_real(processed_text, model_name)
+            return self.analyze_sentiment_real(processed_text, model_name, return_embedding)
         else:
-            return self.analyze_sentiment_mock(processed_text, model_name)
+            return self.analyze_sentiment_mock(processed_text, model_name, return_embedding)
+
+    def analyze_batch(self, texts, model_name, return_embedding=False):
+        """複数件の感情分析（analyze_sentiment と同じ形式のリスト）。実BERTでは空でない口コミを1回のバッチ推論で計算
 
-# グローバルアナライザーインスタンス（フルBERT版）
+        バッチの推論に失敗した場合は、そのバッチだけモック分析にフォールバックする。
+        """
+        processed = [self.preprocess_text(text) for text in texts]
+        results = [None] * len(processed)
+        rows = []
+        for i, text in enumerate(processed):
+            if text:
+                rows.append(i)
+            else:
+                results[i] = {'positive': 0.5, 'negative': 0.5}
+                if return_embedding:
+                    results[i]['embedding'] = None
+        if not rows:
+            return results
+        
+        self.ensure_loaded()
+        if BERT_AVAILABLE and model_name in self.models:
+            labels = MODEL_SPECS[model_name].labels
+            try:
+                probabilities, embeddings = self.infer_batch(model_name, [processed[i] for i in rows], return_embedding)
+                for j, i in enumerate(rows):
+                    results[i] = sentiment_from_probabilities(probabilities[j], labels)
+                    if return_embedding:
+                        results[i]['embedding'] = embeddings[j]
+                return results
+            except Exception as e:
+                print(f"実BERT分析エラー ({model_name}, {len(rows)}件のバッチ): {str(e)}")
+        for i in rows:
+            results[i] = self.analyze_sentiment_mock(processed[i], model_name, return_embedding)
+        return results
+
+# グローバルアナライザーインスタンス（フルBERT版、モデルは初回使用時に読み込み）
 analyzer = FullBertSentimentAnalyzer()
+_warmup_thread = None
+
+def start_model_warmup():
+    """モデル読み込みとウォームアップをバックグラウンドで開始（一度だけ）"""
+    global _warmup_thread
+    
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=analyzer.warm_up, daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
+
+def dataset_content_key(data):
+    """入力3列（hospital_id, review_text, star_rating）の内容から計算するキー"""
+    hashed = pd.util.hash_pandas_object(
+        data[['hospital_id', 'review_text', 'star_rating']], index=False
+    )
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+def embedding_path(model_name, dataset_key, embeddings_dir=None):
+    """モデル・データセットごとの埋め込みファイル（float16 の .npy）"""
+    safe_name = re.sub(r'[^0-9A-Za-z_.-]', '_', model_name)
+    return os.path.join(embeddings_dir or EMBEDDINGS_DIR, f'{safe_name}.{dataset_key[:16]}.npy')
+
+def load_embeddings(model_name, dataset_key, embeddings_dir=None):
+    """保存済みの埋め込みを読み取り専用memmapで開く（未作成なら None）"""
+    path = embedding_path(model_name, dataset_key, embeddings_dir)
+    return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+def prune_embeddings(model_name, embeddings_dir=None, keep=None):
+    """モデルごとに新しい順で keep データセット分だけ埋め込みファイルを残す
 
-def calculate_scores(data):
-    """全モデルでの感情分析とスコア計算"""
+    開いているメモリマップは削除後もそのまま読める（POSIX）。
+    """
+    keep = EMBEDDINGS_KEEP_DATASETS if keep is None else keep
+    directory = embeddings_dir or EMBEDDINGS_DIR
+    safe_name = re.sub(r'[^0-9A-Za-z_.-]', '_', model_name)
+    pattern = re.compile(re.escape(safe_name) + r'\.[0-9a-f]{16}\.npy$')
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if pattern.match(name)]
+    except FileNotFoundError:
+        return
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def calculate_scores(data, collect_embeddings=False, embeddings_dir=None):
+    """全モデルでの感情分析とスコア計算
+
+    collect_embeddings=True の場合、同じ推論の埋め込みを embedding_path(model_name, データセットのキー) に保存する
+    （追加の推論なし。load_embeddings で読み取り専用memmapとして開く）。
+    """
     results = {}
+    dataset_key = dataset_content_key(data) if collect_embeddings else None
     
     for model_name, display_name in MODELS.items():
         print(f"モデル {display_name} での分析開始...")
         
+        store = (EmbeddingStore(embedding_path(model_name, dataset_key, embeddings_dir), len(data))
+                 if collect_embeddings else None)
         model_scores = []
-        for idx, row in data.iterrows():
-            sentiment = analyzer.analyze_sentiment(row['review_text'], model_name)
-            if sentiment:
-                # 口コミスコア計算: (P(pos) * 2) - (P(neg) * 2)
-                review_score = (sentiment['positive'] * 2) - (sentiment['negative'] * 2)
-                model_scores.append(review_score)
-                # デバッグ：最初の3件の分析結果を出力
-                if idx < 3:
-                    print(f"  サンプル {idx}: text='{row['review_text'][:30]}...', pos={sentiment['positive']:.3f}, neg={sentiment['negative']:.3f}, score={review_score:.3f}")
-            else:
-                model_scores.append(0.0)
-                if idx < 3:
-                    print(f"  サンプル {idx}: 感情分析失敗")
+        texts = data['review_text'].tolist()
+        # モデル設定の batch_size 件ずつバッチ推論（校正・ウォームアップと同じ infer_batch）
+        batch_size = MODEL_SPECS[model_name].batch_size
+        try:
+            for batch_start in range(0, len(texts), batch_size):
+                batch = texts[batch_start:batch_start + batch_size]
+                sentiments = analyzer.analyze_batch(batch, model_name, return_embedding=collect_embeddings)
+                for pos, sentiment in enumerate(sentiments, start=batch_start):
+                    if store is not None and sentiment and sentiment.get('embedding') is not None:
+                        store.write(pos, sentiment['embedding'])
+                    if sentiment:
+                        # 口コミスコア計算: (P(pos) * 2) - (P(neg) * 2)
+                        review_score = (sentiment['positive'] * 2) - (sentiment['negative'] * 2)
+                        model_scores.append(review_score)
+                        # デバッグ：最初の3件の分析結果を出力
+                        if pos < 3:
+                            print(f"  サンプル {pos}: text='{str(texts[pos])[:30]}...', pos={sentiment['positive']:.3f}, neg={sentiment['negative']:.3f}, score={review_score:.3f}")
+                    else:
+                        model_scores.append(0.0)
+                        if pos < 3:
+                            print(f"  サンプル {pos}: 感情分析失敗")
+        except BaseException:
+            # 書きかけの一時ファイルを残さない
+            if store is not None:
+                store.discard()
+            raise
         
         print(f"  {display_name} スコア範囲: min={min(model_scores):.3f}, max={max(model_scores):.3f}, avg={sum(model_scores)/len(model_scores):.3f}")
         
         data[f'{display_name}_score'] = model_scores
+        if store is not None:
+            store.close()
+            prune_embeddings(model_name, embeddings_dir)
         print(f"モデル {display_name} の分析完了")
     
     # 星評価スコア正規化: (1-5) → (-2 to +2)
@@ -301,6 +701,23 @@ def aggregate_by_hospital(data):
 def index():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    """死活確認（プロセスが応答できれば200）"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """準備完了確認（モデルの読み込み・ウォームアップ完了まで503）"""
+    start_model_warmup()
+    ready = analyzer.is_ready()
+    return jsonify({
+        'ready': ready,
+        'bert_available': BERT_AVAILABLE,
+        'precision_support': PRECISION_SUPPORT,
+        'models': analyzer.model_status
+    }), 200 if ready else 503
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     global uploaded_data
@@ -310,53 +727,224 @@ def upload_file():
         if file.filename == '':
             return jsonify({'error': 'ファイルが選択されていません'}), 400
         
-        if file and file.filename.endswith('.csv'):
-            # CSVファイルを読み込み
-            content = file.read()
-            
-            # エンコーディングを自動検出して読み込み
-            try:
-                df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-            except UnicodeDecodeError:
-                try:
-                    df = pd.read_csv(io.StringIO(content.decode('shift_jis')))
-                except UnicodeDecodeError:
-                    df = pd.read_csv(io.StringIO(content.decode('cp932')))
-            
-            # 必要な列の確認
-            required_columns = ['hospital_id', 'review_text', 'star_rating']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            
-            if missing_columns:
-                return jsonify({
-                    'error': f'必要な列が不足しています: {", ".join(missing_columns)}',
-                    'required_columns': required_columns,
-                    'found_columns': df.columns.tolist()
-                }), 400
-            
-            # データの基本チェック
-            if len(df) == 0:
-                return jsonify({'error': 'データが空です'}), 400
-            
-            if len(df) > 10000:
-                return jsonify({'error': '一度に処理できるデータは10,000件までです'}), 400
-            
-            uploaded_data = df
-            
+        # CSV / gzip CSV / Parquet / Arrow IPC / NDJSON を必要な列だけ読み込み、星評価を検証
+        try:
+            df = read_reviews(file.filename, file.read(), max_rows=UPLOAD_MAX_ROWS)
+        except MissingColumnsError as e:
             return jsonify({
-                'message': 'ファイルが正常にアップロードされました',
-                'rows': len(df),
-                'columns': df.columns.tolist(),
-                'sample_data': df.head(3).to_dict('records')
-            })
+                'error': str(e),
+                'required_columns': REQUIRED_COLUMNS,
+                'found_columns': e.found
+            }), 400
+        except UploadFormatError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # データの基本チェック
+        if len(df) == 0:
+            return jsonify({'error': 'データが空です'}), 400
         
-        return jsonify({'error': 'CSVファイルを選択してください'}), 400
+        uploaded_data = df
+        
+        return jsonify({
+            'message': 'ファイルが正常にアップロードされました',
+            'rows': len(df),
+            'columns': df.columns.tolist(),
+            'sample_data': df.head(3).to_dict('records')
+        })
         
     except Exception as e:
         logger.error(f"ファイルアップロードエラー: {str(e)}")
         return jsonify({'error': f'ファイル処理中にエラーが発生しました: {str(e)}'}), 500
 
+def build_embedding_results(data):
+    """埋め込み付きでスコア計算し、モデルごとの近傍検索インデックスを作成"""
+    scored_data = calculate_scores(data.reset_index(drop=True).copy(), collect_embeddings=True)
+    dataset_key = dataset_content_key(data)
+    indexes = {}
+    for model_name, display_name in MODELS.items():
+        matrix = load_embeddings(model_name, dataset_key)
+        if matrix is not None and len(matrix) == len(scored_data):
+            indexes[display_name] = EmbeddingIndex(matrix)
+    return {'scored_data': scored_data, 'indexes': indexes}
+
+def get_embedding_index(display_name):
+    """(インデックス, エラーレスポンス) を返す"""
+    if embedding_results is None:
+        return None, (jsonify({'error': '埋め込みが作成されていません。先に /embeddings を実行してください'}), 400)
+    index = embedding_results['indexes'].get(display_name)
+    if index is None:
+        return None, (jsonify({'error': f'モデルの埋め込みが見つかりません: {display_name}'}), 404)
+    return index, None
+
+def review_summary(scored_data, row, similarity=None):
+    record = scored_data.iloc[row]
+    summary = {
+        'row': int(row),
+        'hospital_id': record['hospital_id'],
+        'review_text': record['review_text'],
+        'star_rating': record['star_rating'],
+        'scores': {display_name: float(record[f'{display_name}_score']) for display_name in MODELS.values()}
+    }
+    if similarity is not None:
+        summary['similarity'] = float(similarity)
+    return summary
+
+@app.route('/embeddings', methods=['POST'])
+def build_embeddings():
+    """アップロード済みデータをスコア計算し、同じ推論の埋め込みを保存して索引を作成"""
+    global embedding_results
+    
+    if uploaded_data is None:
+        return jsonify({'error': 'データがアップロードされていません'}), 400
+    
+    # 3モデルの推論を行うため受付制御を通す（混雑時は待ち、上限を超えたら429）
+    try:
+        ticket = admission.submit(client_id_from_request(request), estimate_cost(
+            len(uploaded_data), int(uploaded_data['review_text'].astype(str).str.len().sum()), len(MODELS)
+        ))
+        ticket.wait()
+    except AdmissionRejected as e:
+        response = jsonify({
+            'error': f'サーバーが混雑しています（{str(e)}）。{e.retry_after}秒後に再試行してください',
+            'retry_after': e.retry_after
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    
+    try:
+        start = time.perf_counter()
+        with ticket:
+            embedding_results = build_embedding_results(uploaded_data)
+        return jsonify(convert_numpy_types({
+            'success': True,
+            'rows': len(embedding_results['scored_data']),
+            'seconds': round(time.perf_counter() - start, 2),
+            'models': {
+                display_name: {'dim': index.matrix.shape[1], 'path': index.matrix.filename}
+                for display_name, index in embedding_results['indexes'].items()
+            }
+        }))
+    except Exception as e:
+        logger.error(f"埋め込み作成エラー: {str(e)}")
+        return jsonify({'error': f'埋め込み作成エラー: {str(e)}'}), 500
+
+@app.route('/admission')
+def admission_status():
+    """受付制御の状態（実行中・待ち行列・処理速度の見積もり）"""
+    return jsonify(convert_numpy_types(admission.status()))
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """保存済みのプロファイル一覧（新しい順、X-Profile-Token が必要）"""
+    if not admin_authorized(request.environ):
+        return jsonify({'error': 'プロファイルの取得には正しい X-Profile-Token が必要です'}), 403
+    return jsonify({'profiles': profiles.summaries()})
+
+@app.route('/admin/profiles/<profile_id>')
+@app.route('/admin/profiles/<profile_id>/<report>')
+def get_profile(profile_id, report=None):
+    """プロファイル1件（report: collapsed = フレームグラフ用、allocations = メモリ確保の上位、functions = 関数ごとの集計）"""
+    if not admin_authorized(request.environ):
+        return jsonify({'error': 'プロファイルの取得には正しい X-Profile-Token が必要です'}), 403
+    
+    entry = profiles.get(profile_id)
+    if entry is None:
+        return jsonify({'error': f'プロファイル {profile_id} が見つかりません'}), 404
+    if report is None:
+        return jsonify(entry)
+    if report not in ('collapsed', 'allocations', 'functions'):
+        return jsonify({'error': 'report は collapsed / allocations / functions のいずれかです'}), 404
+    
+    response = Response(entry[report], mimetype='text/plain')
+    if report == 'collapsed':
+        response.headers['Content-Disposition'] = f'attachment; filename=profile_{profile_id}.collapsed.txt'
+    return response
+
+@app.route('/similar_reviews')
+def similar_reviews():
+    """指定した口コミに意味的に近い口コミ（コサイン類似度）
+
+    クエリ: row（口コミの行番号）, k, model（表示名）, mode（exact / approx）, nprobe
+    """
+    display_name = request.args.get('model', next(iter(MODELS.values())))
+    index, error = get_embedding_index(display_name)
+    if error:
+        return error
+    
+    try:
+        row = int(request.args['row'])
+        k = int(request.args.get('k', 10))
+        nprobe = int(request.args.get('nprobe', 8))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'row（整数）を指定してください'}), 400
+    mode = request.args.get('mode', 'exact')
+    if mode not in ('exact', 'approx'):
+        return jsonify({'error': 'mode は exact または approx を指定してください'}), 400
+    
+    scored_data = embedding_results['scored_data']
+    if not 0 <= row < len(scored_data):
+        return jsonify({'error': f'行番号が範囲外です: {row}'}), 404
+    
+    start = time.perf_counter()
+    rows, similarities = index.search(index.vector(row), k=k, mode=mode, nprobe=nprobe, exclude=row)
+    return jsonify(convert_numpy_types({
+        'success': True,
+        'model': display_name,
+        'mode': mode,
+        'search_ms': round((time.perf_counter() - start) * 1000, 2),
+        'query': review_summary(scored_data, row),
+        'similar': [review_summary(scored_data, r, sim) for r, sim in zip(rows, similarities)]
+    }))
+
+@app.route('/hospital_topics/<hospital_id>')
+def hospital_topics(hospital_id):
+    """1病院の口コミを埋め込みでクラスタリングし、トピックごとの代表口コミとスコアを返す
+
+    クエリ: k（トピック数）, model（表示名）, examples（代表口コミの件数）
+    """
+    display_name = request.args.get('model', next(iter(MODELS.values())))
+    index, error = get_embedding_index(display_name)
+    if error:
+        return error
+    
+    try:
+        k = int(request.args.get('k', 5))
+        examples = int(request.args.get('examples', 3))
+    except ValueError:
+        return jsonify({'error': 'k と examples は整数で指定してください'}), 400
+    
+    scored_data = embedding_results['scored_data']
+    rows = np.flatnonzero(scored_data['hospital_id'].astype(str).to_numpy() == str(hospital_id))
+    if len(rows) == 0:
+        return jsonify({'error': f'病院が見つかりません: {hospital_id}'}), 404
+    
+    topics = []
+    for members, similarities in index.cluster(rows, k=k):
+        members_data = scored_data.iloc[members]
+        topics.append({
+            'size': len(members),
+            'mean_star_score': float(members_data['star_score'].mean()),
+            'mean_scores': {
+                name: float(members_data[f'{name}_score'].mean()) for name in MODELS.values()
+            },
+            # 重心に近い順
+            'examples': [review_summary(scored_data, r, sim)
+                         for r, sim in zip(members[:examples], similarities[:examples])]
+        })
+    
+    return jsonify(convert_numpy_types({
+        'success': True,
+        'hospital_id': hospital_id,
+        'model': display_name,
+        'review_count': len(rows),
+        'topics': topics
+    }))
+
 if __name__ == '__main__':
+    # 開発サーバーでは起動時にモデルを読み込み、ウォームアップはバックグラウンドで行う
+    analyzer.ensure_loaded()
+    start_model_warmup()
+    
     # 実行環境の確認
     print("🔍 実行環境チェック:")
     print(f"  - BERT ライブラリ: {'✅ 利用可能' if BERT_AVAILABLE else '❌ 未インストール'}")
@@ -1,20 +1,28 @@
 import os
 import pandas as pd
 import numpy as np
-from flask import Flask, render_template, request, jsonify, send_file
-import plotly
-import plotly.graph_objs as go
-import plotly.express as px
-from sklearn.metrics import mean_absolute_error
-from scipy.stats import pearsonr
-from scipy import stats
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 import json
 import re
 import io
-import base64
 from werkzeug.utils import secure_filename
 import random
 import logging
+import hashlib
+import unicodedata
+import math
+import sys
+import types
+import threading
+import time
+from collections import OrderedDict, deque
+from near_duplicates import cluster_near_duplicates, cluster_report
+from static_assets import AssetStore, compress_html_response
+from admission import AdmissionController, AdmissionRejected, client_id_from_request, estimate_cost
+from model_registry import load_model_registry, models_dict
+from top_reviews import KINDS as TOP_REVIEW_KINDS, HospitalTopReviews
+from upload_formats import REQUIRED_COLUMNS, MissingColumnsError, UploadFormatError, read_reviews
+from request_profiler import ProfileStore, ProfilingMiddleware, admin_authorized
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -22,10 +30,38 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# 静的ファイル: デプロイ時にビルドした内容ハッシュ付きの名前と gzip / brotli 版を /assets/ から長期キャッシュで配信
+# （マニフェストは初回の使用時に読み込む。バッチ・シャードのワーカーが import しても何もしない）
+assets = AssetStore()
+
+@app.template_global()
+def asset_url(filename):
+    """テンプレート用: 内容ハッシュ付きのURL（ビルドに無いファイルは通常の /static/）"""
+    from flask import url_for
+    hashed = assets.hashed_path(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=hashed)
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    response = assets.response(filename, request)
+    if response is None:
+        return jsonify({'error': 'ファイルが見つかりません'}), 404
+    return response
+
+@app.after_request
+def compress_html(response):
+    return compress_html_response(response, request)
+
+# リクエスト単位のプロファイリング（PROFILE_TOKEN 設定時、X-Profile-Token 付きのリクエストだけを計測）
+profiles = ProfileStore()
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profiles)
+
 def convert_numpy_types(obj):
     """numpy型をPythonネイティブ型に変換"""
     if isinstance(obj, dict):
-        return {key: convert_numpy_types(value) for key, value in obj.items()}
+        return {convert_numpy_types(key): convert_numpy_types(value) for key, value in obj.items()}
     elif isinstance(obj, list):
         return [convert_numpy_types(item) for item in obj]
     elif isinstance(obj, np.integer):
@@ -38,18 +74,114 @@ def convert_numpy_types(obj):
         return bool(obj)
     else:
         return obj
+
+def mean_absolute_error(y_true, y_pred):
+    """平均絶対誤差（sklearn.metrics と同じ値、sklearn を読み込まないためにnumpyで計算）"""
+    return float(np.mean(np.abs(np.asarray(y_true, dtype=float) - np.asarray(y_pred, dtype=float))))
+
+# チャート・統計ライブラリ（plotly, scipy）は起動を速くするため初回使用時に読み込む
+LAZY_IMPORTS = ['scipy.stats', 'plotly', 'plotly.graph_objs', 'plotly.utils']
+
+warmup_status = {'state': 'pending', 'imports_ms': {}}
+_warmup_thread = None
+
+def warm_up_imports():
+    """遅延読み込みのライブラリを先に読み込んでおく（ワーカー起動後のウォームアップ用）"""
+    import importlib
+    import time
+    
+    warmup_status['state'] = 'warming'
+    state = 'failed'
+    try:
+        for name in LAZY_IMPORTS:
+            start = time.perf_counter()
+            importlib.import_module(name)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            warmup_status['imports_ms'][name] = round(elapsed_ms, 1)
+            logger.info(f"ウォームアップ: {name} ({elapsed_ms:.0f}ms)")
+        state = 'ready'
+    except Exception as e:
+        warmup_status['error'] = f'{name}: {str(e)}'
+        logger.error(f"ウォームアップ失敗: {name}: {e}")
+    finally:
+        # 失敗した場合も 'warming' のまま残さない（failed は準備未完了として /readyz が503を返す）
+        warmup_status['state'] = state
+
+def start_import_warmup():
+    """リクエスト受付を止めずにバックグラウンドでウォームアップ（一度だけ）"""
+    global _warmup_thread
+    
+    if _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=warm_up_imports, daemon=True)
+        _warmup_thread.start()
+    return _warmup_thread
+
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# アップロードできる行数の上限（gzip の展開後サイズの上限は upload_formats.MAX_DECOMPRESSED_BYTES）
+UPLOAD_MAX_ROWS = int(os.environ.get('UPLOAD_MAX_ROWS', 100000))
+
+# この件数以上の相関係数ブートストラップはプロセスプールで並列実行
+PARALLEL_BOOTSTRAP_MIN_ROWS = int(os.environ.get('PARALLEL_BOOTSTRAP_MIN_ROWS', 50000))
+
+# ブートストラップ設定（リクエストの 'bootstrap' で上書き可能）
+# mode: fixed（常に n_bootstrap 回）/ adaptive（ブロックごとに収束判定して打ち切り）
+# fisher_z_min_rows: この件数以上の相関係数CIはFisher z変換の解析解（0で無効）
+BOOTSTRAP_DEFAULTS = {
+    'n_bootstrap': 10000,
+    'mode': os.environ.get('BOOTSTRAP_MODE', 'fixed'),
+    'tolerance': float(os.environ.get('BOOTSTRAP_TOLERANCE', 0.002)),
+    'block_size': 1000,
+    'min_replicates': 2000,
+    'fisher_z_min_rows': int(os.environ.get('FISHER_Z_MIN_ROWS', 0)),
+    # resampling: review（口コミを独立に復元抽出）/ cluster（病院単位で復元抽出）
+    'resampling': os.environ.get('BOOTSTRAP_RESAMPLING', 'review')
+}
+# リクエストで上書きできる値: 選択肢のある設定と、数値設定の範囲（最小, 最大。範囲外は丸める）
+BOOTSTRAP_CHOICES = {
+    'mode': ('fixed', 'adaptive'),
+    'resampling': ('review', 'cluster')
+}
+BOOTSTRAP_LIMITS = {
+    'n_bootstrap': (100, int(os.environ.get('BOOTSTRAP_MAX_ITERATIONS', 20000))),
+    'tolerance': (1e-4, 0.1),
+    'block_size': (100, 10000),
+    'min_replicates': (100, int(os.environ.get('BOOTSTRAP_MAX_ITERATIONS', 20000))),
+    'fisher_z_min_rows': (0, None)
+}
+
+# 近似重複口コミのクラスタリング（MinHash + LSH、推定Jaccard類似度が threshold 以上を同一クラスタ）
+# collapse: クラスタの代表1件だけをスコア計算し、同じクラスタの口コミには代表のスコアを使う
+#   （口コミ単位のスコアが変わるため既定は無効。有効時は /analyze の score_collapse にクラスタ数を返す）
+# verify_sample: /near_duplicates で代表以外の口コミを実際にスコア計算して確認する件数
+NEAR_DUPLICATE_SETTINGS = {
+    'collapse': os.environ.get('NEAR_DUPLICATE_COLLAPSE', '0') == '1',
+    'threshold': float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.9)),
+    'num_perm': 128,
+    'bands': 16,
+    'shingle_size': 3,
+    'verify_sample': int(os.environ.get('NEAR_DUPLICATE_VERIFY_SAMPLE', 20))
+}
+
+# 分析時に病院ごとに求めておく上位口コミの件数（これより大きい k は要求時に計算）と k の上限
+TOP_REVIEWS_K = int(os.environ.get('TOP_REVIEWS_K', 10))
+TOP_REVIEWS_MAX_K = 100
+
+# 分析結果キャッシュ（同じデータ・設定の再分析は保存済みのレスポンスを返す）
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 8))
+ANALYSIS_CACHE_MAX_BYTES = int(os.environ.get('ANALYSIS_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 3600))  # 秒
 
 # グローバル変数
 uploaded_data = None
 analysis_results = None
+prescore_job = None
+# 先行スコアリングの受付制御上のクライアント名と、分析開始時に停止を待つ秒数
+PRESCORE_CLIENT_ID = 'prescore'
+PRESCORE_HANDOVER_TIMEOUT = 5
 
-# 使用する3つのモデル
-MODELS = {
-    'koheiduck/bert-japanese-finetuned-sentiment': 'Model A (Koheiduck)',
-    'llm-book/bert-base-japanese-v2-finetuned-sentiment': 'Model B (LLM-book)', 
-    'Mizuiro-inc/bert-base-japanese-finetuned-sentiment-analysis': 'Model C (Mizuiro)'
-}
+# 使用するモデル（models.json の app プロファイル、MODEL_CONFIG で別の設定ファイルを指定可能）
+MODEL_SPECS = {spec.model_id: spec for spec in load_model_registry('app')}
+MODELS = models_dict(MODEL_SPECS.values())
 
 class SentimentAnalyzer:
     def __init__(self):
@@ -95,14 +227,9 @@ class SentimentAnalyzer:
             positive_count = sum(1 for word in positive_words if word in processed_text)
             negative_count = sum(1 for word in negative_words if word in processed_text)
             
-            # モデルごとに異なる特性を持たせる
-            model_variants = {
-                'koheiduck/bert-japanese-finetuned-sentiment': 0.0,
-                'llm-book/bert-base-japanese-v2-finetuned-sentiment': 0.1, 
-                'Mizuiro-inc/bert-base-japanese-finetuned-sentiment-analysis': -0.05
-            }
-            
-            variant = model_variants.get(model_name, 0.0)
+            # モデルごとに異なる特性を持たせる（モデル設定の mock_bias）
+            spec = MODEL_SPECS.get(model_name)
+            variant = spec.mock_bias if spec is not None else 0.0
             
             # 基本スコア計算
             base_positive = 0.4 + (positive_count * 0.15) - (negative_count * 0.1) + variant
@@ -136,34 +263,258 @@ class SentimentAnalyzer:
 # グローバルアナライザーインスタンス
 analyzer = SentimentAnalyzer()
 
-def calculate_scores(data):
-    """全モデルでの感情分析とスコア計算"""
-    results = {}
-    
-    for model_name, display_name in MODELS.items():
-        print(f"モデル {display_name} での分析開始...")
-        
-        model_scores = []
-        for idx, row in data.iterrows():
-            sentiment = analyzer.analyze_sentiment(row['review_text'], model_name)
-            if sentiment:
-                # 口コミスコア計算: (P(pos) * 2) - (P(neg) * 2)
-                review_score = (sentiment['positive'] * 2) - (sentiment['negative'] * 2)
-                model_scores.append(review_score)
-                # デバッグ：最初の3件の分析結果を出力
-                if idx < 3:
-                    print(f"  サンプル {idx}: text='{row['review_text'][:30]}...', pos={sentiment['positive']:.3f}, neg={sentiment['negative']:.3f}, score={review_score:.3f}")
+def score_review(text, model_name):
+    """1件の口コミスコアを計算: (P(pos) * 2) - (P(neg) * 2)"""
+    sentiment = analyzer.analyze_sentiment(text, model_name)
+    if not sentiment:
+        return None
+    return (sentiment['positive'] * 2) - (sentiment['negative'] * 2)
+
+def dataset_fingerprint(data):
+    """口コミテキスト列の内容からデータセットの指紋を計算"""
+    hashed = pd.util.hash_pandas_object(data['review_text'].astype(str), index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+class PrescoreJob:
+    """アップロード直後に開始する先行スコアリング（バックグラウンド）"""
+    def __init__(self, data):
+        self.fingerprint = dataset_fingerprint(data)
+        self.texts = data['review_text'].tolist()
+        # 未計算はNaN。/analyze 側と同じ配列を共有して重複計算を避ける
+        self.scores = {model_name: np.full(len(self.texts), np.nan) for model_name in MODELS}
+        # スコアを計算する行（collapse 時は近似重複クラスタの代表のみ。_run の中で決める）
+        self.rows = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _run(self):
+        # /analyze の score ステージと同じく、collapse 時は代表の口コミだけを計算する
+        try:
+            if NEAR_DUPLICATE_SETTINGS['collapse']:
+                rows = np.unique(near_duplicate_labels(self.texts))
+                print(f"先行スコアリング対象: 代表 {len(rows)}/{len(self.texts)}件")
             else:
-                model_scores.append(0.0)
-                if idx < 3:
-                    print(f"  サンプル {idx}: 感情分析失敗")
-        
-        print(f"  {display_name} スコア範囲: min={min(model_scores):.3f}, max={max(model_scores):.3f}, avg={sum(model_scores)/len(model_scores):.3f}")
-        
-        data[f'{display_name}_score'] = model_scores
-        print(f"モデル {display_name} の分析完了")
+                rows = np.arange(len(self.texts))
+        except Exception as e:
+            print(f"先行スコアリングエラー: {str(e)}")
+            return
+        if self.cancelled.is_set():
+            return
+        self.rows = rows
+        # 先行スコアリングも受付制御の予算を使う（全ジョブで1つのクライアント扱い。拒否されたら分析時に計算する）
+        try:
+            ticket = admission.submit(PRESCORE_CLIENT_ID, estimate_cost(
+                len(rows), sum(len(str(self.texts[i])) for i in rows), len(self.scores)
+            ))
+        except AdmissionRejected as e:
+            print(f"先行スコアリング見送り: {str(e)}")
+            return
+        steps = ticket.wait_steps(poll=1.0)
+        try:
+            for _ in steps:
+                if self.cancelled.is_set():
+                    print(f"先行スコアリング中断（待ち行列）: {self.fingerprint[:8]}")
+                    return
+        except AdmissionRejected as e:
+            print(f"先行スコアリング見送り: {str(e)}")
+            return
+        finally:
+            steps.close()
+        with ticket:
+            self._score_all()
+
+    def _score_all(self):
+        try:
+            for model_name, display_name in MODELS.items():
+                model_scores = self.scores[model_name]
+                for i in self.rows:
+                    if self.cancelled.is_set():
+                        print(f"先行スコアリング中断: {self.fingerprint[:8]}")
+                        return
+                    if np.isnan(model_scores[i]):
+                        review_score = score_review(self.texts[i], model_name)
+                        model_scores[i] = 0.0 if review_score is None else review_score
+                print(f"先行スコアリング完了: {display_name}")
+            self.done.set()
+        except Exception as e:
+            print(f"先行スコアリングエラー: {str(e)}")
+
+    def progress(self):
+        """計算対象の行のうち計算済みの割合（0-1、対象が決まる前は全行に対する割合）"""
+        rows = self.rows if self.rows is not None else np.arange(len(self.texts))
+        total = len(rows) * len(self.scores)
+        if total == 0:
+            return 1.0
+        computed = sum(int(np.count_nonzero(~np.isnan(s[rows]))) for s in self.scores.values())
+        return computed / total
+
+def start_prescoring(data):
+    """受理したデータセットの先行スコアリングを開始（前のジョブは中断）"""
+    global prescore_job
+    
+    if prescore_job is not None:
+        prescore_job.cancel()
+    prescore_job = PrescoreJob(data).start()
+    return prescore_job
+
+def hand_over_prescoring(data):
+    """分析を始めるデータセットの先行スコアリングを止めて受付予算を返す（計算済みのスコアは分析で再利用）"""
+    job = prescore_job
+    if job is None or job.done.is_set() or job.fingerprint != dataset_fingerprint(data):
+        return
+    job.cancel()
+    job.thread.join(timeout=PRESCORE_HANDOVER_TIMEOUT)
+
+def get_prescored(data):
+    """データセットが一致する場合のみ先行スコアを返す"""
+    job = prescore_job
+    if job is None or job.fingerprint != dataset_fingerprint(data):
+        return None
+    print(f"先行スコア再利用: 進捗 {job.progress() * 100:.1f}%")
+    return job.scores
+
+def dataset_content_key(data):
+    """入力3列（hospital_id, review_text, star_rating）の内容から計算するキー"""
+    hashed = pd.util.hash_pandas_object(
+        data[['hospital_id', 'review_text', 'star_rating']], index=False
+    )
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+def analysis_cache_key(data, settings):
+    """分析キャッシュのキー: 入力3列の内容 + モデル構成（順番を含む）+ 代表スコアの流用設定 + ブートストラップ設定"""
+    digest = hashlib.sha1(dataset_content_key(data).encode('utf-8'))
+    digest.update(json.dumps([spec.to_dict() for spec in MODEL_SPECS.values()], sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps(NEAR_DUPLICATE_SETTINGS, sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps(NEAR_DUPLICATE_SETTINGS, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def estimate_nbytes(obj, seen=None):
+    """オブジェクトがたどれる範囲で保持しているメモリの概算（配列・DataFrame・辞書・リスト・属性をたどる）
+
+    複数の場所から参照されているオブジェクトは1回だけ数える。
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(obj, pd.Categorical):
+        return int(obj.nbytes)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(key, seen) + estimate_nbytes(value, seen)
+                                        for key, value in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(item, seen) for item in obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None), np.generic)):
+        return sys.getsizeof(obj)
+    if hasattr(obj, '__dict__') and not isinstance(obj, (type, types.ModuleType, types.FunctionType,
+                                                          types.MethodType)):
+        return sys.getsizeof(obj) + estimate_nbytes(vars(obj), seen)
+    return sys.getsizeof(obj)
+
+class AnalysisCache:
+    """/analyze の結果キャッシュ（件数・概算サイズ・経過時間で破棄）"""
+    def __init__(self, max_entries=ANALYSIS_CACHE_MAX_ENTRIES, max_bytes=ANALYSIS_CACHE_MAX_BYTES,
+                 ttl=ANALYSIS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (保存時刻, サイズ, レスポンス, analysis_results)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[2], entry[3]
+
+    def put(self, key, response_data, results):
+        # レスポンスJSONの長さ + 分析結果（パイプラインのメモ化したステージを含む）が保持するメモリを概算サイズとする
+        size = len(json.dumps(response_data, ensure_ascii=False)) + estimate_nbytes(results)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time(), size, response_data, results)
+            self.total_bytes += size
+            self._evict()
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key)[1]
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, entry in self.entries.items() if now - entry[0] > self.ttl]:
+            self._remove(key)
+        # 古い順（最後に使われた時刻順）に破棄。直近の1件は残す
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries
+                                         or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+analysis_cache = AnalysisCache()
+
+# 分析リクエストの受付制御（同時実行数・コスト予算・待ち行列）
+admission = AdmissionController()
+
+def score_model(data, model_name, cached_scores=None):
+    """1モデル分の感情スコアを計算（cached_scores があれば計算済み分を再利用し、計算結果を書き戻す）"""
+    display_name = MODELS[model_name]
+    print(f"モデル {display_name} での分析開始...")
+    
+    reused = 0
+    model_scores = []
+    for pos, (idx, row) in enumerate(data.iterrows()):
+        if cached_scores is not None and not np.isnan(cached_scores[pos]):
+            model_scores.append(float(cached_scores[pos]))
+            reused += 1
+            continue
+        review_score = score_review(row['review_text'], model_name)
+        if review_score is not None:
+            model_scores.append(review_score)
+            # デバッグ：最初の3件の分析結果を出力
+            if idx < 3:
+                print(f"  サンプル {idx}: text='{row['review_text'][:30]}...', score={review_score:.3f}")
+        else:
+            model_scores.append(0.0)
+            if idx < 3:
+                print(f"  サンプル {idx}: 感情分析失敗")
+        if cached_scores is not None:
+            cached_scores[pos] = model_scores[-1]
     
-    # 星評価スコア正規化: (1-5) → (-2 to +2)
+    if reused:
+        print(f"  {display_name} 先行スコア再利用: {reused}/{len(model_scores)}件")
+    if model_scores:
+        print(f"  {display_name} スコア範囲: min={min(model_scores):.3f}, max={max(model_scores):.3f}, avg={sum(model_scores)/len(model_scores):.3f}")
+    print(f"モデル {display_name} の分析完了")
+    return model_scores
+
+def normalize_star_ratings(data):
+    """星評価スコア正規化: (1-5) → (-2 to +2)"""
     # データ型を数値に変換してから計算
     try:
         data['star_rating'] = pd.to_numeric(data['star_rating'], errors='coerce')
@@ -181,6 +532,14 @@ def calculate_scores(data):
     
     return data
 
+def calculate_scores(data, prescored=None):
+    """全モデルでの感情分析とスコア計算（prescored があれば計算済み分を再利用）"""
+    for model_name, display_name in MODELS.items():
+        cached_scores = prescored.get(model_name) if prescored is not None else None
+        data[f'{display_name}_score'] = score_model(data, model_name, cached_scores)
+    
+    return normalize_star_ratings(data)
+
 def aggregate_by_hospital(data):
     """病院単位での集計"""
     # 病院IDごとにグループ化して平均を計算
@@ -195,10 +554,216 @@ def aggregate_by_hospital(data):
     
     return hospital_stats
 
+class CompactScoredData:
+    """スコア付きデータのコンパクトな列指向表現（DataFrameへの変換はエクスポート時のみ）"""
+    def __init__(self, hospital_ids, star_ratings, scores, display_names, text_buffer, text_offsets):
+        self.hospital_ids = hospital_ids        # pd.Categorical（病院IDはコード＋カテゴリ）
+        self.star_ratings = star_ratings        # int8（欠損は0）
+        self.scores = scores                    # float32 の2次元配列（行=口コミ, 列=モデル）
+        self.display_names = list(display_names)
+        self.text_buffer = text_buffer          # 全口コミを連結したUTF-8バイト列
+        self.text_offsets = text_offsets        # 各口コミの開始位置（長さ n+1）
+
+    @classmethod
+    def from_scored_frame(cls, data, display_names):
+        """calculate_scores の出力から作成"""
+        encoded = [str(text).encode('utf-8') for text in data['review_text'].fillna('')]
+        text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=text_offsets[1:])
+        star_ratings = pd.to_numeric(data['star_rating'], errors='coerce').fillna(0).to_numpy()
+        # int8 に変換しても値が変わらないこと（小数の切り捨て・範囲外の桁あふれで input_frame が元と食い違わない）
+        if not np.isin(star_ratings, np.arange(0, 6)).all():
+            raise ValueError('星評価は1〜5の整数である必要があります')
+        star_ratings = star_ratings.astype(np.int8)
+        scores = np.ascontiguousarray(
+            data[[f'{display_name}_score' for display_name in display_names]].to_numpy(dtype=np.float32)
+        )
+        return cls(pd.Categorical(data['hospital_id']), star_ratings, scores,
+                   display_names, b''.join(encoded), text_offsets)
+
+    def __len__(self):
+        return len(self.star_ratings)
+
+    @property
+    def star_scores(self):
+        """星評価スコア（星評価 - 3、欠損はNaN）"""
+        return np.where(self.star_ratings > 0, self.star_ratings - 3, np.nan).astype(np.float32)
+
+    def model_scores(self, display_name):
+        return self.scores[:, self.display_names.index(display_name)]
+
+    def review_text(self, i):
+        return self.text_buffer[self.text_offsets[i]:self.text_offsets[i + 1]].decode('utf-8')
+
+    def review_texts(self):
+        return [self.review_text(i) for i in range(len(self))]
+
+    @property
+    def nbytes(self):
+        return (self.hospital_ids.codes.nbytes + self.star_ratings.nbytes + self.scores.nbytes
+                + len(self.text_buffer) + self.text_offsets.nbytes)
+
+    def input_frame(self):
+        """入力3列（hospital_id, review_text, star_rating）のDataFrameを作り直す（星評価の欠損はNaN）"""
+        star_ratings = self.star_ratings.astype(np.int64)
+        return pd.DataFrame({
+            'hospital_id': np.asarray(self.hospital_ids),
+            'review_text': self.review_texts(),
+            'star_rating': star_ratings if (star_ratings > 0).all() else np.where(star_ratings > 0, star_ratings, np.nan)
+        })
+
+    def to_dataframe(self):
+        """エクスポート用に calculate_scores と同じ列構成のDataFrameへ変換"""
+        df = pd.DataFrame({
+            'hospital_id': np.asarray(self.hospital_ids),
+            'review_text': self.review_texts(),
+            'star_rating': pd.Series(self.star_ratings, dtype='Int8').mask(self.star_ratings == 0),
+            'star_score': self.star_scores
+        })
+        for m, display_name in enumerate(self.display_names):
+            df[f'{display_name}_score'] = self.scores[:, m]
+        return df
+
+class HospitalRowIndex:
+    """病院ID → 行範囲のインデックス（スコア計算後に一度だけ作成）
+
+    行番号を病院コード順に並べ替えた order と、病院ごとの開始位置 offsets を持つ。
+    1病院の口コミ取得は O(その病院の件数)。
+    """
+    def __init__(self, scored_data):
+        codes = scored_data.hospital_ids.codes
+        categories = scored_data.hospital_ids.categories
+        self.order = np.argsort(codes, kind='stable')
+        self.offsets = np.searchsorted(codes[self.order], np.arange(len(categories) + 1))
+        # URLから来る病院IDは文字列なので文字列で引けるようにする
+        self.lookup = {str(hospital_id): code for code, hospital_id in enumerate(categories)}
+        self.hospital_ids = list(categories)
+
+    def rows(self, hospital_id):
+        """病院の行番号（元の並び順）。未登録の病院は None"""
+        code = self.lookup.get(str(hospital_id))
+        if code is None:
+            return None
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+    def review_count(self, hospital_id):
+        code = self.lookup.get(str(hospital_id))
+        return 0 if code is None else int(self.offsets[code + 1] - self.offsets[code])
+
+def normalize_search_text(text):
+    """検索用の正規化（前処理 → NFKC → 小文字化 → 空白除去）"""
+    text = analyzer.preprocess_text(unicodedata.normalize('NFKC', str(text))).lower()
+    return re.sub(r'\s+', '', text)
+
+def near_duplicate_labels(texts):
+    """近似重複クラスタの代表行番号（NEAR_DUPLICATE_SETTINGS の設定で計算）"""
+    settings = NEAR_DUPLICATE_SETTINGS
+    return cluster_near_duplicates(
+        [normalize_search_text(text) for text in texts],
+        threshold=settings['threshold'], num_perm=settings['num_perm'],
+        bands=settings['bands'], shingle_size=settings['shingle_size']
+    )
+
+class NgramIndex:
+    """口コミテキストの文字n-gram転置インデックス（単語境界のない日本語向け）
+
+    1文字と2文字のn-gram → 行番号（昇順のint32配列）を持つ。
+    検索語のn-gramのポスティングを短い順に積集合し、残った候補だけを部分一致で確認する。
+    """
+    def __init__(self, texts):
+        self.texts = [normalize_search_text(text) for text in texts]
+        postings = {}
+        for row, text in enumerate(self.texts):
+            for gram in set(text) | {text[i:i + 2] for i in range(len(text) - 1)}:
+                postings.setdefault(gram, []).append(row)
+        self.postings = {gram: np.asarray(rows, dtype=np.int32) for gram, rows in postings.items()}
+        print(f"検索インデックス作成: {len(self.texts)}件, {len(self.postings)} n-gram")
+
+    def search(self, query, candidates=None):
+        """空白区切りの全語を含む行番号（昇順）。candidates（昇順）があればその中から探す"""
+        terms = [normalize_search_text(term) for term in query.split()]
+        terms = [term for term in terms if term]
+        if not terms:
+            return np.empty(0, dtype=np.int32)
+        
+        grams = set()
+        for term in terms:
+            grams.update({term[i:i + 2] for i in range(len(term) - 1)} if len(term) > 1 else {term})
+        lists = sorted((self.postings.get(gram, np.empty(0, dtype=np.int32)) for gram in grams), key=len)
+        if candidates is not None:
+            lists.insert(0, np.asarray(candidates, dtype=np.int32))
+        
+        rows = lists[0]
+        for posting in lists[1:]:
+            if len(rows) == 0:
+                break
+            rows = np.intersect1d(rows, posting, assume_unique=True)
+        
+        # 2-gramがすべて含まれても連続しているとは限らないので候補を確認
+        if any(len(term) > 2 for term in terms):
+            rows = np.asarray([row for row in rows if all(term in self.texts[row] for term in terms)],
+                              dtype=np.int32)
+        return rows
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    """死活確認（プロセスが応答できれば200）"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """準備完了確認（ウォームアップ完了まで503を返し、ロードバランサーの振り分けを待たせる）
+
+    ウォームアップに失敗した場合（state が failed）も、分析に必要なライブラリが使えないため503のまま。
+    """
+    start_import_warmup()
+    ready = warmup_status['state'] == 'ready'
+    body = {
+        'ready': ready,
+        'warmup': warmup_status,
+        'models': {
+            display_name: {'state': 'ready', 'backend': 'mock'}
+            for display_name in MODELS.values()
+        }
+    }
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/admission')
+def admission_status():
+    """受付制御の状態（実行中・待ち行列・処理速度の見積もり）"""
+    return jsonify(convert_numpy_types(admission.status()))
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """保存済みのプロファイル一覧（新しい順、X-Profile-Token が必要）"""
+    if not admin_authorized(request.environ):
+        return jsonify({'error': 'プロファイルの取得には正しい X-Profile-Token が必要です'}), 403
+    return jsonify({'profiles': profiles.summaries()})
+
+@app.route('/admin/profiles/<profile_id>')
+@app.route('/admin/profiles/<profile_id>/<report>')
+def get_profile(profile_id, report=None):
+    """プロファイル1件（report: collapsed = フレームグラフ用、allocations = メモリ確保の上位、functions = 関数ごとの集計）"""
+    if not admin_authorized(request.environ):
+        return jsonify({'error': 'プロファイルの取得には正しい X-Profile-Token が必要です'}), 403
+    
+    entry = profiles.get(profile_id)
+    if entry is None:
+        return jsonify({'error': f'プロファイル {profile_id} が見つかりません'}), 404
+    if report is None:
+        return jsonify(entry)
+    if report not in ('collapsed', 'allocations', 'functions'):
+        return jsonify({'error': 'report は collapsed / allocations / functions のいずれかです'}), 404
+    
+    response = Response(entry[report], mimetype='text/plain')
+    if report == 'collapsed':
+        response.headers['Content-Disposition'] = f'attachment; filename=profile_{profile_id}.collapsed.txt'
+    return response
+
 @app.route('/debug')
 def debug():
     return render_template('debug.html')
@@ -229,29 +794,26 @@ def export_results():
         return jsonify({'error': '分析結果がありません'}), 400
     
     try:
-        # 分析済みデータの取得
+        # 分析済みデータの取得（コンパクト表現からここで初めてDataFrameに変換）
         scored_data = analysis_results['scored_data']
-        if not isinstance(scored_data, pd.DataFrame):
-            scored_data = pd.DataFrame(scored_data)
         print(f"エクスポート対象データ数: {len(scored_data)}")
         
         # データサイズ制限（10万件まで）
         if len(scored_data) > 100000:
             print(f"警告: データが大きすぎます ({len(scored_data)}件)")
             return jsonify({'error': 'データサイズが大きすぎます。10万件以下に制限してください。'}), 400
+        scored_data = scored_data.to_dataframe()
         
         # CSV用にデータを整理（メモリ効率化）
         print("CSV用データ整理開始...")
         
-        # 列名のマッピング
+        # 列名のマッピング（モデル列はモデル設定の short_name から）
         export_columns = {
             'hospital_id': '病院ID',
             'review_text': 'レビュー文', 
             'star_rating': '星評価',
             'star_score': '星評価スコア',
-            'Model A (Koheiduck)_score': 'Koheiduck感情スコア',
-            'Model B (LLM-book)_score': 'LLM-book感情スコア', 
-            'Model C (Mizuiro)_score': 'Mizuiro感情スコア'
+            **{f'{spec.display_name}_score': f'{spec.short_name}感情スコア' for spec in MODEL_SPECS.values()}
         }
         
         # 必要な列のみを選択してリネーム
@@ -303,55 +865,229 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'ファイルが選択されていません'}), 400
     
-    if file and file.filename.endswith('.csv'):
-        try:
-            # CSVファイルを読み込み
-            df = pd.read_csv(file)
-            
-            # 必要な列があるかチェック
-            required_columns = ['hospital_id', 'review_text', 'star_rating']
-            if not all(col in df.columns for col in required_columns):
-                return jsonify({'error': f'必要な列が不足しています: {required_columns}'}), 400
-            
-            # データ型チェック
-            df['star_rating'] = pd.to_numeric(df['star_rating'], errors='coerce')
-            df = df.dropna(subset=['star_rating'])
-            df['star_rating'] = df['star_rating'].astype(int)
-            
-            # 1-5の範囲チェック
-            df = df[(df['star_rating'] >= 1) & (df['star_rating'] <= 5)]
-            
-            uploaded_data = df
-            
-            # 基本統計量計算
-            total_reviews = len(df)
-            unique_hospitals = df['hospital_id'].nunique()
-            avg_star_rating = float(df['star_rating'].mean())
-            star_distribution = df['star_rating'].value_counts().sort_index().to_dict()
-            
-            print(f"データ統計: 総口コミ数={total_reviews}, 病院数={unique_hospitals}, 平均星評価={avg_star_rating:.2f}")
-            print(f"病院ID一覧: {df['hospital_id'].unique().tolist()}")
-            
-            stats = {
-                'total_reviews': total_reviews,
-                'unique_hospitals': unique_hospitals,
-                'avg_star_rating': avg_star_rating,
-                'star_distribution': star_distribution
+    try:
+        # CSV / gzip CSV / Parquet / Arrow IPC / NDJSON を必要な列だけ読み込み、星評価を検証
+        df = read_reviews(file.filename, file.read(), max_rows=UPLOAD_MAX_ROWS)
+    except MissingColumnsError as e:
+        return jsonify({'error': f'必要な列が不足しています: {REQUIRED_COLUMNS}', 'found_columns': e.found}), 400
+    except UploadFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'ファイル処理エラー: {str(e)}'}), 500
+    
+    if len(df) == 0:
+        return jsonify({'error': 'データが空です'}), 400
+    
+    uploaded_data = df
+    start_prescoring(df)
+    
+    # 基本統計量計算
+    total_reviews = len(df)
+    unique_hospitals = df['hospital_id'].nunique()
+    avg_star_rating = float(df['star_rating'].mean())
+    star_distribution = df['star_rating'].value_counts().sort_index().to_dict()
+    
+    print(f"データ統計: 総口コミ数={total_reviews}, 病院数={unique_hospitals}, 平均星評価={avg_star_rating:.2f}")
+    print(f"病院ID一覧: {df['hospital_id'].unique().tolist()}")
+    
+    stats = {
+        'total_reviews': total_reviews,
+        'unique_hospitals': unique_hospitals,
+        'avg_star_rating': avg_star_rating,
+        'star_distribution': star_distribution
+    }
+    
+    # JSONレスポンス用にデータを変換
+    data_for_js = df.to_dict('records')
+    
+    return jsonify({
+        'success': True, 
+        'stats': stats,
+        'data': data_for_js
+    })
+
+def parse_analysis_request(request_data):
+    """リクエストのデータをDataFrameに変換（star_ratingは1〜5の整数のみ受け付け、それ以外は ValueError）"""
+    data = pd.DataFrame(request_data['data'])
+    
+    # データ型を適切に変換
+    print(f"受信データ数: {len(data)}")
+    print(f"データ型確認 - star_rating: {data['star_rating'].dtype}")
+    
+    # star_ratingを数値型に変換し、1〜5の整数以外（小数・範囲外・欠損・数値でない値）は拒否する
+    star_ratings = pd.to_numeric(data['star_rating'], errors='coerce')
+    invalid = ~star_ratings.isin(range(1, 6))
+    if invalid.any():
+        rows = np.flatnonzero(invalid.to_numpy())
+        examples = ', '.join(f'{row + 1}行目={data["star_rating"].iloc[row]!r}' for row in rows[:5])
+        raise ValueError(f'star_rating は1〜5の整数で指定してください（{len(rows)}件: {examples}）')
+    data['star_rating'] = star_ratings.astype(np.int64)
+    print(f"変換後 - star_rating: {data['star_rating'].dtype}")
+    return data
+
+def get_pipeline(data):
+    """同じデータの分析パイプラインがあれば再利用（設定変更時は下流のステージのみ再計算）"""
+    pipeline = analysis_results.get('pipeline') if analysis_results else None
+    if pipeline is None or pipeline.ingest_key != dataset_content_key(data):
+        pipeline = AnalysisPipeline(data, prescored=get_prescored(data))
+    return pipeline
+
+def iter_analysis_events(pipeline, settings):
+    """ステージを順に計算し、完了したものから (イベント名, データ) を返す
+    
+    basic_stats → model（モデルごと）→ hospital_analysis → correlation（相関CI）→ performance_test（MAE差検定）
+    """
+    # 1. 基本統計（スコア計算を待たずに出せる）
+    _, data = pipeline.preprocess()
+    review_lengths = data['review_text'].str.len()
+    star_ratings = data['star_rating']
+    
+    basic_stats = {
+        'total_reviews': len(data),
+        'unique_hospitals': int(data['hospital_id'].nunique()),
+        'avg_rating': float(star_ratings.mean()),
+        'avg_review_length': float(review_lengths.mean()),
+        'rating_std': float(star_ratings.std()),
+        'length_std': float(review_lengths.std()),
+        'min_rating': int(star_ratings.min()),
+        'max_rating': int(star_ratings.max()),
+        'median_rating': float(star_ratings.median()),
+        'min_length': int(review_lengths.min()),
+        'max_length': int(review_lengths.max())
+    }
+    yield 'basic_stats', {
+        'basic_stats': basic_stats,
+        'star_rating_distribution': star_ratings.value_counts().sort_index().to_dict()
+    }
+    
+    # 2. モデルごとのスコア・性能指標（MAEは病院単位、相関係数は全レビューデータ）
+    for model_name, display_name in MODELS.items():
+        _, scores = pipeline.score(model_name)
+        _, metrics = pipeline.metrics(display_name)
+        yield 'model', {
+            'model': display_name,
+            'metrics': metrics,
+            'score_collapse': pipeline.collapse_summary(),
+            # 散布図用データ（preprocess ステージで正規化済み: 1-5 → -2~+2）
+            'scatter_data': {
+                'star_ratings': data['star_score'].tolist(),
+                'sentiment_scores': scores.tolist()
             }
-            
-            # JSONレスポンス用にデータを変換
-            data_for_js = df.to_dict('records')
-            
-            return jsonify({
-                'success': True, 
-                'stats': stats,
-                'data': data_for_js
-            })
-            
-        except Exception as e:
-            return jsonify({'error': f'ファイル処理エラー: {str(e)}'}), 500
+        }
+    
+    # 3. 病院別分析データ
+    _, hospital_stats = pipeline.aggregate()
+    hospital_analysis = {}
+    for _, row in hospital_stats.iterrows():
+        hospital_id = row['hospital_id']
+        
+        # 各モデルの感情スコアを個別に取得
+        sentiment_scores = {}
+        sentiment_values = []
+        for model_name, display_name in MODELS.items():
+            score_col = f'{display_name}_score'
+            if score_col in row.index:
+                score_value = float(row[score_col])
+                sentiment_scores[display_name] = score_value
+                sentiment_values.append(score_value)
+        
+        # 平均感情スコア
+        avg_sentiment = sum(sentiment_values) / len(sentiment_values) if sentiment_values else 0.0
+        
+        hospital_analysis[hospital_id] = {
+            'review_count': int(row['review_count']),
+            'avg_rating': float(row['star_score']),  # aggregate ステージの病院平均
+            'avg_sentiment': avg_sentiment,
+            'model_sentiments': sentiment_scores,
+            # JavaScript用に直接的なキーも追加
+            **sentiment_scores  # 辞書を展開してキーを直接追加
+        }
+    yield 'hospital_analysis', {'hospital_analysis': hospital_analysis}
+    
+    # 4. ブートストラップ信頼区間 (10000回) - 正規化後の星評価スコアを使用
+    for display_name in MODELS.values():
+        _, metrics = pipeline.metrics(display_name)
+        _, bootstrap_result = pipeline.correlation_ci(display_name, 'review', settings)
+        yield 'correlation', {
+            'model': display_name,
+            'result': {
+                'correlation': metrics['correlation'],
+                'p_value': metrics['p_value'],
+                'ci_lower': float(bootstrap_result['ci_lower']),
+                'ci_upper': float(bootstrap_result['ci_upper']),
+                'significant': bool(metrics['p_value'] < 0.05),
+                'sample_size': len(data),
+                'n_replicates': bootstrap_result['n_replicates'],
+                'ci_method': bootstrap_result['method']
+            }
+        }
     
-    return jsonify({'error': '無効なファイル形式です。CSVファイルをアップロードしてください'}), 400
+    # 5. モデル性能比較のブートストラップ検定 (10000回、全ての組をまとめて計算)
+    _, pairwise_tests = pipeline.pairwise_mae_tests(settings)
+    for comparison, test_results in pairwise_tests.items():
+        yield 'performance_test', {
+            'comparison': comparison,
+            'result': {
+                'mae_difference': test_results['mean_difference'],
+                'p_value': test_results['p_value'],
+                'ci_lower': test_results['confidence_interval'][0],
+                'ci_upper': test_results['confidence_interval'][1],
+                'significant': bool(test_results['p_value'] < 0.05),
+                'n_replicates': test_results['n_replicates']
+            }
+        }
+
+def collect_analysis_event(results, event, payload):
+    """イベントを /analyze のレスポンス形式（results）に反映"""
+    if event == 'basic_stats':
+        results.update(payload)
+    elif event == 'model':
+        model = payload['model']
+        results['model_comparison'][model] = payload['metrics']
+        results['score_collapse'] = payload['score_collapse']
+        results['sentiment_correlation']['scatter_data'][model] = payload['scatter_data']
+    elif event == 'hospital_analysis':
+        results['hospital_analysis'] = payload['hospital_analysis']
+    elif event == 'correlation':
+        results['sentiment_correlation']['correlations'][payload['model']] = payload['result']
+    elif event == 'performance_test':
+        results['model_performance_tests'][payload['comparison']] = payload['result']
+    return results
+
+def empty_analysis_results():
+    return {
+        'basic_stats': {},
+        'model_comparison': {},
+        'score_collapse': {'enabled': NEAR_DUPLICATE_SETTINGS['collapse']},
+        'star_rating_distribution': {},
+        'sentiment_correlation': {'scatter_data': {}, 'correlations': {}},
+        'hospital_analysis': {},
+        'model_performance_tests': {}
+    }
+
+def format_sse(event, payload):
+    """Server-Sent Events の1イベント"""
+    return f"event: {event}\ndata: {json.dumps(convert_numpy_types(payload), ensure_ascii=False)}\n\n"
+
+def analysis_cost(data, settings):
+    """分析1回のコスト見積もり（全モデルの推論 + 相関CI・MAE差検定のブートストラップ）"""
+    n_models = len(MODELS)
+    bootstrap_rows = len(data) if settings['resampling'] == 'review' else data['hospital_id'].nunique()
+    # MAE差検定は全ての組を1回のブートストラップで計算する
+    return estimate_cost(
+        len(data), int(data['review_text'].astype(str).str.len().sum()), n_models,
+        n_bootstrap=settings['n_bootstrap'], bootstrap_rows=bootstrap_rows,
+        n_bootstrap_tests=n_models + 1
+    )
+
+def admission_rejected_response(error):
+    """429 + Retry-After"""
+    response = jsonify({
+        'error': f'サーバーが混雑しています（{str(error)}）。{error.retry_after}秒後に再試行してください',
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
@@ -363,240 +1099,259 @@ def analyze():
         return jsonify({'error': 'データが送信されていません'}), 400
     
     # アップロードされたデータをDataFrameに変換
-    uploaded_data = pd.DataFrame(request_data['data'])
-    
-    # データ型を適切に変換
-    print(f"受信データ数: {len(uploaded_data)}")
-    print(f"データ型確認 - star_rating: {uploaded_data['star_rating'].dtype}")
-    
-    # star_ratingを確実に数値型に変換
     try:
-        uploaded_data['star_rating'] = pd.to_numeric(uploaded_data['star_rating'], errors='coerce')
-        print(f"変換後 - star_rating: {uploaded_data['star_rating'].dtype}")
+        uploaded_data = parse_analysis_request(request_data)
     except Exception as e:
         print(f"データ型変換エラー: {e}")
         return jsonify({'error': f'データ型変換エラー: {str(e)}'}), 400
+    try:
+        settings = bootstrap_settings(request_data.get('bootstrap'))
+    except BootstrapSettingsError as e:
+        return jsonify({'error': f'ブートストラップ設定が不正です: {str(e)}'}), 400
     
     try:
-        # 感情分析とスコア計算
-        scored_data = calculate_scores(uploaded_data.copy())
-        
-        # 病院単位で集計
-        hospital_stats = aggregate_by_hospital(scored_data)
-        
-        print(f"集計後の病院数: {len(hospital_stats)}")
-        print(f"集計データのサンプル:")
-        print(hospital_stats.head())
-        
-        # モデル性能評価
-        performance_metrics = {}
-        
-        for model_name, display_name in MODELS.items():
-            model_col = f'{display_name}_score'
-            
-            # MAE計算（病院単位での集計データを使用）
-            mae = mean_absolute_error(hospital_stats['star_score'], hospital_stats[model_col])
-            
-            # 一時的なperformance_metrics（相関係数は後で全レビューデータで上書きする）
-            performance_metrics[display_name] = {
-                'correlation': 0.0,  # 後で上書き
-                'p_value': 0.0,      # 後で上書き
-                'mae': float(mae)
-            }
-        
-        # モデル性能比較のブートストラップ検定 (10000回)
-        model_performance_tests = {}
-        model_names_list = list(MODELS.values())
-        
-        for i, model1 in enumerate(model_names_list):
-            for j, model2 in enumerate(model_names_list):
-                if i < j:  # 重複を避けるため
-                    col1 = f'{model1}_score'
-                    col2 = f'{model2}_score'
-                    
-                    if col1 in hospital_stats.columns and col2 in hospital_stats.columns:
-                        # MAE差のブートストラップ検定
-                        test_results = bootstrap_mae_difference_test(
-                            hospital_stats['star_score'].tolist(),
-                            hospital_stats[col1].tolist(),
-                            hospital_stats[col2].tolist(),
-                            n_bootstrap=10000
-                        )
-                        
-                        model_performance_tests[f'{model1}_vs_{model2}'] = {
-                            'mae_difference': test_results['mean_difference'],
-                            'p_value': test_results['p_value'],
-                            'ci_lower': test_results['confidence_interval'][0],
-                            'ci_upper': test_results['confidence_interval'][1],
-                            'significant': bool(test_results['p_value'] < 0.05)
-                        }
-        
-        # 星評価分布の計算
-        star_distribution = uploaded_data['star_rating'].value_counts().sort_index().to_dict()
-        
-        # 星評価と感情スコアの相関分析
-        sentiment_correlation_data = {}
-        scatter_data = {}
-        correlation_results = {}
-        
-        # 各モデルの星評価との相関を計算
-        for model_name, display_name in MODELS.items():
-            model_col = f'{display_name}_score'
-            
-            # 散布図用データ（強制的に正規化: 1-5 → -2~+2）
-            original_ratings = scored_data['star_rating'].tolist()
-            normalized_ratings = [(rating - 3) for rating in original_ratings]  # 確実に正規化
-            
-            print(f"Debug: {display_name} original star_rating range: {min(original_ratings)} to {max(original_ratings)}")
-            print(f"Debug: {display_name} normalized star_score range: {min(normalized_ratings)} to {max(normalized_ratings)}")
-            print(f"Debug: First 5 normalized star_scores: {normalized_ratings[:5]}")
-            
-            scatter_data[display_name] = {
-                'star_ratings': normalized_ratings,  # 確実に正規化されたデータ
-                'sentiment_scores': scored_data[model_col].tolist()
-            }
-            
-            # 相関係数と検定（正規化後の星評価スコアで計算）
-            correlation, p_value = pearsonr(scored_data['star_score'], scored_data[model_col])
-            
-            # performance_metricsを正しい相関係数で更新
-            performance_metrics[display_name].update({
-                'correlation': float(correlation),
-                'p_value': float(p_value)
-            })
-            
-            # ブートストラップ信頼区間 (10000回) - 正規化後の星評価スコアを使用
-            bootstrap_result = bootstrap_correlation_ci(
-                scored_data['star_score'].tolist(), 
-                scored_data[model_col].tolist(), 
-                n_bootstrap=10000
-            )
-            
-            correlation_results[display_name] = {
-                'correlation': float(correlation),
-                'p_value': float(p_value),
-                'ci_lower': float(bootstrap_result['ci_lower']),
-                'ci_upper': float(bootstrap_result['ci_upper']),
-                'significant': bool(p_value < 0.05),
-                'sample_size': len(uploaded_data)
-            }
-        
-        sentiment_correlation_data = {
-            'scatter_data': scatter_data,
-            'correlations': correlation_results
-        }
-        
-        # 基本統計の計算
-        review_lengths = uploaded_data['review_text'].str.len()
-        star_ratings = uploaded_data['star_rating']
-        
-        basic_stats = {
-            'total_reviews': len(uploaded_data),
-            'unique_hospitals': len(hospital_stats),
-            'avg_rating': float(star_ratings.mean()),
-            'avg_review_length': float(review_lengths.mean()),
-            'rating_std': float(star_ratings.std()),
-            'length_std': float(review_lengths.std()),
-            'min_rating': int(star_ratings.min()),
-            'max_rating': int(star_ratings.max()),
-            'median_rating': float(star_ratings.median()),
-            'min_length': int(review_lengths.min()),
-            'max_length': int(review_lengths.max())
-        }
-        
-        # 病院別分析データ
-        hospital_analysis = {}
-        for _, row in hospital_stats.iterrows():
-            hospital_id = row['hospital_id']
-            
-            # 各モデルの感情スコアを個別に取得
-            sentiment_scores = {}
-            sentiment_values = []
-            for model_name, display_name in MODELS.items():
-                score_col = f'{display_name}_score'
-                if score_col in row.index:
-                    score_value = float(row[score_col])
-                    sentiment_scores[display_name] = score_value
-                    sentiment_values.append(score_value)
-            
-            # 平均感情スコア
-            avg_sentiment = sum(sentiment_values) / len(sentiment_values) if sentiment_values else 0.0
+        # 同じデータ・設定の分析済み結果があれば再計算しない
+        cache_key = analysis_cache_key(uploaded_data, settings)
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            response_data, analysis_results = cached
+            print(f"分析キャッシュヒット: {cache_key[:8]}")
+            return jsonify(response_data)
+        
+        # 受付制御（混雑時は待ち行列で待ち、上限を超えたら429）
+        hand_over_prescoring(uploaded_data)
+        try:
+            ticket = admission.submit(client_id_from_request(request), analysis_cost(uploaded_data, settings))
+            ticket.wait()
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        
+        with ticket:
+            pipeline = get_pipeline(uploaded_data)
+            results = empty_analysis_results()
+            for event, payload in iter_analysis_events(pipeline, settings):
+                collect_analysis_event(results, event, payload)
             
-            hospital_analysis[hospital_id] = {
-                'review_count': int(row['review_count']),
-                'avg_rating': float(scored_data[scored_data['hospital_id'] == hospital_id]['star_score'].mean()),
-                'avg_sentiment': avg_sentiment,
-                'model_sentiments': sentiment_scores,
-                # JavaScript用に直接的なキーも追加
-                **sentiment_scores  # 辞書を展開してキーを直接追加
-            }
-        
-        # グローバル変数に分析結果を保存（CSVエクスポート用）
-        analysis_results = {
-            'hospital_stats': hospital_stats,
-            'performance_metrics': performance_metrics,
-            'scored_data': scored_data
-        }
-        # 元のuploaded_dataもグローバル変数として保存
-        uploaded_data = pd.DataFrame(request_data['data'])
-        
-        # JavaScriptが期待する形式でレスポンスを返す
-        response_data = {
-            'success': True,
-            'results': {
-                'basic_stats': basic_stats,
-                'model_comparison': performance_metrics,
-                'star_rating_distribution': star_distribution,
-                'sentiment_correlation': sentiment_correlation_data,
-                'hospital_analysis': hospital_analysis,
-                'model_performance_tests': model_performance_tests
-            }
-        }
+            # グローバル変数に分析結果を保存（CSVエクスポート用、コンパクト表現で保持）
+            analysis_results = pipeline.results(settings)
+        print(f"分析結果のメモリ使用量: {estimate_nbytes(analysis_results) / 1024:.1f}KB")
         
-        # numpy型をPythonネイティブ型に変換
-        response_data = convert_numpy_types(response_data)
+        # JavaScriptが期待する形式でレスポンスを返す（numpy型をPythonネイティブ型に変換）
+        response_data = convert_numpy_types({'success': True, 'results': results})
+        analysis_cache.put(cache_key, response_data, analysis_results)
         
         return jsonify(response_data)
-        
+    
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"分析エラーの詳細: {error_details}")
         return jsonify({'error': f'分析エラー: {str(e)}'}), 500
 
-def bootstrap_correlation_ci(x_data, y_data, n_bootstrap=10000, confidence_level=0.95):
-    """ブートストラップ法で相関係数の信頼区間を計算"""
+@app.route('/analyze_stream', methods=['POST'])
+def analyze_stream():
+    """/analyze と同じ分析を、ステージが完了するたびに Server-Sent Events で送信"""
+    global uploaded_data
+    
+    request_data = request.get_json()
+    if not request_data or 'data' not in request_data:
+        return jsonify({'error': 'データが送信されていません'}), 400
+    
+    try:
+        uploaded_data = parse_analysis_request(request_data)
+    except Exception as e:
+        print(f"データ型変換エラー: {e}")
+        return jsonify({'error': f'データ型変換エラー: {str(e)}'}), 400
+    try:
+        settings = bootstrap_settings(request_data.get('bootstrap'))
+    except BootstrapSettingsError as e:
+        return jsonify({'error': f'ブートストラップ設定が不正です: {str(e)}'}), 400
+    data = uploaded_data
+    
+    cache_key = analysis_cache_key(data, settings)
+    ticket = None
+    if analysis_cache.get(cache_key) is None:
+        # 受付制御（待ち行列が満杯なら429、待つ場合は queued イベントで待ち順を通知）
+        hand_over_prescoring(data)
+        try:
+            ticket = admission.submit(client_id_from_request(request), analysis_cost(data, settings))
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+    
+    def generate():
+        global analysis_results
+        
+        try:
+            cached = analysis_cache.get(cache_key)
+            if cached is not None:
+                response_data, analysis_results = cached
+                print(f"分析キャッシュヒット: {cache_key[:8]}")
+                yield format_sse('complete', response_data)
+                return
+            
+            if ticket is not None:
+                for position in ticket.wait_steps():
+                    yield format_sse('queued', {'position': position})
+            
+            pipeline = get_pipeline(data)
+            results = empty_analysis_results()
+            for event, payload in iter_analysis_events(pipeline, settings):
+                collect_analysis_event(results, event, payload)
+                yield format_sse(event, payload)
+            
+            analysis_results = pipeline.results(settings)
+            response_data = convert_numpy_types({'success': True, 'results': results})
+            analysis_cache.put(cache_key, response_data, analysis_results)
+            yield format_sse('complete', response_data)
+        
+        except AdmissionRejected as e:
+            yield format_sse('error', {'error': f'サーバーが混雑しています（{str(e)}）。{e.retry_after}秒後に再試行してください',
+                                       'retry_after': e.retry_after})
+        except Exception as e:
+            import traceback
+            print(f"分析エラーの詳細: {traceback.format_exc()}")
+            yield format_sse('error', {'error': f'分析エラー: {str(e)}'})
+        finally:
+            if ticket is not None:
+                ticket.release()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # リバースプロキシでのバッファリングを無効化
+    })
+    if ticket is not None:
+        # 送信開始前に切断された場合も待ち行列・予算を解放
+        response.call_on_close(lambda: (admission.cancel(ticket), ticket.release()))
+    return response
+
+class BootstrapSettingsError(ValueError):
+    """リクエストのブートストラップ設定が不正（400を返す）"""
+
+def bootstrap_settings(overrides=None):
+    """ブートストラップ設定（既定値 + リクエストごとの上書き）
+
+    mode / resampling は選択肢以外ならエラー、数値は BOOTSTRAP_LIMITS の範囲に丸める。
+    min_replicates は n_bootstrap を超えないようにする。
+    """
+    settings = dict(BOOTSTRAP_DEFAULTS)
+    if not overrides:
+        return settings
+    if not isinstance(overrides, dict):
+        raise BootstrapSettingsError('bootstrap はオブジェクトで指定してください')
+    
+    for key, value in overrides.items():
+        if key not in settings:
+            continue
+        if key in BOOTSTRAP_CHOICES:
+            if value not in BOOTSTRAP_CHOICES[key]:
+                raise BootstrapSettingsError(f'{key} は {" / ".join(BOOTSTRAP_CHOICES[key])} のいずれかです')
+            settings[key] = value
+            continue
+        try:
+            number = type(settings[key])(value)
+        except (TypeError, ValueError):
+            raise BootstrapSettingsError(f'{key} は数値で指定してください')
+        if isinstance(value, bool) or not math.isfinite(number):
+            raise BootstrapSettingsError(f'{key} は数値で指定してください')
+        low, high = BOOTSTRAP_LIMITS[key]
+        number = max(number, low)
+        settings[key] = number if high is None else min(number, high)
+    settings['min_replicates'] = min(settings['min_replicates'], settings['n_bootstrap'])
+    return settings
+
+def percentile_ci(values, confidence_level=0.95):
+    """パーセンタイル法の信頼区間（2次元の場合は列ごと）"""
+    alpha = 1 - confidence_level
+    return (np.percentile(values, (alpha / 2) * 100, axis=0),
+            np.percentile(values, (1 - alpha / 2) * 100, axis=0))
+
+def fisher_z_ci(x_data, y_data, confidence_level=0.95):
+    """Fisher z変換による相関係数の信頼区間（大規模データ用の解析解）"""
+    from scipy.stats import norm, pearsonr
+    
+    n = len(x_data)
+    r, _ = pearsonr(x_data, y_data)
+    z_crit = norm.ppf(1 - (1 - confidence_level) / 2)
+    z = np.arctanh(np.clip(r, -0.9999999, 0.9999999))
+    half_width = z_crit / np.sqrt(n - 3)
+    return np.tanh(z - half_width), np.tanh(z + half_width)
+
+def bootstrap_correlation_ci(x_data, y_data, n_bootstrap=10000, confidence_level=0.95, settings=None):
+    """ブートストラップ法で相関係数の信頼区間を計算（adaptive: 収束した時点で打ち切り）"""
+    from scipy.stats import pearsonr
+    
+    settings = settings or bootstrap_settings()
+    adaptive = settings['mode'] == 'adaptive'
     n = len(x_data)
+    
+    # 非常に大きいデータはFisher z変換の解析解（設定で有効化した場合のみ）
+    if settings['fisher_z_min_rows'] and n >= settings['fisher_z_min_rows']:
+        ci_lower, ci_upper = fisher_z_ci(x_data, y_data, confidence_level)
+        return {
+            'ci_lower': ci_lower,
+            'ci_upper': ci_upper,
+            'correlations': [],
+            'n_replicates': 0,
+            'method': 'fisher_z'
+        }
+    
+    # 大規模データ（口コミ単位）は全コアで並列実行
+    if n >= PARALLEL_BOOTSTRAP_MIN_ROWS:
+        from parallel_bootstrap import parallel_bootstrap_correlation_ci
+        print(f"並列ブートストラップ: n={n}, 回数={n_bootstrap}")
+        result = parallel_bootstrap_correlation_ci(
+            x_data, y_data,
+            n_bootstrap=n_bootstrap,
+            confidence_level=confidence_level,
+            seed=int(np.random.randint(0, 2**31 - 1)),
+            tolerance=settings['tolerance'] if adaptive else None,
+            block_size=settings['block_size'],
+            min_replicates=settings['min_replicates']
+        )
+        result['method'] = 'adaptive_bootstrap' if adaptive else 'bootstrap'
+        return result
+    
     bootstrap_correlations = []
+    previous_ci = None
+    n_replicates = 0
     
-    for _ in range(n_bootstrap):
+    for i in range(n_bootstrap):
         # リサンプリング
         indices = np.random.choice(n, n, replace=True)
         x_boot = [x_data[i] for i in indices]
         y_boot = [y_data[i] for i in indices]
+        n_replicates += 1
         
         # 相関係数計算
         if len(set(x_boot)) > 1 and len(set(y_boot)) > 1:  # 分散が0でない場合のみ
             corr, _ = pearsonr(x_boot, y_boot)
             if not np.isnan(corr):
                 bootstrap_correlations.append(corr)
+        
+        # ブロックごとに信頼区間の変化を確認し、許容差未満なら打ち切り
+        if adaptive and n_replicates % settings['block_size'] == 0 and bootstrap_correlations:
+            current_ci = percentile_ci(bootstrap_correlations, confidence_level)
+            if (previous_ci is not None and n_replicates >= settings['min_replicates']
+                    and max(abs(current_ci[0] - previous_ci[0]), abs(current_ci[1] - previous_ci[1])) < settings['tolerance']):
+                print(f"ブートストラップ収束: {n_replicates}回で打ち切り")
+                break
+            previous_ci = current_ci
     
     # 信頼区間計算
-    alpha = 1 - confidence_level
-    lower_percentile = (alpha / 2) * 100
-    upper_percentile = (1 - alpha / 2) * 100
-    
-    ci_lower = np.percentile(bootstrap_correlations, lower_percentile)
-    ci_upper = np.percentile(bootstrap_correlations, upper_percentile)
+    ci_lower, ci_upper = percentile_ci(bootstrap_correlations, confidence_level)
     
     return {
         'ci_lower': ci_lower,
         'ci_upper': ci_upper,
-        'correlations': bootstrap_correlations
+        'correlations': bootstrap_correlations,
+        'n_replicates': n_replicates,
+        'method': 'adaptive_bootstrap' if adaptive else 'bootstrap'
     }
 
-def bootstrap_mae_difference_test(y_true, y_pred1, y_pred2, n_bootstrap=10000, confidence_level=0.95):
-    """ブートストラップ法でMAE差の信頼区間を計算"""
+def bootstrap_mae_difference_test(y_true, y_pred1, y_pred2, n_bootstrap=10000, confidence_level=0.95, settings=None):
+    """ブートストラップ法でMAE差の信頼区間を計算（adaptive: 信頼区間とp値が収束した時点で打ち切り）"""
+    settings = settings or bootstrap_settings()
+    adaptive = settings['mode'] == 'adaptive'
     n = len(y_true)
     mae_differences = []
     
@@ -606,8 +1361,14 @@ def bootstrap_mae_difference_test(y_true, y_pred1, y_pred2, n_bootstrap=10000, c
     # オリジナルのMAE計算
     original_mae1 = mean_absolute_error(y_true, y_pred1)
     original_mae2 = mean_absolute_error(y_true, y_pred2)
+    mean_difference = original_mae1 - original_mae2
     print(f"オリジナルMAE: モデル1={original_mae1:.4f}, モデル2={original_mae2:.4f}")
     
+    y_true = np.asarray(y_true, dtype=float)
+    y_pred1 = np.asarray(y_pred1, dtype=float)
+    y_pred2 = np.asarray(y_pred2, dtype=float)
+    previous = None
+    
     for i in range(n_bootstrap):
         # 進行状況表示（1000回ごと）
         if (i + 1) % 1000 == 0:
@@ -615,27 +1376,30 @@ def bootstrap_mae_difference_test(y_true, y_pred1, y_pred2, n_bootstrap=10000, c
             
         # リサンプリング
         indices = np.random.choice(n, n, replace=True)
-        y_true_boot = [y_true[i] for i in indices]
-        y_pred1_boot = [y_pred1[i] for i in indices]
-        y_pred2_boot = [y_pred2[i] for i in indices]
+        y_true_boot = y_true[indices]
         
         # MAE計算
-        mae1 = mean_absolute_error(y_true_boot, y_pred1_boot)
-        mae2 = mean_absolute_error(y_true_boot, y_pred2_boot)
+        mae1 = mean_absolute_error(y_true_boot, y_pred1[indices])
+        mae2 = mean_absolute_error(y_true_boot, y_pred2[indices])
         
         # MAE差を記録 (モデル2のMAE - モデル1のMAE)
         mae_differences.append(mae2 - mae1)
+        
+        # ブロックごとに信頼区間とp値の変化を確認し、許容差未満なら打ち切り
+        if adaptive and (i + 1) % settings['block_size'] == 0:
+            ci = percentile_ci(mae_differences, confidence_level)
+            p_value = np.mean(np.abs(mae_differences) >= np.abs(mean_difference))
+            current = (ci[0], ci[1], p_value)
+            if (previous is not None and i + 1 >= settings['min_replicates']
+                    and max(abs(c - p) for c, p in zip(current, previous)) < settings['tolerance']):
+                print(f"ブートストラップ収束: {i + 1}回で打ち切り")
+                break
+            previous = current
     
     # 信頼区間計算
-    alpha = 1 - confidence_level
-    lower_percentile = (alpha / 2) * 100
-    upper_percentile = (1 - alpha / 2) * 100
-    
-    ci_lower = np.percentile(mae_differences, lower_percentile)
-    ci_upper = np.percentile(mae_differences, upper_percentile)
+    ci_lower, ci_upper = percentile_ci(mae_differences, confidence_level)
     
     # p値計算（両側検定）
-    mean_difference = original_mae1 - original_mae2
     p_value = np.sum(np.abs(mae_differences) >= np.abs(mean_difference)) / len(mae_differences)
     
     print(f"95%信頼区間: [{ci_lower:.4f}, {ci_upper:.4f}]")
@@ -644,142 +1408,599 @@ def bootstrap_mae_difference_test(y_true, y_pred1, y_pred2, n_bootstrap=10000, c
         'mean_difference': mean_difference,
         'p_value': p_value,
         'confidence_interval': [ci_lower, ci_upper],
-        'mae_differences': mae_differences
+        'mae_differences': mae_differences,
+        'n_replicates': len(mae_differences)
     }
 
-@app.route('/get_charts')
-def get_charts():
-    global analysis_results
+class HospitalGroupStats:
+    """病院ごとの十分統計量（クラスターブートストラップ用、分析時に一度だけ計算）"""
+    def __init__(self, scored_data, display_names):
+        self.display_names = list(display_names)
+        hospital_ids = pd.Categorical(scored_data['hospital_id'])
+        codes = hospital_ids.codes
+        n_hospitals = len(hospital_ids.categories)
+        x = scored_data['star_score'].to_numpy(dtype=float)
+        y = scored_data[[f'{display_name}_score' for display_name in self.display_names]].to_numpy(dtype=float)
+        
+        def group_sum(values):
+            if values.ndim == 1:
+                return np.bincount(codes, weights=values, minlength=n_hospitals)
+            return np.column_stack([group_sum(values[:, m]) for m in range(values.shape[1])])
+        
+        self.hospital_ids = hospital_ids.categories
+        self.counts = np.bincount(codes, minlength=n_hospitals).astype(float)
+        # 口コミ単位の相関係数用モーメント（x=星評価スコア, y=各モデル）
+        self.sum_x = group_sum(x)
+        self.sum_xx = group_sum(x * x)
+        self.sum_y = group_sum(y)
+        self.sum_yy = group_sum(y * y)
+        self.sum_xy = group_sum(x[:, None] * y)
+        # 病院単位の平均（hospital_stats と同じ値）
+        self.mean_x = self.sum_x / self.counts
+        self.mean_y = self.sum_y / self.counts[:, None]
     
-    if analysis_results is None:
-        return jsonify({'error': '分析結果がありません'}), 400
+    def __len__(self):
+        return len(self.counts)
     
-    try:
-        hospital_stats = analysis_results['hospital_stats']
-        performance_metrics = analysis_results['performance_metrics']
-        
-        # 1. パフォーマンス比較棒グラフ（相関係数）- 信頼区間付き
-        models = list(performance_metrics.keys())
-        correlations = []
-        correlation_cis = []
-        
-        for model in models:
-            model_col = f'{model}_score'
-            x_data = hospital_stats[model_col].tolist()
-            y_data = hospital_stats['star_score'].tolist()
-            
-            # 相関係数の信頼区間を計算
-            bootstrap_result = bootstrap_correlation_ci(x_data, y_data)
-            ci_lower = bootstrap_result['ci_lower']
-            ci_upper = bootstrap_result['ci_upper']
-            correlation_cis.append((ci_lower, ci_upper))
-            correlations.append(performance_metrics[model]['correlation'])
-        
-        # エラーバー付きの相関係数グラフ
-        correlation_chart = go.Figure(data=[
-            go.Bar(
-                x=models, 
-                y=correlations, 
-                name='相関係数',
-                error_y=dict(
-                    type='data',
-                    symmetric=False,
-                    array=[ci[1] - corr for ci, corr in zip(correlation_cis, correlations)],
-                    arrayminus=[corr - ci[0] for ci, corr in zip(correlation_cis, correlations)]
+    def model_index(self, display_name):
+        return self.display_names.index(display_name)
+    
+    def resample_weights(self, n_replicates):
+        return hospital_resample_weights(len(self), n_replicates)
+
+def hospital_resample_weights(n_hospitals, n_replicates):
+    """病院の復元抽出を多重度（replicates × 病院数）として表現"""
+    return np.random.multinomial(n_hospitals, np.full(n_hospitals, 1.0 / n_hospitals), size=n_replicates).astype(float)
+
+def weighted_pearson(weights, n, sum_a, sum_b, sum_aa, sum_bb, sum_ab):
+    """クラスターごとの和と重み行列から、replicateごとのピアソン相関係数を計算"""
+    total = weights @ n
+    a = weights @ sum_a
+    b = weights @ sum_b
+    cov = total * (weights @ sum_ab) - a * b
+    var_a = total * (weights @ sum_aa) - a * a
+    var_b = total * (weights @ sum_bb) - b * b
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = cov / np.sqrt(var_a * var_b)
+    return r[(var_a > 1e-12) & (var_b > 1e-12) & ~np.isnan(r)]
+
+def run_bootstrap_blocks(compute_block, n_bootstrap, settings, confidence_level=0.95, p_value=None):
+    """ブロック単位でreplicateを計算し、adaptive 設定なら収束した時点で打ち切る"""
+    adaptive = settings['mode'] == 'adaptive'
+    block_size = settings['block_size'] if adaptive else min(n_bootstrap, settings['block_size'])
+    values = []
+    n_replicates = 0
+    previous = None
+    
+    while n_replicates < n_bootstrap:
+        size = min(block_size, n_bootstrap - n_replicates)
+        values.append(compute_block(size))
+        n_replicates += size
+        if adaptive:
+            merged = np.concatenate(values)
+            # 複数の統計量（列）をまとめて計算する場合は全列が収束するまで続ける
+            current = np.asarray(percentile_ci(merged, confidence_level) + ((p_value(merged),) if p_value else ()))
+            if (previous is not None and n_replicates >= settings['min_replicates']
+                    and np.max(np.abs(current - previous)) < settings['tolerance']):
+                print(f"クラスターブートストラップ収束: {n_replicates}回で打ち切り")
+                break
+            previous = current
+    
+    return np.concatenate(values), n_replicates
+
+def cluster_bootstrap_correlation_ci(group_stats, display_name, level='review', n_bootstrap=10000,
+                                     confidence_level=0.95, settings=None):
+    """病院を単位とするクラスターブートストラップで相関係数の信頼区間を計算（1回あたりO(病院数)）
+
+    level='review': 抽出した病院の全口コミでの相関（口コミ単位の相関係数に対応）
+    level='hospital': 抽出した病院の平均スコア同士の相関（/get_charts の相関係数に対応）
+    """
+    settings = settings or bootstrap_settings()
+    m = group_stats.model_index(display_name)
+    if level == 'review':
+        moments = (group_stats.counts, group_stats.sum_x, group_stats.sum_y[:, m],
+                   group_stats.sum_xx, group_stats.sum_yy[:, m], group_stats.sum_xy[:, m])
+    else:
+        mean_x, mean_y = group_stats.mean_x, group_stats.mean_y[:, m]
+        moments = (np.ones(len(group_stats)), mean_x, mean_y, mean_x ** 2, mean_y ** 2, mean_x * mean_y)
+    
+    def compute_block(size):
+        return weighted_pearson(group_stats.resample_weights(size), *moments)
+    
+    bootstrap_correlations, n_replicates = run_bootstrap_blocks(compute_block, n_bootstrap, settings, confidence_level)
+    ci_lower, ci_upper = percentile_ci(bootstrap_correlations, confidence_level)
+    return {
+        'ci_lower': ci_lower,
+        'ci_upper': ci_upper,
+        'correlations': bootstrap_correlations,
+        'n_replicates': n_replicates,
+        'method': 'cluster_bootstrap'
+    }
+
+def pairwise_mae_difference_tests(errors, display_names, n_bootstrap=10000, confidence_level=0.95, settings=None):
+    """全モデルの組のMAE差検定を1回のブートストラップでまとめて計算（errors: 病院 × モデルの絶対誤差）
+
+    replicate ごとの病院の重みを全ての組で共有し、重み行列 × 誤差行列（replicates × モデル）から
+    組ごとの差を取る。モデル数が増えても病院の抽出・MAEの計算はモデル数に比例するだけで済む。
+    結果は bootstrap_mae_difference_test と同じ形で、キーは '{モデル1}_vs_{モデル2}'（設定の順で前のモデルが1）。
+    """
+    settings = settings or bootstrap_settings()
+    errors = np.asarray(errors, dtype=float)
+    n_hospitals = len(errors)
+    first, second = np.triu_indices(errors.shape[1], k=1)
+    mae = errors.mean(axis=0)
+    mean_differences = mae[first] - mae[second]
+    
+    def compute_block(size):
+        boot_mae = hospital_resample_weights(n_hospitals, size) @ errors / n_hospitals
+        # モデル2のMAE - モデル1のMAE（逐次版と同じ向き）
+        return boot_mae[:, second] - boot_mae[:, first]
+    
+    def p_value_of(differences):
+        return np.mean(np.abs(differences) >= np.abs(mean_differences), axis=0)
+    
+    mae_differences, n_replicates = run_bootstrap_blocks(
+        compute_block, n_bootstrap, settings, confidence_level, p_value=p_value_of
+    )
+    ci_lower, ci_upper = percentile_ci(mae_differences, confidence_level)
+    p_values = p_value_of(mae_differences)
+    print(f"MAE差検定: {len(first)}組をまとめて計算（{n_replicates}回）")
+    return {
+        f'{display_names[i]}_vs_{display_names[j]}': {
+            'mean_difference': float(mean_differences[k]),
+            'p_value': float(p_values[k]),
+            'confidence_interval': [float(ci_lower[k]), float(ci_upper[k])],
+            'mae_differences': mae_differences[:, k],
+            'n_replicates': n_replicates
+        }
+        for k, (i, j) in enumerate(zip(first, second))
+    }
+
+BOOTSTRAP_SEED = 42  # ステージの再計算とメモ化結果を一致させるための固定シード
+
+class AnalysisPipeline:
+    """分析のステージグラフ: ingest → near_duplicates → preprocess → score（モデルごと）→ score_matrix → aggregate → metrics → bootstrap → charts
+
+    各ノードの出力は「ノード名 + 上流ノードのキー + パラメータ」のハッシュでメモ化する。
+    エンドポイントは必要なノードを要求するだけで、未計算のノードのみ計算される。
+    ブートストラップ設定を変えた場合は bootstrap / charts ノードだけが再計算される。
+    """
+    # 口コミ単位のDataFrameを出力するノード（分析結果の保存後はメモ化しない）
+    FRAME_NODES = ('preprocess', 'scored')
+
+    def __init__(self, data, prescored=None):
+        self.data = data
+        self.ingest_key = dataset_content_key(data)
+        self.prescored = prescored
+        self.memo = {}  # ノード名 -> (キー, 出力)
+        self.lock = threading.RLock()
+        self.frames_released = False
+
+    @staticmethod
+    def _key(name, upstream, params):
+        return hashlib.sha1(json.dumps([name, upstream, params], sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _node(self, name, upstream, params, compute):
+        key = self._key(name, upstream, params)
+        with self.lock:
+            cached = self.memo.get(name)
+            if cached is not None and cached[0] == key:
+                return key, cached[1]
+            start = time.perf_counter()
+            value = compute()
+            if not (self.frames_released and name in self.FRAME_NODES):
+                self.memo[name] = (key, value)
+            print(f"ステージ計算: {name} ({(time.perf_counter() - start) * 1000:.0f}ms)")
+            return key, value
+
+    def release_frames(self):
+        """分析結果の保存時に、口コミ単位のDataFrame（入力データ・preprocess・scored）を手放す
+
+        キャッシュ・analysis_results に残るのは列指向の compact と配列・集計結果だけになる。
+        入力データは compact から作り直せるため、以降に preprocess / scored が必要になった場合は
+        その都度作り直す（メモ化しない）。
+        """
+        with self.lock:
+            self.compact()
+            for name in self.FRAME_NODES:
+                self.memo.pop(name, None)
+            self.data = None
+            self.frames_released = True
+
+    @staticmethod
+    def _seeded(compute):
+        def run():
+            np.random.seed(BOOTSTRAP_SEED)
+            return compute()
+        return run
+
+    def ingest(self):
+        """入力データ（手放した後は compact から作り直す）"""
+        with self.lock:
+            data = self.data
+            if data is None:
+                data = self.compact()[1].input_frame()
+            return self.ingest_key, data
+
+    def preprocess_key(self):
+        return self._key('preprocess', [self.ingest_key], None)
+
+    def preprocess(self):
+        """星評価の数値化と正規化（star_score）"""
+        return self._node('preprocess', [self.ingest_key], None, lambda: normalize_star_ratings(
+            self.ingest()[1][['hospital_id', 'review_text', 'star_rating']].copy()
+        ))
+
+    def near_duplicates(self):
+        """近似重複クラスタ: 各口コミの代表行番号（入力データのみに依存）"""
+        key = self.ingest_key
+        settings = NEAR_DUPLICATE_SETTINGS
+        def compute():
+            _, data = self.ingest()
+            labels = near_duplicate_labels(data['review_text'])
+            print(f"近似重複クラスタ: {len(np.unique(labels))}/{len(labels)}件が代表")
+            return labels
+        params = {name: settings[name] for name in ('threshold', 'num_perm', 'bands', 'shingle_size')}
+        return self._node('near_duplicates', [key], params, compute)
+
+    def score(self, model_name):
+        """1モデル分の感情スコア（先行スコアがあれば再利用、collapse 時は近似重複クラスタの代表のみ計算）"""
+        key = self.ingest_key
+        cached_scores = self.prescored.get(model_name) if self.prescored is not None else None
+        if not NEAR_DUPLICATE_SETTINGS['collapse']:
+            return self._node(f'score:{model_name}', [key], model_name, lambda: np.asarray(
+                score_model(self.ingest()[1], model_name, cached_scores), dtype=float
+            ))
+
+        dedup_key, labels = self.near_duplicates()
+        def compute():
+            _, data = self.ingest()
+            representatives = np.unique(labels)
+            cached = cached_scores[representatives] if cached_scores is not None else None
+            rep_scores = np.asarray(score_model(data.iloc[representatives], model_name, cached), dtype=float)
+            if cached_scores is not None:
+                cached_scores[representatives] = cached  # 代表の計算結果を先行スコアに書き戻す
+            scores = np.empty(len(data))
+            scores[representatives] = rep_scores
+            return scores[labels]
+        return self._node(f'score:{model_name}', [key, dedup_key], model_name, compute)
+
+    def collapse_summary(self):
+        """代表スコアの流用の有無と件数（n_clusters: 実際にスコア計算した代表の数、n_collapsed: 代表のスコアを使った口コミの数）"""
+        if not NEAR_DUPLICATE_SETTINGS['collapse']:
+            return {'enabled': False}
+        _, labels = self.near_duplicates()
+        n_clusters = int(len(np.unique(labels)))
+        return {
+            'enabled': True,
+            'threshold': NEAR_DUPLICATE_SETTINGS['threshold'],
+            'n_reviews': int(len(labels)),
+            'n_clusters': n_clusters,
+            'n_collapsed': int(len(labels)) - n_clusters
+        }
+
+    def near_duplicate_check(self, model_name):
+        """代表スコアの流用の確認: 代表以外の口コミを抽出して実際にスコア計算した値との差"""
+        key = self.ingest_key
+        dedup_key, labels = self.near_duplicates()
+        score_key, scores = self.score(model_name)
+        sample_size = NEAR_DUPLICATE_SETTINGS['verify_sample']
+        def compute():
+            _, data = self.ingest()
+            members = np.flatnonzero(labels != np.arange(len(labels)))
+            rng = np.random.default_rng(BOOTSTRAP_SEED)
+            sample = np.sort(rng.choice(members, min(len(members), sample_size), replace=False))
+            actual = []
+            for text in data['review_text'].iloc[sample]:
+                review_score = score_review(text, model_name)
+                actual.append(0.0 if review_score is None else review_score)
+            differences = np.abs(np.asarray(actual, dtype=float) - scores[sample])
+            return {
+                'sample_size': len(sample),
+                'mean_abs_difference': float(differences.mean()) if len(sample) else None,
+                'max_abs_difference': float(differences.max()) if len(sample) else None
+            }
+        return self._node(f'near_duplicate_check:{model_name}', [key, dedup_key, score_key], sample_size,
+                          compute)
+
+    def near_duplicate_report(self, top=10):
+        """近似重複クラスタの全体統計・病院ごとの重複率・大きいクラスタ上位"""
+        key = self.ingest_key
+        dedup_key, labels = self.near_duplicates()
+        def compute():
+            _, data = self.ingest()
+            return cluster_report(labels, data['hospital_id'].tolist(), data['review_text'].tolist(), top=top)
+        return self._node('near_duplicate_report', [key, dedup_key], top, compute)
+
+    def score_matrix(self):
+        """全モデルのスコア行列（口コミ × モデル、列はモデル設定の順）"""
+        score_nodes = [self.score(model_name) for model_name in MODELS]
+        return self._node('score_matrix', [key for key, _ in score_nodes], None, lambda: np.column_stack(
+            [scores for _, scores in score_nodes]
+        ) if score_nodes else np.empty((len(self.ingest()[1]), 0)))
+
+    def scored_key(self):
+        return self._key('scored', [self.preprocess_key(), self.score_matrix()[0]], None)
+
+    def scored(self):
+        """calculate_scores と同じ列を持つスコア付きデータ"""
+        preprocess_key = self.preprocess_key()
+        matrix_key, matrix = self.score_matrix()
+        def compute():
+            _, data = self.preprocess()
+            scores = pd.DataFrame(matrix, columns=[f'{display_name}_score' for display_name in MODELS.values()],
+                                  index=data.index)
+            return pd.concat([data, scores], axis=1)
+        return self._node('scored', [preprocess_key, matrix_key], None, compute)
+
+    def aggregate(self):
+        def compute():
+            hospital_stats = aggregate_by_hospital(self.scored()[1])
+            print(f"集計後の病院数: {len(hospital_stats)}")
+            return hospital_stats
+        return self._node('aggregate', [self.scored_key()], None, compute)
+
+    def group_stats(self):
+        return self._node('group_stats', [self.scored_key()], None,
+                          lambda: HospitalGroupStats(self.scored()[1], MODELS.values()))
+
+    def compact(self):
+        return self._node('compact', [self.scored_key()], None,
+                          lambda: CompactScoredData.from_scored_frame(self.scored()[1], MODELS.values()))
+
+    def search_index(self):
+        """口コミテキストの転置インデックス（入力データのみに依存）"""
+        return self._node('search_index', [self.ingest_key], None,
+                          lambda: NgramIndex(self.ingest()[1]['review_text'].tolist()))
+
+    def hospital_index(self):
+        key, scored_data = self.compact()
+        return self._node('hospital_index', [key], None, lambda: HospitalRowIndex(scored_data))
+
+    def top_reviews(self, k=TOP_REVIEWS_K):
+        """病院ごと・モデルごとの上位k件（ポジティブ / ネガティブ / 星評価とのずれ）の行番号
+
+        k が TOP_REVIEWS_K 以下なら分析時の結果、超える場合は TOP_REVIEWS_MAX_K 件を別のメモに一度だけ計算する
+        （k ごとに計算し直さず、分析時の結果も置き換えない）。取り出す件数は hospital(hospital_id, k) で指定する。
+        """
+        name, k = ('top_reviews', TOP_REVIEWS_K) if k <= TOP_REVIEWS_K else ('top_reviews_max', TOP_REVIEWS_MAX_K)
+        compact_key, scored_data = self.compact()
+        index_key, hospital_index = self.hospital_index()
+        return self._node(name, [compact_key, index_key], k,
+                          lambda: HospitalTopReviews(scored_data, hospital_index, k))
+
+    def metrics(self, display_name):
+        """MAE（病院単位）と相関係数・p値（口コミ単位）。そのモデルのスコアだけに依存する"""
+        preprocess_key = self.preprocess_key()
+        model_name = next(name for name, display in MODELS.items() if display == display_name)
+        score_key, scores = self.score(model_name)
+        def compute():
+            from scipy.stats import pearsonr
+            _, data = self.preprocess()
+            correlation, p_value = pearsonr(data['star_score'], scores)
+            # 病院単位の平均（aggregate_by_hospital と同じ値）
+            hospital_means = pd.DataFrame({
+                'hospital_id': data['hospital_id'], 'star_score': data['star_score'], 'score': scores
+            }).groupby('hospital_id')[['star_score', 'score']].mean()
+            return {
+                'correlation': float(correlation),
+                'p_value': float(p_value),
+                'mae': float(mean_absolute_error(hospital_means['star_score'], hospital_means['score']))
+            }
+        return self._node(f'metrics:{display_name}', [preprocess_key, score_key], display_name, compute)
+
+    def performance_metrics(self):
+        return {display_name: self.metrics(display_name)[1] for display_name in MODELS.values()}
+
+    def correlation_ci(self, display_name, level, settings):
+        """相関係数のブートストラップ信頼区間（level: review=口コミ単位 / hospital=病院単位）"""
+        if settings['resampling'] == 'cluster':
+            upstream_key, group_stats = self.group_stats()
+            def compute():
+                return cluster_bootstrap_correlation_ci(
+                    group_stats, display_name, level=level,
+                    n_bootstrap=settings['n_bootstrap'], settings=settings
                 )
+        else:
+            upstream_key = self.scored_key() if level == 'review' else self.aggregate()[0]
+            def compute():
+                frame = self.scored()[1] if level == 'review' else self.aggregate()[1]
+                return bootstrap_correlation_ci(
+                    frame['star_score'].tolist(), frame[f'{display_name}_score'].tolist(),
+                    n_bootstrap=settings['n_bootstrap'], settings=settings
+                )
+        return self._node(f'correlation_ci:{display_name}:{level}', [upstream_key], settings,
+                          self._seeded(compute))
+
+    def pairwise_mae_tests(self, settings):
+        """全モデルの組のMAE差検定（病院単位、全ての組を1回のブートストラップで計算）
+
+        MAE差検定は病院単位の平均の誤差を病院ごとに抽出し直すため、resampling 設定によらず同じ計算になる。
+        """
+        upstream_key, group_stats = self.group_stats()
+        def compute():
+            errors = np.abs(group_stats.mean_x[:, None] - group_stats.mean_y)
+            return pairwise_mae_difference_tests(
+                errors, group_stats.display_names, n_bootstrap=settings['n_bootstrap'], settings=settings
+            )
+        return self._node('pairwise_mae_tests', [upstream_key], settings, self._seeded(compute))
+
+    def mae_test(self, model1, model2, settings):
+        """MAE差のブートストラップ検定（pairwise_mae_tests の結果から取り出す。逆順の組は符号を反転）"""
+        key, tests = self.pairwise_mae_tests(settings)
+        result = tests.get(f'{model1}_vs_{model2}')
+        if result is not None:
+            return key, result
+        result = tests[f'{model2}_vs_{model1}']
+        ci_lower, ci_upper = result['confidence_interval']
+        return key, {
+            **result,
+            'mean_difference': -result['mean_difference'],
+            'confidence_interval': [-ci_upper, -ci_lower],
+            'mae_differences': -result['mae_differences']
+        }
+
+    def charts(self, settings):
+        aggregate_key, hospital_stats = self.aggregate()
+        display_names = list(MODELS.values())
+        metric_nodes = [self.metrics(display_name) for display_name in display_names]
+        ci_nodes = [self.correlation_ci(display_name, 'hospital', settings) for display_name in display_names]
+        upstream = [aggregate_key] + [key for key, _ in metric_nodes] + [key for key, _ in ci_nodes]
+        return self._node('charts', upstream, None, lambda: build_charts_json(
+            hospital_stats,
+            {display_name: metrics for display_name, (_, metrics) in zip(display_names, metric_nodes)},
+            [result for _, result in ci_nodes]
+        ))
+
+    def results(self, settings):
+        """export_results / get_charts / statistical_test が参照する分析結果（保存前にDataFrameを手放す）"""
+        results = {
+            'pipeline': self,
+            'hospital_stats': self.aggregate()[1],
+            'performance_metrics': self.performance_metrics(),
+            'bootstrap_settings': settings,
+            'group_stats': self.group_stats()[1],
+            'scored_data': self.compact()[1],
+            'hospital_index': self.hospital_index()[1],
+            'search_index': self.search_index()[1],
+            'top_reviews': self.top_reviews()[1]
+        }
+        self.release_frames()
+        return results
+
+def build_charts_json(hospital_stats, performance_metrics, correlation_ci_results):
+    """charts ステージ: 病院単位の集計・性能指標・相関係数CIからPlotlyチャートを作成"""
+    import plotly
+    import plotly.graph_objs as go
+    from scipy import stats
+    
+    # 1. パフォーマンス比較棒グラフ（相関係数）- 信頼区間付き
+    models = list(performance_metrics.keys())
+    correlations = [performance_metrics[model]['correlation'] for model in models]
+    correlation_cis = [(result['ci_lower'], result['ci_upper']) for result in correlation_ci_results]
+    correlation_replicates = [result['n_replicates'] for result in correlation_ci_results]
+    
+    # エラーバー付きの相関係数グラフ
+    correlation_chart = go.Figure(data=[
+        go.Bar(
+            x=models, 
+            y=correlations, 
+            name='相関係数',
+            error_y=dict(
+                type='data',
+                symmetric=False,
+                array=[ci[1] - corr for ci, corr in zip(correlation_cis, correlations)],
+                arrayminus=[corr - ci[0] for ci, corr in zip(correlation_cis, correlations)]
             )
-        ])
-        correlation_chart.update_layout(
-            title='モデル性能比較: 相関係数 (95%信頼区間付き)',
-            xaxis_title='モデル',
-            yaxis_title='ピアソン相関係数',
-            showlegend=False
-        )
-        
-        # 2. MAE比較棒グラフ
-        mae_values = [performance_metrics[model]['mae'] for model in models]
-        
-        mae_chart = go.Figure(data=[
-            go.Bar(x=models, y=mae_values, name='MAE', marker_color='orange')
-        ])
-        mae_chart.update_layout(
-            title='モデル性能比較: 平均絶対誤差 (MAE)',
-            xaxis_title='モデル',
-            yaxis_title='平均絶対誤差',
-            showlegend=False
         )
-        
-        # 3. 散布図（各モデル）- 信頼区間情報付き
-        scatter_charts = []
-        
-        for i, (model_name, display_name) in enumerate(MODELS.items()):
-            model_col = f'{display_name}_score'
-            correlation = performance_metrics[display_name]['correlation']
-            ci_lower, ci_upper = correlation_cis[i]
-            
-            # データをリストに変換して確実にプロット
-            x_data = hospital_stats[model_col].tolist()
-            y_data = hospital_stats['star_score'].tolist()
-            hospital_ids = hospital_stats['hospital_id'].tolist()
-            
-            scatter_chart = go.Figure()
+    ])
+    correlation_chart.update_layout(
+        title='モデル性能比較: 相関係数 (95%信頼区間付き)',
+        xaxis_title='モデル',
+        yaxis_title='ピアソン相関係数',
+        showlegend=False
+    )
+    
+    # 2. MAE比較棒グラフ
+    mae_values = [performance_metrics[model]['mae'] for model in models]
+    
+    mae_chart = go.Figure(data=[
+        go.Bar(x=models, y=mae_values, name='MAE', marker_color='orange')
+    ])
+    mae_chart.update_layout(
+        title='モデル性能比較: 平均絶対誤差 (MAE)',
+        xaxis_title='モデル',
+        yaxis_title='平均絶対誤差',
+        showlegend=False
+    )
+    
+    # 3. 散布図（各モデル）- 信頼区間情報付き
+    scatter_charts = []
+    
+    for i, (model_name, display_name) in enumerate(MODELS.items()):
+        model_col = f'{display_name}_score'
+        correlation = performance_metrics[display_name]['correlation']
+        ci_lower, ci_upper = correlation_cis[i]
+        
+        # データをリストに変換して確実にプロット
+        x_data = hospital_stats[model_col].tolist()
+        y_data = hospital_stats['star_score'].tolist()
+        hospital_ids = hospital_stats['hospital_id'].tolist()
+        
+        scatter_chart = go.Figure()
+        
+        scatter_chart.add_trace(go.Scatter(
+            x=x_data,
+            y=y_data,
+            mode='markers',
+            marker=dict(
+                size=10, 
+                opacity=0.7,
+                color='blue',
+                line=dict(width=1, color='darkblue')
+            ),
+            text=[f'病院ID: {hid}' for hid in hospital_ids],
+            hovertemplate='<b>%{text}</b><br>口コミスコア: %{x:.3f}<br>星評価スコア: %{y:.3f}<extra></extra>',
+            name='病院データ'
+        ))
+        
+        # 回帰線を追加
+        if len(x_data) > 1:
+            slope, intercept, r_value, p_value, std_err = stats.linregress(x_data, y_data)
+            x_line = [min(x_data), max(x_data)]
+            y_line = [slope * x + intercept for x in x_line]
             
             scatter_chart.add_trace(go.Scatter(
-                x=x_data,
-                y=y_data,
-                mode='markers',
-                marker=dict(
-                    size=10, 
-                    opacity=0.7,
-                    color='blue',
-                    line=dict(width=1, color='darkblue')
-                ),
-                text=[f'病院ID: {hid}' for hid in hospital_ids],
-                hovertemplate='<b>%{text}</b><br>口コミスコア: %{x:.3f}<br>星評価スコア: %{y:.3f}<extra></extra>',
-                name='病院データ'
-            ))
-            
-            # 回帰線を追加
-            if len(x_data) > 1:
-                slope, intercept, r_value, p_value, std_err = stats.linregress(x_data, y_data)
-                x_line = [min(x_data), max(x_data)]
-                y_line = [slope * x + intercept for x in x_line]
-                
-                scatter_chart.add_trace(go.Scatter(
-                    x=x_line,
-                    y=y_line,
-                    mode='lines',
-                    line=dict(color='red', width=2),
-                    name=f'回帰線 (r={correlation:.3f})',
-                    showlegend=True
-                ))
-            
-            scatter_chart.update_layout(
-                title=f'{display_name}<br>相関係数 r = {correlation:.3f} (95%CI: [{ci_lower:.3f}, {ci_upper:.3f}])<br>病院数: {len(hospital_stats)}',
-                xaxis_title='平均口コミスコア',
-                yaxis_title='平均星評価スコア',
-                width=400,
-                height=400,
+                x=x_line,
+                y=y_line,
+                mode='lines',
+                line=dict(color='red', width=2),
+                name=f'回帰線 (r={correlation:.3f})',
                 showlegend=True
-            )
-            
-            scatter_charts.append(scatter_chart)
-        
-        # MAEでモデルをソートして、デフォルト選択用の情報を追加
-        mae_sorted_models = sorted(models, key=lambda m: performance_metrics[m]['mae'])
-        
-        # チャートをJSONに変換
-        charts_json = {
-            'correlation_chart': json.dumps(correlation_chart, cls=plotly.utils.PlotlyJSONEncoder),
-            'mae_chart': json.dumps(mae_chart, cls=plotly.utils.PlotlyJSONEncoder),
-            'scatter_charts': [json.dumps(chart, cls=plotly.utils.PlotlyJSONEncoder) for chart in scatter_charts],
-            'model_list': models,
-            'best_model': mae_sorted_models[0] if mae_sorted_models else models[0],
-            'second_best_model': mae_sorted_models[1] if len(mae_sorted_models) > 1 else models[1] if len(models) > 1 else models[0],
-            'performance_metrics': performance_metrics,
-            'correlation_cis': {model: {'lower': ci[0], 'upper': ci[1]} for model, ci in zip(models, correlation_cis)}
-        }
+            ))
         
+        scatter_chart.update_layout(
+            title=f'{display_name}<br>相関係数 r = {correlation:.3f} (95%CI: [{ci_lower:.3f}, {ci_upper:.3f}])<br>病院数: {len(hospital_stats)}',
+            xaxis_title='平均口コミスコア',
+            yaxis_title='平均星評価スコア',
+            width=400,
+            height=400,
+            showlegend=True
+        )
+        
+        scatter_charts.append(scatter_chart)
+    
+    # MAEでモデルをソートして、デフォルト選択用の情報を追加
+    mae_sorted_models = sorted(models, key=lambda m: performance_metrics[m]['mae'])
+    
+    # チャートをJSONに変換
+    charts_json = {
+        'correlation_chart': json.dumps(correlation_chart, cls=plotly.utils.PlotlyJSONEncoder),
+        'mae_chart': json.dumps(mae_chart, cls=plotly.utils.PlotlyJSONEncoder),
+        'scatter_charts': [json.dumps(chart, cls=plotly.utils.PlotlyJSONEncoder) for chart in scatter_charts],
+        'model_list': models,
+        'best_model': mae_sorted_models[0] if mae_sorted_models else models[0],
+        'second_best_model': mae_sorted_models[1] if len(mae_sorted_models) > 1 else models[1] if len(models) > 1 else models[0],
+        'performance_metrics': performance_metrics,
+        'correlation_cis': {
+            model: {'lower': ci[0], 'upper': ci[1], 'n_replicates': n_replicates}
+            for model, ci, n_replicates in zip(models, correlation_cis, correlation_replicates)
+        }
+    }
+    
+    return charts_json
+
+@app.route('/get_charts')
+def get_charts():
+    global analysis_results
+    
+    if analysis_results is None:
+        return jsonify({'error': '分析結果がありません'}), 400
+    
+    try:
+        # charts ステージ（計算済みなら再計算しない）
+        settings = analysis_results.get('bootstrap_settings') or bootstrap_settings()
+        _, charts_json = analysis_results['pipeline'].charts(settings)
         return jsonify(charts_json)
         
     except Exception as e:
@@ -797,6 +2018,301 @@ def get_performance_metrics():
         'performance_metrics': analysis_results['performance_metrics']
     })
 
+def review_record(scored_data, row):
+    """1件の口コミとモデル別スコア（drill-down / 検索のレスポンス用）"""
+    star_rating = int(scored_data.star_ratings[row])
+    return {
+        'row': int(row),
+        'hospital_id': scored_data.hospital_ids[row],
+        'review_text': scored_data.review_text(row),
+        'star_rating': star_rating if star_rating > 0 else None,
+        'star_score': None if star_rating == 0 else star_rating - 3,
+        'scores': {display_name: float(scored_data.scores[row, m])
+                   for m, display_name in enumerate(scored_data.display_names)}
+    }
+
+def pagination_args(max_per_page=500):
+    """page / per_page クエリパラメータ（不正な値は ValueError）"""
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', 50))
+    if page < 1 or not 1 <= per_page <= max_per_page:
+        raise ValueError(f'page は1以上、per_page は1〜{max_per_page}で指定してください')
+    return page, per_page
+
+@app.route('/hospitals')
+def list_hospitals():
+    """病院一覧（集計値、ページング・並べ替え・絞り込み対応）
+
+    クエリ: page, per_page, sort（hospital_id / review_count / star_score / avg_sentiment / モデル表示名）,
+            order（asc / desc）, q（病院IDの部分一致）, min_reviews（レビュー数の下限）
+    """
+    if analysis_results is None:
+        return jsonify({'error': '分析結果がありません'}), 400
+    
+    try:
+        page, per_page = pagination_args()
+        min_reviews = int(request.args.get('min_reviews', 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    hospital_stats = analysis_results['hospital_stats']
+    score_cols = [f'{display_name}_score' for display_name in MODELS.values()]
+    sort = request.args.get('sort', 'hospital_id')
+    if sort in ('hospital_id', 'review_count', 'star_score', 'avg_sentiment'):
+        sort_col = sort
+    else:
+        sort_col = f'{sort}_score'
+        if sort_col not in hospital_stats.columns:
+            return jsonify({'error': f'並べ替えできない列です: {sort}'}), 400
+    ascending = request.args.get('order', 'asc') != 'desc'
+    
+    # 絞り込み
+    filtered = hospital_stats
+    query = request.args.get('q', '').strip()
+    if query:
+        filtered = filtered[filtered['hospital_id'].astype(str).str.contains(query, case=False, regex=False)]
+    if min_reviews > 0:
+        filtered = filtered[filtered['review_count'] >= min_reviews]
+    
+    if sort_col == 'avg_sentiment':
+        sort_keys = filtered[score_cols].mean(axis=1)
+        ordered = filtered.iloc[np.argsort(sort_keys.to_numpy() if ascending else -sort_keys.to_numpy(),
+                                           kind='stable')]
+    else:
+        ordered = filtered.sort_values(sort_col, ascending=ascending, kind='stable')
+    start = (page - 1) * per_page
+    page_rows = ordered.iloc[start:start + per_page]
+    
+    hospitals = []
+    for row in page_rows.to_dict('records'):  # 列ごとのdtypeを保つ（iterrowsは病院IDがfloatになる）
+        scores = {display_name: float(row[f'{display_name}_score']) for display_name in MODELS.values()}
+        hospitals.append({
+            'hospital_id': row['hospital_id'],
+            'review_count': int(row['review_count']),
+            'star_score': float(row['star_score']),
+            'scores': scores,
+            'avg_sentiment': sum(scores.values()) / len(scores)
+        })
+    
+    return jsonify(convert_numpy_types({
+        'success': True,
+        'total': len(filtered),
+        'page': page,
+        'per_page': per_page,
+        'pages': -(-len(filtered) // per_page),
+        'hospitals': hospitals
+    }))
+
+@app.route('/hospitals/<hospital_id>/reviews')
+def hospital_reviews(hospital_id):
+    """1病院の口コミとモデル別スコア（ページング・スコア列での並べ替え・星評価での絞り込み）
+
+    クエリ: page, per_page, sort（star_rating / モデル表示名 / row）, order（asc / desc）,
+            star（例: star=1,2 で★1と★2のみ）, q（口コミ本文のキーワード、空白区切りでAND）
+    """
+    if analysis_results is None or analysis_results.get('hospital_index') is None:
+        return jsonify({'error': '分析結果がありません'}), 400
+    
+    try:
+        page, per_page = pagination_args()
+        stars = [int(star) for star in request.args.get('star', '').split(',') if star.strip()]
+    except ValueError as e:
+        return jsonify({'error': f'パラメータが不正です: {str(e)}'}), 400
+    
+    scored_data = analysis_results['scored_data']
+    rows = analysis_results['hospital_index'].rows(hospital_id)
+    if rows is None:
+        return jsonify({'error': f'病院が見つかりません: {hospital_id}'}), 404
+    
+    # 星評価・キーワードで絞り込み
+    if stars:
+        rows = rows[np.isin(scored_data.star_ratings[rows], stars)]
+    query = request.args.get('q', '').strip()
+    if query and analysis_results.get('search_index') is not None:
+        rows = analysis_results['search_index'].search(query, np.sort(rows))
+    
+    # 並べ替え（対象病院の行だけをソート）
+    sort = request.args.get('sort', 'row')
+    descending = request.args.get('order', 'asc') == 'desc'
+    if sort == 'star_rating':
+        keys = scored_data.star_ratings[rows]
+    elif sort in scored_data.display_names:
+        keys = scored_data.model_scores(sort)[rows]
+    elif sort == 'row':
+        keys = rows
+    else:
+        return jsonify({'error': f'並べ替えできない列です: {sort}'}), 400
+    order = np.argsort(-keys.astype(np.float64) if descending else keys, kind='stable')
+    rows = rows[order]
+    
+    start = (page - 1) * per_page
+    page_rows = rows[start:start + per_page]
+    
+    return jsonify(convert_numpy_types({
+        'success': True,
+        'hospital_id': hospital_id,
+        'total': len(rows),
+        'page': page,
+        'per_page': per_page,
+        'pages': -(-len(rows) // per_page),
+        'reviews': [review_record(scored_data, row) for row in page_rows]
+    }))
+
+@app.route('/hospitals/<hospital_id>/top_reviews')
+def hospital_top_reviews(hospital_id):
+    """1病院の上位k件: 最もポジティブ / 最もネガティブ / 星評価とのずれが最も大きい口コミ（モデルごと）
+
+    クエリ: k（既定 TOP_REVIEWS_K、最大 TOP_REVIEWS_MAX_K）, model（モデル表示名、省略時は全モデル）
+    分析時に求めた TOP_REVIEWS_K 件までは保存済みの結果から返す。
+    """
+    if analysis_results is None or analysis_results.get('top_reviews') is None:
+        return jsonify({'error': '分析結果がありません'}), 400
+    
+    try:
+        k = int(request.args.get('k', TOP_REVIEWS_K))
+    except ValueError:
+        return jsonify({'error': 'k は整数で指定してください'}), 400
+    if not 1 <= k <= TOP_REVIEWS_MAX_K:
+        return jsonify({'error': f'k は1〜{TOP_REVIEWS_MAX_K}で指定してください'}), 400
+    model = request.args.get('model')
+    scored_data = analysis_results['scored_data']
+    if model and model not in scored_data.display_names:
+        return jsonify({'error': f'モデルが見つかりません: {model}'}), 400
+    
+    top_reviews = analysis_results['top_reviews']
+    if k > top_reviews.k:
+        # 保存済みの件数を超える場合は全行を並べ直すため、受付制御を通す
+        try:
+            ticket = admission.submit(client_id_from_request(request), estimate_cost(
+                len(scored_data), 0, len(scored_data.display_names)
+            ))
+            ticket.wait()
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        with ticket:
+            _, top_reviews = analysis_results['pipeline'].top_reviews(k)
+    selected = top_reviews.hospital(hospital_id, k)
+    if selected is None:
+        return jsonify({'error': f'病院が見つかりません: {hospital_id}'}), 404
+    
+    star_scores = scored_data.star_scores
+    result = {}
+    for kind in TOP_REVIEW_KINDS:
+        result[kind] = {}
+        for display_name, rows in selected[kind].items():
+            if model and display_name != model:
+                continue
+            m = scored_data.display_names.index(display_name)
+            result[kind][display_name] = [
+                {**review_record(scored_data, row),
+                 'disagreement': float(abs(scored_data.scores[row, m] - star_scores[row]))
+                 if not np.isnan(star_scores[row]) else None}
+                for row in rows
+            ]
+    
+    return jsonify(convert_numpy_types({
+        'success': True,
+        'hospital_id': hospital_id,
+        'k': k,
+        'review_count': analysis_results['hospital_index'].review_count(hospital_id),
+        **result
+    }))
+
+@app.route('/search')
+def search_reviews():
+    """口コミのキーワード検索（転置インデックス使用）
+
+    クエリ: q（空白区切りでAND検索）, hospital_id（任意）, page, per_page
+    一致した口コミと、一致分についてのモデル別スコア集計を返す。
+    """
+    if analysis_results is None or analysis_results.get('search_index') is None:
+        return jsonify({'error': '分析結果がありません'}), 400
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '検索語を指定してください'}), 400
+    try:
+        page, per_page = pagination_args()
+    except ValueError as e:
+        return jsonify({'error': f'パラメータが不正です: {str(e)}'}), 400
+    
+    scored_data = analysis_results['scored_data']
+    candidates = None
+    hospital_id = request.args.get('hospital_id')
+    if hospital_id:
+        candidates = analysis_results['hospital_index'].rows(hospital_id)
+        if candidates is None:
+            return jsonify({'error': f'病院が見つかりません: {hospital_id}'}), 404
+        candidates = np.sort(candidates)
+    
+    rows = analysis_results['search_index'].search(query, candidates)
+    
+    # 一致した口コミのモデル別スコア集計
+    summary = {}
+    if len(rows):
+        star_ratings = scored_data.star_ratings[rows]
+        rated = star_ratings > 0
+        summary['star_score_mean'] = float(np.mean(star_ratings[rated] - 3)) if rated.any() else None
+        for m, display_name in enumerate(scored_data.display_names):
+            model_scores = scored_data.scores[rows, m]
+            summary[display_name] = {
+                'mean': float(model_scores.mean()),
+                'std': float(model_scores.std()),
+                'min': float(model_scores.min()),
+                'max': float(model_scores.max())
+            }
+    
+    start = (page - 1) * per_page
+    return jsonify(convert_numpy_types({
+        'success': True,
+        'query': query,
+        'hospital_id': hospital_id,
+        'total': len(rows),
+        'page': page,
+        'per_page': per_page,
+        'pages': -(-len(rows) // per_page),
+        'summary': summary,
+        'reviews': [review_record(scored_data, row) for row in rows[start:start + per_page]]
+    }))
+
+@app.route('/near_duplicates')
+def near_duplicates():
+    """近似重複口コミのクラスタ統計（病院ごとの重複率、大きいクラスタ上位）
+
+    クエリ: top（大きいクラスタの表示件数）, verify=1（代表スコア流用の抽出確認を含める）
+    分析前でもアップロード済みのデータがあれば計算できる。
+    """
+    if uploaded_data is None:
+        return jsonify({'error': 'データがアップロードされていません'}), 400
+    pipeline = get_pipeline(uploaded_data)
+    
+    try:
+        top = int(request.args.get('top', 10))
+    except ValueError as e:
+        return jsonify({'error': f'パラメータが不正です: {str(e)}'}), 400
+    
+    try:
+        _, report = pipeline.near_duplicate_report(top=max(0, min(top, 100)))
+        response = {'success': True, 'settings': NEAR_DUPLICATE_SETTINGS, **report}
+        if request.args.get('verify') == '1':
+            # 抽出確認はスコア計算（未分析なら全モデルの推論）を伴うため、受付制御を通す
+            try:
+                ticket = admission.submit(client_id_from_request(request), estimate_cost(
+                    len(uploaded_data), int(uploaded_data['review_text'].astype(str).str.len().sum()), len(MODELS)
+                ))
+                ticket.wait()
+            except AdmissionRejected as e:
+                return admission_rejected_response(e)
+            with ticket:
+                response['verification'] = {
+                    display_name: pipeline.near_duplicate_check(model_name)[1]
+                    for model_name, display_name in MODELS.items()
+                }
+        return jsonify(convert_numpy_types(response))
+    except Exception as e:
+        print(f"近似重複集計エラー: {e}")
+        return jsonify({'error': f'近似重複集計エラー: {str(e)}'}), 500
+
 @app.route('/statistical_test', methods=['POST'])
 def statistical_test():
     global analysis_results
@@ -826,55 +2342,34 @@ def statistical_test():
         if model1_col not in hospital_stats.columns or model2_col not in hospital_stats.columns:
             return jsonify({'error': 'モデルデータが見つかりません'}), 400
         
-        # データ準備
-        star_scores = hospital_stats['star_score'].values
-        model1_scores = hospital_stats[model1_col].values
-        model2_scores = hospital_stats[model2_col].values
-        
+        pipeline = analysis_results['pipeline']
         print(f"統計検定開始: {model1} vs {model2}")
-        print(f"データ数: {len(star_scores)}")
         
-        # オリジナルのMAEを計算
-        mae1 = mean_absolute_error(star_scores, model1_scores)
-        mae2 = mean_absolute_error(star_scores, model2_scores)
+        # オリジナルのMAE（metrics ステージ）
+        mae1 = pipeline.metrics(model1)[1]['mae']
+        mae2 = pipeline.metrics(model2)[1]['mae']
         
         print(f"オリジナルMAE: {model1}={mae1:.4f}, {model2}={mae2:.4f}")
         
-        # ブートストラップ法による検定
-        bootstrap_iterations = 10000
-        mae_differences = []
-        
-        np.random.seed(42)  # 再現可能な結果のため
-        
-        for i in range(bootstrap_iterations):
-            # ブートストラップサンプリング
-            n = len(star_scores)
-            indices = np.random.choice(n, size=n, replace=True)
-            
-            # リサンプリングされたデータでMAE計算
-            boot_star = star_scores[indices]
-            boot_model1 = model1_scores[indices]
-            boot_model2 = model2_scores[indices]
-            
-            boot_mae1 = mean_absolute_error(boot_star, boot_model1)
-            boot_mae2 = mean_absolute_error(boot_star, boot_model2)
-            
-            # MAEの差を記録
-            mae_diff = boot_mae2 - boot_mae1
-            mae_differences.append(mae_diff)
-            
-            # 進捗表示（1000回ごと）
-            if (i + 1) % 1000 == 0:
-                print(f"ブートストラップ進捗: {i + 1}/{bootstrap_iterations}")
-        
-        # 95%信頼区間を計算
-        mae_differences = np.array(mae_differences)
-        confidence_interval = [
-            float(np.percentile(mae_differences, 2.5)),
-            float(np.percentile(mae_differences, 97.5))
-        ]
-        
-        print(f"95%信頼区間: [{confidence_interval[0]:.4f}, {confidence_interval[1]:.4f}]")
+        # ブートストラップ法による検定（固定シード。/analyze と同じ設定なら計算済みの結果を再利用）
+        try:
+            overrides = data.get('bootstrap') or {}
+            if not isinstance(overrides, dict):
+                raise BootstrapSettingsError('bootstrap はオブジェクトで指定してください')
+            settings = bootstrap_settings({**(analysis_results.get('bootstrap_settings') or {}), **overrides})
+        except BootstrapSettingsError as e:
+            return jsonify({'error': f'ブートストラップ設定が不正です: {str(e)}'}), 400
+        try:
+            ticket = admission.submit(client_id_from_request(request), estimate_cost(
+                0, 0, 0, n_bootstrap=settings['n_bootstrap'], bootstrap_rows=len(hospital_stats), n_bootstrap_tests=1
+            ))
+            ticket.wait()
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        with ticket:
+            _, test_results = pipeline.mae_test(model1, model2, settings)
+        confidence_interval = [float(ci) for ci in test_results['confidence_interval']]
+        bootstrap_iterations = test_results['n_replicates']
         
         # 結果をまとめる
         result = {
@@ -885,6 +2380,7 @@ def statistical_test():
             'mae_difference': float(mae2 - mae1),
             'confidence_interval': confidence_interval,
             'bootstrap_iterations': bootstrap_iterations,
+            'p_value': float(test_results['p_value']),
             'is_significant': confidence_interval[0] > 0 or confidence_interval[1] < 0
         }
         
@@ -949,6 +2445,7 @@ def load_sample_data():
         
         # uploaded_data にセット
         uploaded_data = df
+        start_prescoring(df)
         
         # 基本統計量計算
         total_reviews = len(df)
@@ -1007,6 +2504,7 @@ def load_sample():
         df = df[(df['star_rating'] >= 1) & (df['star_rating'] <= 5)]
         
         uploaded_data = df
+        start_prescoring(df)
         
         # 基本統計量計算
         total_reviews = len(df)
@@ -1071,6 +2569,8 @@ if __name__ == '__main__':
     logger.info(f"📊 Models configured: {len(MODELS)}")
     logger.info(f"🎯 Mock mode: {os.environ.get('USE_MOCK_MODELS', 'false')}")
     
+    start_import_warmup()
+    
     app.run(
         debug=debug, 
         host='0.0.0.0', 
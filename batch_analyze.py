@@ -0,0 +1,231 @@
+"""動物病院口コミ分析 - バッチ実行用CLI（Flaskサーバー不要）
+
+使い方:
+    python batch_analyze.py reviews.csv --out-dir results/
+    python batch_analyze.py reviews.parquet --backend bert --workers 4
+
+入力CSV/Parquetをチャンク単位で読み込み、プロセスプールで全コアを使って
+スコア化し、スコア付きの行（scored_rows.csv）と分析レポート（report.json）を書き出す。
+"""
+import os
+import sys
+import json
+import argparse
+import importlib.util
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from upload_formats import REQUIRED_COLUMNS, validate_reviews
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ワーカープロセスごとに読み込むアプリモジュール
+_backend_module = None
+
+
+def load_backend(backend):
+    """スコア計算に使うアプリモジュールを読み込む（mock: app.py, bert: app-full-bert.py）"""
+    if backend == 'mock':
+        import app
+        return app
+    path = os.path.join(BASE_DIR, 'app-full-bert.py')
+    spec = importlib.util.spec_from_file_location('app_full_bert', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def iter_chunks(path, chunk_size, dtype=None):
+    """CSV/Parquetを必要な列だけチャンク単位で読み込む（dtype: CSVの列の型の指定）"""
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("Parquetの読み込みには pyarrow が必要です: pip install pyarrow")
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=REQUIRED_COLUMNS):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_size, usecols=REQUIRED_COLUMNS, dtype=dtype):
+            yield chunk
+
+
+def validate_chunk(df):
+    """/upload と同じ星評価のチェック（数値化・1-5の範囲）"""
+    return validate_reviews(df)
+
+
+def _init_worker(backend, threads_per_worker):
+    global _backend_module
+    _backend_module = load_backend(backend)
+    # フルBERT版はモデルを遅延読み込みするため、ワーカー起動時に読み込んでおく
+    ensure_loaded = getattr(_backend_module.analyzer, 'ensure_loaded', None)
+    if ensure_loaded is not None:
+        ensure_loaded()
+    torch = getattr(_backend_module, 'torch', None)
+    if torch is not None:
+        torch.set_num_threads(threads_per_worker)
+
+
+def _score_chunk(df):
+    return _backend_module.calculate_scores(df.reset_index(drop=True))
+
+
+def build_report(module, scored, n_bootstrap, settings=None):
+    """/analyze と同じ指標（MAE・相関・ブートストラップ検定）をまとめる"""
+    from scipy.stats import pearsonr
+
+    hospital_stats = module.aggregate_by_hospital(scored)
+    display_names = list(module.MODELS.values())
+    star_scores = scored['star_score'].to_numpy()
+    model_scores = {display_name: scored[f'{display_name}_score'].to_numpy() for display_name in display_names}
+    point_correlations = {
+        display_name: pearsonr(star_scores, model_scores[display_name])
+        for display_name in display_names
+    }
+    star_distribution = scored['star_rating'].value_counts().sort_index().to_dict()
+    return assemble_report(hospital_stats, display_names, star_scores, model_scores,
+                           point_correlations, star_distribution, n_bootstrap, settings)
+
+
+def assemble_report(hospital_stats, display_names, star_scores, model_scores,
+                    point_correlations, star_distribution, n_bootstrap, settings=None):
+    """集計済みの病院統計・スコア配列からレポートを組み立てる（シャード集約と共通）"""
+    import app
+
+    settings = settings or app.bootstrap_settings()
+
+    performance_metrics = {}
+    correlations = {}
+    for display_name in display_names:
+        model_col = f'{display_name}_score'
+        mae = float(np.mean(np.abs(hospital_stats['star_score'] - hospital_stats[model_col])))
+        correlation, p_value = point_correlations[display_name]
+        bootstrap_result = app.bootstrap_correlation_ci(
+            np.asarray(star_scores).tolist(),
+            np.asarray(model_scores[display_name]).tolist(),
+            n_bootstrap=n_bootstrap,
+            settings=settings
+        )
+        performance_metrics[display_name] = {
+            'correlation': float(correlation),
+            'p_value': float(p_value),
+            'mae': mae
+        }
+        correlations[display_name] = {
+            'correlation': float(correlation),
+            'p_value': float(p_value),
+            'ci_lower': float(bootstrap_result['ci_lower']),
+            'ci_upper': float(bootstrap_result['ci_upper']),
+            'significant': bool(p_value < 0.05),
+            'sample_size': len(star_scores),
+            'n_replicates': bootstrap_result['n_replicates'],
+            'ci_method': bootstrap_result['method']
+        }
+
+    # 全ての組のMAE差検定を1回のブートストラップでまとめて計算
+    errors = np.abs(hospital_stats[['star_score']].to_numpy(dtype=float)
+                    - hospital_stats[[f'{display_name}_score' for display_name in display_names]].to_numpy(dtype=float))
+    model_performance_tests = {}
+    pairwise_tests = app.pairwise_mae_difference_tests(errors, display_names, n_bootstrap=n_bootstrap, settings=settings)
+    for comparison, test_results in pairwise_tests.items():
+        model_performance_tests[comparison] = {
+            'mae_difference': test_results['mean_difference'],
+            'p_value': test_results['p_value'],
+            'ci_lower': test_results['confidence_interval'][0],
+            'ci_upper': test_results['confidence_interval'][1],
+            'significant': bool(test_results['p_value'] < 0.05),
+            'n_replicates': test_results['n_replicates']
+        }
+
+    hospital_analysis = {
+        str(row['hospital_id']): {
+            'review_count': int(row['review_count']),
+            'avg_rating': float(row['star_score']),
+            **{display_name: float(row[f'{display_name}_score']) for display_name in display_names}
+        }
+        for _, row in hospital_stats.iterrows()
+    }
+
+    # 星評価 = 星評価スコア + 3
+    star_ratings = np.asarray(star_scores, dtype=float) + 3
+    return app.convert_numpy_types({
+        'basic_stats': {
+            'total_reviews': len(star_ratings),
+            'unique_hospitals': len(hospital_stats),
+            'avg_rating': float(star_ratings.mean()),
+            'rating_std': float(star_ratings.std(ddof=1)) if len(star_ratings) > 1 else 0.0
+        },
+        'model_comparison': performance_metrics,
+        'star_rating_distribution': star_distribution,
+        'sentiment_correlation': {'correlations': correlations},
+        'hospital_analysis': hospital_analysis,
+        'model_performance_tests': model_performance_tests,
+        'n_bootstrap': n_bootstrap,
+        'bootstrap_settings': settings
+    })
+
+
+def run(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    rows_path = os.path.join(args.out_dir, 'scored_rows.csv')
+    report_path = os.path.join(args.out_dir, 'report.json')
+
+    workers = args.workers or os.cpu_count() or 1
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    module = load_backend(args.backend)
+    score_columns = [f'{display_name}_score' for display_name in module.MODELS.values()]
+
+    print(f"🚀 バッチ分析開始: {args.input} (backend={args.backend}, workers={workers})")
+
+    # レポート用にはテキストを除いた数値列だけを保持する
+    slim_frames = []
+    total = 0
+    with open(rows_path, 'w', encoding='utf-8-sig', newline='') as rows_file:
+        with Pool(workers, initializer=_init_worker, initargs=(args.backend, threads_per_worker)) as pool:
+            chunks = (validate_chunk(chunk) for chunk in iter_chunks(args.input, args.chunk_size))
+            for i, scored in enumerate(pool.imap(_score_chunk, chunks)):
+                scored.to_csv(rows_file, index=False, header=(i == 0))
+                slim_frames.append(scored[['hospital_id', 'star_rating', 'star_score'] + score_columns])
+                total += len(scored)
+                print(f"📦 チャンク {i + 1} 完了: 累計 {total} 件")
+
+    if total == 0:
+        sys.exit("有効なデータがありません")
+
+    scored = pd.concat(slim_frames, ignore_index=True)
+    np.random.seed(args.seed)
+    import app
+    settings = app.bootstrap_settings({'n_bootstrap': args.n_bootstrap, 'mode': args.bootstrap_mode})
+    # 回数は BOOTSTRAP_LIMITS の範囲に丸めた値を使う（レポートの n_bootstrap も同じ値）
+    report = build_report(module, scored, settings['n_bootstrap'], settings)
+    report['input'] = os.path.abspath(args.input)
+    report['backend'] = args.backend
+    report['generated_at'] = datetime.now().isoformat()
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ 完了: {rows_path}, {report_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='動物病院口コミのバッチ感情分析')
+    parser.add_argument('input', help='入力ファイル（.csv または .parquet）')
+    parser.add_argument('--out-dir', default='batch_results', help='出力ディレクトリ')
+    parser.add_argument('--backend', choices=['mock', 'bert'], default='mock',
+                        help='mock: app.py のアナライザー, bert: app-full-bert.py のフルBERT')
+    parser.add_argument('--workers', type=int, default=None, help='ワーカープロセス数（既定: CPUコア数）')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='1チャンクあたりの行数')
+    parser.add_argument('--n-bootstrap', type=int, default=10000, help='ブートストラップ回数')
+    parser.add_argument('--bootstrap-mode', choices=['fixed', 'adaptive'], default='fixed',
+                        help='adaptive: 信頼区間が収束した時点で打ち切り')
+    parser.add_argument('--seed', type=int, default=42, help='ブートストラップの乱数シード')
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""動物病院口コミ分析 - ベンチマーク
+
+使い方:
+    python benchmark.py                 # import時間プロファイル + スコア計算
+    python benchmark.py --top 30 > bench_output.txt
+
+import時間は `python -X importtime` を別プロセスで実行して計測する
+（コールドスタート時と同じ条件にするため）。
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def profile_imports(label, statement, top=15):
+    """python -X importtime の出力を集計し、累積時間の大きいモジュールを返す"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=BASE_DIR, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # 先頭の空白1つの後、ネストの深さごとに2スペースずつインデントされる
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+
+    # 直接importされたモジュール（深さ1まで）を累積時間順に並べる
+    top_level = [r for r in rows if r[3] == 0]
+    direct = sorted((r for r in rows if r[3] <= 1), key=lambda r: r[2], reverse=True)
+    return {
+        'label': label,
+        'returncode': result.returncode,
+        'wall_ms': wall_ms,
+        'total_import_ms': sum(r[2] for r in top_level) / 1000,
+        'top_modules': direct[:top]
+    }
+
+
+def print_import_report(report):
+    print(f"\n=== import時間プロファイル: {report['label']} ===")
+    if report['returncode'] != 0:
+        print("  ⚠️ importに失敗しました（依存関係を確認してください）")
+    print(f"  プロセス全体: {report['wall_ms']:.0f}ms / import合計: {report['total_import_ms']:.0f}ms")
+    print(f"  {'モジュール':<40} {'累積(ms)':>10} {'自身(ms)':>10}")
+    for name, self_us, cumulative_us, _ in report['top_modules']:
+        print(f"  {name:<40} {cumulative_us / 1000:>10.1f} {self_us / 1000:>10.1f}")
+
+
+def benchmark_scoring(repeat=3):
+    """サンプルデータでのスコア計算時間（mockアナライザー）"""
+    import pandas as pd
+    import app
+
+    data = pd.read_csv(os.path.join(BASE_DIR, 'sample_data.csv'))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        app.calculate_scores(data.copy())
+        timings.append((time.perf_counter() - start) * 1000)
+    return len(data), timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='起動時間・スコア計算のベンチマーク')
+    parser.add_argument('--top', type=int, default=15, help='表示するモジュール数')
+    parser.add_argument('--skip-scoring', action='store_true', help='スコア計算の計測を省略')
+    args = parser.parse_args(argv)
+
+    statements = [
+        ('app.py', 'import app'),
+        ('app.py + ウォームアップ', 'import app; app.warm_up_imports()'),
+        ('app-full-bert.py', "import importlib.util; spec = importlib.util.spec_from_file_location('app_full_bert', "
+                             "'app-full-bert.py'); module = importlib.util.module_from_spec(spec); "
+                             "spec.loader.exec_module(module)"),
+    ]
+    for label, statement in statements:
+        print_import_report(profile_imports(label, statement, args.top))
+
+    if not args.skip_scoring:
+        rows, timings = benchmark_scoring()
+        print(f"\n=== スコア計算（{rows}件 × 3モデル）===")
+        print(f"  最小: {min(timings):.0f}ms / 平均: {sum(timings) / len(timings):.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
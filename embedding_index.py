@@ -0,0 +1,193 @@
+"""動物病院口コミ分析 - 口コミ埋め込みの保存と近傍検索
+
+- 埋め込みは float16 の .npy（np.memmap）として保存し、検索時は必要なブロックだけ読む
+  （一時ファイルに書いてから os.replace で置き換えるため、既存のファイルを開いている検索は影響を受けない）
+- 完全探索: ブロックごとの行列積 + argpartition で上位k件（コサイン類似度）
+- 近似探索: 球面k-meansによる粗い量子化（IVF）で、近いクラスタの行だけを完全探索
+- 病院ごとのトピッククラスタリング（球面k-means）
+"""
+import os
+import threading
+import uuid
+
+import numpy as np
+
+# 1回の行列積で読み込む行数（float16 → float32 変換のメモリ使用量の制御）
+BLOCK_ROWS = 8192
+
+
+class EmbeddingStore:
+    """1モデル分の埋め込み行列（float16 のメモリマップ、次元は最初の書き込みで決まる）
+
+    書き込みは同じディレクトリの一時ファイルに行い、close で path に置き換える。
+    """
+    def __init__(self, path, n_rows):
+        self.path = path
+        self.n_rows = n_rows
+        self.matrix = None
+        self.tmp_path = f'{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp'
+
+    def write(self, row, vector):
+        if self.matrix is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.matrix = np.lib.format.open_memmap(
+                self.tmp_path, mode='w+', dtype=np.float16, shape=(self.n_rows, len(vector))
+            )
+        self.matrix[row] = vector
+
+    def close(self):
+        """ディスクに書き出して path に置き換え、読み取り専用のメモリマップを返す（未書き込みなら None）"""
+        if self.matrix is None:
+            return None
+        self.matrix.flush()
+        del self.matrix
+        self.matrix = None
+        os.replace(self.tmp_path, self.path)
+        return np.load(self.path, mmap_mode='r')
+
+    def discard(self):
+        """途中で失敗した場合に一時ファイルを削除"""
+        if self.matrix is not None:
+            del self.matrix
+            self.matrix = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def spherical_kmeans(vectors, k, n_iter=10, seed=0):
+    """正規化済みベクトルの球面k-means（ラベル, 正規化済みの重心）"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    labels = np.zeros(len(vectors), dtype=np.int64)
+
+    for _ in range(n_iter):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = ~sums.any(axis=1)
+        # 空のクラスタは元の重心を残す
+        sums[empty] = centroids[empty]
+        centroids = _normalize(sums)
+    return labels, centroids
+
+
+class EmbeddingIndex:
+    """埋め込み行列（float16 memmap）に対するコサイン類似度の近傍検索"""
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.norms = np.concatenate([
+            np.linalg.norm(block, axis=1) for block in self._blocks()
+        ]) if len(matrix) else np.empty(0, dtype=np.float32)
+        self.centroids = None
+        self.lists = None
+        self.ivf_lock = threading.Lock()
+
+    def _blocks(self, rows=None):
+        """float32 に変換したブロックを順に返す（rows 指定時はその行のみ）"""
+        n = len(self.matrix) if rows is None else len(rows)
+        for start in range(0, n, BLOCK_ROWS):
+            if rows is None:
+                yield np.asarray(self.matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            else:
+                yield np.asarray(self.matrix[rows[start:start + BLOCK_ROWS]], dtype=np.float32)
+
+    def vector(self, row):
+        return np.asarray(self.matrix[row], dtype=np.float32)
+
+    def build_ivf(self, n_lists=None, n_iter=10, sample_size=20000, seed=0):
+        """近似探索用の粗い量子化（k-meansの重心と、重心ごとの行リスト）"""
+        n = len(self.matrix)
+        n_lists = n_lists or max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, min(n, sample_size), replace=False))
+        _, centroids = spherical_kmeans(
+            _normalize(np.asarray(self.matrix[sample], dtype=np.float32)), n_lists, n_iter, seed
+        )
+        labels = np.concatenate([
+            np.argmax(_normalize(block) @ centroids.T, axis=1) for block in self._blocks()
+        ])
+        order = np.argsort(labels, kind='stable')
+        offsets = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+        # 検索中のスレッドが途中の状態を見ないよう、重心 → 行リストの順にまとめて設定
+        self.centroids = centroids
+        self.lists = [order[offsets[c]:offsets[c + 1]] for c in range(len(centroids))]
+        print(f"近似検索インデックス作成: {n}件, {len(centroids)}クラスタ")
+        return self
+
+    def ensure_ivf(self):
+        """近似探索用のインデックスを一度だけ作成（同時に検索されても1回だけ）"""
+        if self.lists is None:
+            with self.ivf_lock:
+                if self.lists is None:
+                    self.build_ivf()
+        return self
+
+    def search(self, query, k=10, mode='exact', nprobe=8, exclude=None):
+        """上位k件の (行番号, コサイン類似度)。mode='approx' は近いクラスタ nprobe 個のみ探索"""
+        query = np.asarray(query, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0 or len(self.matrix) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = query / query_norm
+
+        if mode == 'approx':
+            self.ensure_ivf()
+            probes = np.argsort(-(self.centroids @ query))[:nprobe]
+            rows = np.sort(np.concatenate([self.lists[c] for c in probes]))
+        else:
+            rows = None
+
+        candidate_rows = []
+        candidate_sims = []
+        offset = 0
+        for block in self._blocks(rows):
+            block_rows = np.arange(offset, offset + len(block)) if rows is None else rows[offset:offset + len(block)]
+            offset += len(block)
+            norms = self.norms[block_rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sims = np.where(norms > 0, (block @ query) / norms, -np.inf)
+            if exclude is not None:
+                sims[block_rows == exclude] = -np.inf
+            # ブロックごとに上位k件だけ残す
+            if len(sims) > k:
+                top = np.argpartition(-sims, k)[:k]
+                block_rows, sims = block_rows[top], sims[top]
+            candidate_rows.append(block_rows)
+            candidate_sims.append(sims)
+
+        if not candidate_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(candidate_rows)
+        sims = np.concatenate(candidate_sims)
+        order = np.argsort(-sims, kind='stable')[:k]
+        order = order[np.isfinite(sims[order])]
+        return rows[order], sims[order]
+
+    def cluster(self, rows, k=5, n_iter=20, seed=0):
+        """指定行（例: 1病院の口コミ）のトピッククラスタリング
+
+        戻り値: クラスタごとに (行番号の配列（重心に近い順）, 重心との類似度) のリスト（大きい順）
+        """
+        rows = np.asarray(rows)
+        rows = rows[self.norms[rows] > 0]
+        if len(rows) == 0:
+            return []
+        vectors = _normalize(np.asarray(self.matrix[rows], dtype=np.float32))
+        labels, centroids = spherical_kmeans(vectors, k, n_iter, seed)
+        sims = np.einsum('ij,ij->i', vectors, centroids[labels])
+
+        clusters = []
+        for c in range(len(centroids)):
+            members = np.flatnonzero(labels == c)
+            if len(members) == 0:
+                continue
+            members = members[np.argsort(-sims[members], kind='stable')]
+            clusters.append((rows[members], sims[members]))
+        clusters.sort(key=lambda cluster: len(cluster[0]), reverse=True)
+        return clusters
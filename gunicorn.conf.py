@@ -9,7 +9,7 @@ backlog = 2048
 workers = 1  # Render free tier limitation
 worker_class = "sync"
 worker_connections = 1000
-timeout = 30
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))  # admission.py の待ち時間の上限もこの値から決める
 keepalive = 2
 
 # Restart workers after this many requests
@@ -26,4 +26,15 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 proc_name = "veterinary-bert-analysis"
 
 # Preload app for better performance
-preload_app = True
\ No newline at end of file
+preload_app = True
+
+# Warm up lazily imported libraries / models in each worker
+def post_worker_init(worker):
+    """ワーカー起動後、ライブラリ読み込みとモデルのウォームアップをバックグラウンドで開始"""
+    import sys
+    app_module = sys.modules.get('app')
+    if app_module is not None and hasattr(app_module, 'start_import_warmup'):
+        app_module.start_import_warmup()
+    bert_module = sys.modules.get('app-full-bert')
+    if bert_module is not None and hasattr(bert_module, 'start_model_warmup'):
+        bert_module.start_model_warmup()
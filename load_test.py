@@ -0,0 +1,329 @@
+"""動物病院口コミ分析 - 負荷試験（ローカルのgunicornに対して同時ユーザーのシナリオを実行）
+
+使い方:
+    python load_test.py                                  # 現在の設定（1ワーカー, sync）で8ユーザー
+    python load_test.py --configs 1:sync 2:sync 2:gthread:4 --users 16 --iterations 3
+    python load_test.py --latency-ms 40 --cpu-share 0.8 --output load_test_results.json
+
+各ユーザーは upload → analyze → get_charts → statistical_test → export_results を繰り返す。
+BERTの推論は偽のスコアラー（1件あたり latency_ms ± jitter、うち cpu_share をCPUビジーループ、
+残りを待機）に置き換えるため、モデルのダウンロードなしで実行できる。
+ワーカー構成（ワーカー数:ワーカークラス[:スレッド数]）ごとにサーバーを起動し、
+エンドポイント別の p50/p95/p99 レイテンシ、エラー率、スループットを出力する。
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import socket
+import argparse
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_registry import load_model_registry
+
+# /statistical_test で比較する2モデル（サーバーと同じモデル設定の先頭2つ）
+COMPARED_MODELS = [spec.display_name for spec in load_model_registry('app')[:2]]
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = ['upload', 'analyze', 'get_charts', 'statistical_test', 'export_results', 'flow']
+
+POSITIVE_PHRASES = ['先生がとても親切でした', 'スタッフの対応が丁寧で安心できました', '院内が清潔です', '説明が的確で頼りになります']
+NEGATIVE_PHRASES = ['待ち時間が長いです', '料金が高いと感じました', '駐車場が狭くて不便です', '説明が不十分で不安でした']
+NEUTRAL_PHRASES = ['予約して行きました', '犬の健康診断で利用しました', '猫のワクチン接種です', '駅から歩いて10分ほどです']
+
+
+class FakeBertScorer:
+    """BERT推論の代わり（mockの感情分析の前に、推論と同程度の時間とCPUを使う）
+
+    latency_ms: 1件あたりの平均処理時間, jitter: 標準偏差（平均に対する割合）,
+    cpu_share: 処理時間のうちCPUを使う割合（残りはsleep）
+    """
+    def __init__(self, analyze, latency_ms=20.0, jitter=0.2, cpu_share=1.0, seed=0):
+        self.analyze = analyze
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.cpu_share = cpu_share
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self, text, model_name):
+        with self.lock:
+            latency = max(0.0, self.rng.gauss(self.latency_ms, self.latency_ms * self.jitter)) / 1000
+        cpu_seconds = latency * self.cpu_share
+        # CPUビジーループ（推論の計算部分）
+        deadline = time.perf_counter() + cpu_seconds
+        while time.perf_counter() < deadline:
+            pass
+        if latency > cpu_seconds:
+            time.sleep(latency - cpu_seconds)
+        return self.analyze(text, model_name)
+
+
+def create_app():
+    """gunicorn用のアプリ（app.py の感情分析を偽のスコアラーに置き換える）
+
+    設定は環境変数 LOAD_TEST_LATENCY_MS / LOAD_TEST_JITTER / LOAD_TEST_CPU_SHARE
+    """
+    import app as app_module
+
+    analyzer = app_module.analyzer
+    analyzer.analyze_sentiment = FakeBertScorer(
+        analyzer.analyze_sentiment,
+        latency_ms=float(os.environ.get('LOAD_TEST_LATENCY_MS', 20)),
+        jitter=float(os.environ.get('LOAD_TEST_JITTER', 0.2)),
+        cpu_share=float(os.environ.get('LOAD_TEST_CPU_SHARE', 1.0))
+    )
+    return app_module.app
+
+
+def make_dataset_csv(n_rows, n_hospitals, seed):
+    """負荷試験用の口コミCSV（hospital_id, review_text, star_rating）"""
+    rng = random.Random(seed)
+    lines = ['hospital_id,review_text,star_rating']
+    for i in range(n_rows):
+        star = rng.randint(1, 5)
+        phrases = POSITIVE_PHRASES if star >= 4 else NEGATIVE_PHRASES if star <= 2 else NEUTRAL_PHRASES
+        text = '。'.join(rng.sample(phrases, 2) + [rng.choice(NEUTRAL_PHRASES)]) + f'（{seed}-{i}）'
+        lines.append(f'H{rng.randrange(n_hospitals):04d},{text},{star}')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def parse_config(spec):
+    """'ワーカー数:ワーカークラス[:スレッド数]'（例: 2:gthread:4）"""
+    parts = spec.split(':')
+    return {
+        'label': spec,
+        'workers': int(parts[0]),
+        'worker_class': parts[1] if len(parts) > 1 else 'sync',
+        'threads': int(parts[2]) if len(parts) > 2 else 1
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(config, port, args):
+    """gunicorn.conf.py の設定にワーカー構成だけを上書きしてサーバーを起動"""
+    env = dict(os.environ,
+               LOAD_TEST_LATENCY_MS=str(args.latency_ms),
+               LOAD_TEST_JITTER=str(args.jitter),
+               LOAD_TEST_CPU_SHARE=str(args.cpu_share))
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', os.path.join(BASE_DIR, 'gunicorn.conf.py'),
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(config['workers']),
+        '--worker-class', config['worker_class'],
+        '--threads', str(config['threads']),
+        '--access-logfile', '/dev/null',
+        'load_test:create_app()'
+    ]
+    if args.timeout is not None:
+        command[-1:-1] = ['--timeout', str(args.timeout)]
+    log = open(os.path.join(args.log_dir, f"server_{config['label'].replace(':', '_')}.log"), 'wb')
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log = log
+    return process
+
+
+def wait_until_ready(session, base_url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'サーバーが終了しました（終了コード {process.returncode}）')
+        try:
+            if session.get(f'{base_url}/healthz', timeout=2).status_code == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('サーバーの起動がタイムアウトしました')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    process.log.close()
+
+
+class Recorder:
+    """リクエストごとの (エンドポイント, レイテンシ秒, 成功) を記録"""
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, endpoint, elapsed, ok, detail=None):
+        with self.lock:
+            self.records.append((endpoint, elapsed, ok, detail))
+
+
+def timed_request(recorder, endpoint, send):
+    """リクエストを送って記録（HTTPエラー・例外はエラーとして数える）。レスポンス（失敗時 None）を返す"""
+    start = time.perf_counter()
+    try:
+        response = send()
+        ok = response.status_code < 400
+        recorder.add(endpoint, time.perf_counter() - start, ok, None if ok else f'HTTP {response.status_code}')
+        return response if ok else None
+    except Exception as e:
+        recorder.add(endpoint, time.perf_counter() - start, False, type(e).__name__)
+        return None
+
+
+def run_user_flow(session, base_url, csv_bytes, recorder, args):
+    """1ユーザー1回分のシナリオ（途中で失敗したら以降のステップは行わない）"""
+    timeout = args.request_timeout
+    flow_start = time.perf_counter()
+
+    response = timed_request(recorder, 'upload', lambda: session.post(
+        f'{base_url}/upload', files={'file': ('reviews.csv', io.BytesIO(csv_bytes), 'text/csv')}, timeout=timeout
+    ))
+    if response is None:
+        recorder.add('flow', time.perf_counter() - flow_start, False, 'upload')
+        return
+
+    body = {'data': response.json()['data']}
+    if args.bootstrap:
+        body['bootstrap'] = args.bootstrap
+    steps = [
+        ('analyze', lambda: session.post(f'{base_url}/analyze', json=body, timeout=timeout)),
+        ('get_charts', lambda: session.get(f'{base_url}/get_charts', timeout=timeout)),
+        ('statistical_test', lambda: session.post(f'{base_url}/statistical_test', json={
+            'model1': COMPARED_MODELS[0], 'model2': COMPARED_MODELS[1]
+        }, timeout=timeout)),
+        ('export_results', lambda: session.post(f'{base_url}/export_results', json={}, timeout=timeout))
+    ]
+    for endpoint, send in steps:
+        if timed_request(recorder, endpoint, send) is None:
+            recorder.add('flow', time.perf_counter() - flow_start, False, endpoint)
+            return
+    recorder.add('flow', time.perf_counter() - flow_start, True)
+
+
+def run_config(config, datasets, args):
+    """1つのワーカー構成でサーバーを起動し、同時ユーザーのシナリオを実行"""
+    import requests
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    process = start_server(config, port, args)
+    recorder = Recorder()
+    try:
+        with requests.Session() as session:
+            wait_until_ready(session, base_url, process)
+
+        def user(user_id):
+            with requests.Session() as session:
+                for iteration in range(args.iterations):
+                    csv_bytes = datasets[(user_id + iteration) % len(datasets)]
+                    run_user_flow(session, base_url, csv_bytes, recorder, args)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as executor:
+            list(executor.map(user, range(args.users)))
+        wall_seconds = time.perf_counter() - start
+    finally:
+        stop_server(process)
+    return summarize(config, recorder.records, wall_seconds)
+
+
+def summarize(config, records, wall_seconds):
+    """エンドポイント別の件数・エラー率・レイテンシのパーセンタイル・スループット"""
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        rows = [r for r in records if r[0] == endpoint]
+        if not rows:
+            continue
+        latencies = np.array([r[1] for r in rows]) * 1000
+        errors = [r[3] for r in rows if not r[2]]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        endpoints[endpoint] = {
+            'requests': len(rows),
+            'error_rate': len(errors) / len(rows),
+            'errors': {detail: errors.count(detail) for detail in sorted(set(errors))},
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': float(latencies.max()),
+            'throughput_rps': len(rows) / wall_seconds
+        }
+    return {'config': config, 'wall_seconds': wall_seconds, 'endpoints': endpoints}
+
+
+def print_report(summary):
+    config = summary['config']
+    print(f"\n=== ワーカー構成: {config['workers']} × {config['worker_class']}"
+          f"{'' if config['threads'] == 1 else ' (threads=' + str(config['threads']) + ')'}"
+          f" / 経過 {summary['wall_seconds']:.1f}秒 ===")
+    print(f"  {'エンドポイント':<18} {'件数':>6} {'エラー率':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'req/s':>7}")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"  {endpoint:<18} {stats['requests']:>6} {stats['error_rate'] * 100:>7.1f}% "
+              f"{stats['p50_ms']:>9.0f} {stats['p95_ms']:>9.0f} {stats['p99_ms']:>9.0f} {stats['throughput_rps']:>7.2f}")
+        if stats['errors']:
+            print(f"    エラー内訳: {stats['errors']}")
+
+
+def parse_bootstrap(values):
+    """--bootstrap n_bootstrap=1000 resampling=cluster → /analyze の 'bootstrap' 設定"""
+    settings = {}
+    for value in values or []:
+        key, _, setting = value.partition('=')
+        settings[key] = setting
+    return settings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='同時ユーザーの負荷試験（偽のBERTスコアラー使用）')
+    parser.add_argument('--configs', nargs='+', default=['1:sync'],
+                        help='ワーカー構成（ワーカー数:ワーカークラス[:スレッド数]）')
+    parser.add_argument('--users', type=int, default=8, help='同時ユーザー数')
+    parser.add_argument('--iterations', type=int, default=2, help='ユーザーごとのシナリオ実行回数')
+    parser.add_argument('--rows', type=int, default=200, help='1データセットの口コミ数')
+    parser.add_argument('--hospitals', type=int, default=20, help='1データセットの病院数')
+    parser.add_argument('--datasets', type=int, default=1, help='ユーザーが使い分けるデータセット数')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='偽スコアラーの1件あたりの平均処理時間')
+    parser.add_argument('--jitter', type=float, default=0.2, help='処理時間の標準偏差（平均に対する割合）')
+    parser.add_argument('--cpu-share', type=float, default=1.0, help='処理時間のうちCPUを使う割合')
+    parser.add_argument('--bootstrap', nargs='*', help='/analyze のブートストラップ設定（例: n_bootstrap=1000）')
+    parser.add_argument('--timeout', type=int, help='gunicornのワーカータイムアウト（省略時は gunicorn.conf.py）')
+    parser.add_argument('--request-timeout', type=float, default=300.0, help='クライアント側のタイムアウト（秒）')
+    parser.add_argument('--log-dir', default=os.path.join(BASE_DIR, 'load_test_logs'), help='サーバーログの出力先')
+    parser.add_argument('--output', help='結果のJSON出力先')
+    args = parser.parse_args(argv)
+    args.bootstrap = parse_bootstrap(args.bootstrap)
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    datasets = [make_dataset_csv(args.rows, args.hospitals, seed) for seed in range(args.datasets)]
+    print(f"負荷試験: {args.users}ユーザー × {args.iterations}回, {args.rows}件/データセット × {args.datasets}, "
+          f"偽スコアラー {args.latency_ms}ms（CPU {args.cpu_share * 100:.0f}%）")
+
+    summaries = []
+    for spec in args.configs:
+        config = parse_config(spec)
+        print(f"\nサーバー起動: {spec}")
+        summary = run_config(config, datasets, args)
+        print_report(summary)
+        summaries.append(summary)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'settings': {key: value for key, value in vars(args).items()}, 'results': summaries},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
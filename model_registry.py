@@ -0,0 +1,111 @@
+"""動物病院口コミ分析 - 設定ファイルから読み込むモデルレジストリ
+
+models.json（環境変数 MODEL_CONFIG で別のファイルを指定可能）にプロファイルごとのモデル一覧を書く。
+
+- app: 軽量版（app.py）のモデル。backend は mock（キーワード + モデルごとの偏り mock_bias）
+- full_bert: フルBERT版（app-full-bert.py）のモデル。backend は transformers
+
+各モデルの項目:
+    model_id      Hugging Face のモデルID（必須）
+    display_name  画面・スコア列名（{display_name}_score）に使う名前（必須、重複不可）
+    short_name    CSVエクスポートの列名（{short_name}感情スコア）。省略時は display_name
+    backend       transformers / mock
+    batch_size    推論・ウォームアップのバッチサイズ
+    max_length    トークナイザーの最大系列長
+    labels        出力クラスの順番（negative / neutral / positive 以外のラベルはスコアに使わない）
+    precision     推論精度 fp32 / bf16（autocast）/ fp16（重みをfp16、累積はfp32）。非対応の環境では fp32
+    mock_bias     モック分析でのポジティブ寄りの偏り
+"""
+import json
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_CONFIG_PATH = os.environ.get('MODEL_CONFIG', os.path.join(BASE_DIR, 'models.json'))
+
+BACKENDS = ('transformers', 'mock')
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+MODEL_DEFAULTS = {
+    'backend': 'transformers',
+    'batch_size': 8,
+    'max_length': 512,
+    'labels': ['negative', 'positive'],
+    'precision': 'fp32',
+    'mock_bias': 0.0
+}
+
+
+class ModelSpec:
+    """1モデル分の設定"""
+    def __init__(self, model_id, display_name, short_name=None, backend='transformers', batch_size=8,
+                 max_length=512, labels=('negative', 'positive'), precision='fp32', mock_bias=0.0):
+        self.model_id = model_id
+        self.display_name = display_name
+        self.short_name = short_name or display_name
+        self.backend = backend
+        self.batch_size = int(batch_size)
+        self.max_length = int(max_length)
+        self.labels = list(labels)
+        self.precision = precision
+        self.mock_bias = float(mock_bias)
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        return f'ModelSpec({self.model_id!r}, {self.display_name!r}, backend={self.backend!r})'
+
+
+def load_model_registry(profile, path=None):
+    """プロファイルのモデル一覧（ModelSpec のリスト、設定ファイルの順）を読み込む"""
+    path = path or MODEL_CONFIG_PATH
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    entries = config.get('profiles', {}).get(profile)
+    if not entries:
+        raise ValueError(f'モデル設定 {path} にプロファイル {profile} がありません')
+
+    specs = []
+    for entry in entries:
+        unknown = set(entry) - set(MODEL_DEFAULTS) - {'model_id', 'display_name', 'short_name'}
+        if unknown:
+            raise ValueError(f'モデル設定の不明な項目: {sorted(unknown)}')
+        if 'model_id' not in entry or 'display_name' not in entry:
+            raise ValueError(f'モデル設定に model_id / display_name がありません: {entry}')
+        spec = ModelSpec(**{**MODEL_DEFAULTS, **entry})
+        if spec.backend not in BACKENDS:
+            raise ValueError(f'{spec.model_id}: 不明な backend {spec.backend}（{", ".join(BACKENDS)}）')
+        if spec.precision not in PRECISIONS:
+            raise ValueError(f'{spec.model_id}: 不明な precision {spec.precision}（{", ".join(PRECISIONS)}）')
+        if 'positive' not in spec.labels or 'negative' not in spec.labels:
+            raise ValueError(f'{spec.model_id}: labels に positive / negative が必要です')
+        specs.append(spec)
+
+    for field in ('model_id', 'display_name', 'short_name'):
+        values = [getattr(spec, field) for spec in specs]
+        duplicated = sorted({value for value in values if values.count(value) > 1})
+        if duplicated:
+            raise ValueError(f'モデル設定の {field} が重複しています: {duplicated}')
+
+    print(f"モデルレジストリ読み込み: {profile} {len(specs)}モデル ({path})")
+    return specs
+
+
+def models_dict(specs):
+    """モデルID → 表示名（従来の MODELS と同じ形、設定ファイルの順）"""
+    return {spec.model_id: spec.display_name for spec in specs}
+
+
+def check_num_labels(spec, num_labels):
+    """モデルの出力クラス数が設定の labels と一致するか（読み込み時に確認、不一致は ValueError）"""
+    if num_labels != len(spec.labels):
+        raise ValueError(
+            f'{spec.model_id}: 出力クラス数 {num_labels} が設定の labels {list(spec.labels)}（{len(spec.labels)}件）と一致しません'
+        )
+
+
+def sentiment_from_probabilities(probabilities, labels):
+    """クラス確率をラベル名の辞書にする（クラス数が設定と違う場合は ValueError）"""
+    if len(probabilities) != len(labels):
+        raise ValueError(f'クラス確率の数 {len(probabilities)} が labels {list(labels)} と一致しません')
+    return {label: float(probability) for label, probability in zip(labels, probabilities)}
@@ -0,0 +1,155 @@
+"""動物病院口コミ分析 - MinHash + LSH による近似重複口コミのクラスタリング
+
+句読点・名前・絵文字だけが違うテンプレート的な口コミをまとめ、
+スコア計算はクラスタの代表1件だけで行う（推論回数の削減）。
+同じクラスタは病院ごとの重複率（スパムの目安）の集計にも使う。
+
+- シングル: 正規化済みテキストの文字n-gram（既定3文字）を32bitハッシュ化
+- MinHash: h(x) = ((a*x + b) mod 2^64) の上位32bit（multiply-shift）を num_perm 個
+- LSH: 署名を bands 個の帯に分け、帯が一致した組だけ推定Jaccard類似度を確認して union-find で結合
+"""
+import re
+
+import numpy as np
+
+MAX_HASH = (1 << 32) - 1
+# 近似重複の判定では無視する記号（preprocess_text で残る句読点など）
+PUNCTUATION = re.compile(r'[。、，．！？.,!?()（）\-・〜~…「」『』]')
+
+
+def shingle_hashes(text, shingle_size=3):
+    """文字n-gramの32bitハッシュ（重複は最小値に影響しないので除かない）。短いテキストは全体を1シングルとする"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return np.empty(0, dtype=np.uint64)
+    size = min(shingle_size, len(codes))
+    hashes = np.zeros(len(codes) - size + 1, dtype=np.uint64)
+    for j in range(size):
+        hashes = (hashes * np.uint64(1000003) + codes[j:len(codes) - size + 1 + j]) & np.uint64(0xFFFFFFFF)
+    return hashes
+
+
+def minhash_signatures(texts, num_perm=128, shingle_size=3, seed=1, chunk_size=10000):
+    """MinHash署名（n × num_perm, uint32）と、シングルが空の行のマスク"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)  # 奇数の乗数
+    b = rng.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+
+    signatures = np.full((len(texts), num_perm), MAX_HASH, dtype=np.uint32)
+    empty = np.zeros(len(texts), dtype=bool)
+    for start in range(0, len(texts), chunk_size):
+        shingles = [shingle_hashes(PUNCTUATION.sub('', text), shingle_size)
+                    for text in texts[start:start + chunk_size]]
+        lengths = np.array([len(s) for s in shingles])
+        empty[start:start + len(shingles)] = lengths == 0
+        nonempty = np.flatnonzero(lengths)
+        if len(nonempty) == 0:
+            continue
+        values = np.concatenate([shingles[i] for i in nonempty])
+        offsets = np.concatenate([[0], np.cumsum(lengths[nonempty])[:-1]])
+        # ハッシュ関数ごとに全シングルを計算し、口コミごとの最小値を取る（連続メモリで reduceat）
+        for p in range(num_perm):
+            hashed = ((a[p] * values + b[p]) >> np.uint64(32)).astype(np.uint32)
+            signatures[start + nonempty, p] = np.minimum.reduceat(hashed, offsets)
+    return signatures, empty
+
+
+def cluster_near_duplicates(texts, threshold=0.9, num_perm=128, bands=16, shingle_size=3, seed=1):
+    """近似重複クラスタ: 各行の代表行番号（クラスタ内で最小の行番号）を返す
+
+    推定Jaccard類似度が threshold 以上の組を結合する。空のテキストは結合しない。
+    """
+    n = len(texts)
+    signatures, empty = minhash_signatures(texts, num_perm, shingle_size, seed)
+    rows_per_band = num_perm // bands
+    parent = np.arange(n)
+
+    def find(i):
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    valid_rows = np.flatnonzero(~empty)
+    for band in range(bands):
+        # 帯の値をまとめて1つの64bitキーにする（衝突しても下の類似度確認で除外される）
+        block = signatures[valid_rows, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64)
+        band_keys = np.zeros(len(valid_rows), dtype=np.uint64)
+        for column in block.T:
+            band_keys = band_keys * np.uint64(0x100000001B3) + column
+        _, inverse, counts = np.unique(band_keys, return_inverse=True, return_counts=True)
+        shared = counts[inverse] > 1
+        if not shared.any():
+            continue
+        members = valid_rows[shared]
+        keys = inverse[shared]
+        order = np.argsort(keys, kind='stable')
+        members, keys = members[order], keys[order]
+        # 同じバケットの先頭行と各行の推定類似度を確認
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        firsts = np.repeat(members[starts], np.diff(np.concatenate([starts, [len(keys)]])))
+        similar = (signatures[members] == signatures[firsts]).mean(axis=1) >= threshold
+        for first, member in zip(firsts[similar], members[similar]):
+            root_a, root_b = find(first), find(member)
+            if root_a != root_b:
+                # 小さい行番号を根にする（代表 = クラスタ内の最小行番号）
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    return np.array([find(i) for i in range(n)], dtype=np.int64)
+
+
+def cluster_report(labels, hospital_ids, texts, top=10):
+    """クラスタの全体統計・病院ごとの重複統計・大きいクラスタ上位を集計"""
+    import pandas as pd
+
+    labels = np.asarray(labels)
+    sizes = np.bincount(labels, minlength=len(labels))
+    row_sizes = sizes[labels]
+    duplicated = row_sizes > 1
+    frame = pd.DataFrame({
+        'hospital_id': np.asarray(hospital_ids),
+        'label': labels,
+        'cluster_size': row_sizes,
+        'duplicated': duplicated
+    })
+
+    # 複数の病院にまたがるクラスタ（テンプレート投稿の目安）
+    hospitals_per_cluster = frame[duplicated].groupby('label')['hospital_id'].nunique()
+    cross_hospital = set(hospitals_per_cluster[hospitals_per_cluster > 1].index)
+
+    hospitals = {}
+    for hospital_id, group in frame.groupby('hospital_id', sort=True):
+        dup = group[group['duplicated']]
+        hospitals[hospital_id] = {
+            'review_count': len(group),
+            'duplicate_reviews': len(dup),
+            'duplicate_share': len(dup) / len(group),
+            'duplicate_clusters': int(dup['label'].nunique()),
+            'largest_cluster': int(group['cluster_size'].max()),
+            'cross_hospital_clusters': int(sum(1 for label in dup['label'].unique() if label in cross_hospital))
+        }
+
+    multi = np.flatnonzero(sizes > 1)
+    top_clusters = []
+    for label in multi[np.argsort(-sizes[multi], kind='stable')][:top]:
+        members = frame[frame['label'] == label]
+        top_clusters.append({
+            'representative_row': int(label),
+            'size': int(sizes[label]),
+            'representative_text': texts[label],
+            'hospitals': {hospital_id: int(count)
+                          for hospital_id, count in members['hospital_id'].value_counts().items()}
+        })
+
+    n_unique = int(np.count_nonzero(sizes))
+    return {
+        'total_reviews': len(labels),
+        'unique_reviews': n_unique,
+        'duplicate_clusters': len(multi),
+        'duplicate_reviews': int(duplicated.sum()),
+        'inference_saved_share': 1 - n_unique / len(labels) if len(labels) else 0.0,
+        'hospitals': hospitals,
+        'top_clusters': top_clusters
+    }
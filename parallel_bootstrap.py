@@ -0,0 +1,149 @@
+"""動物病院口コミ分析 - マルチコア並列ブートストラップ
+
+口コミ単位（数十万〜百万件）の相関係数ブートストラップを、プロセスプールに
+リサンプリング回数を分割して実行する。
+
+- 入力配列は共有メモリ（multiprocessing.shared_memory）に一度だけ置き、
+  ワーカーは名前で接続する（配列をpickleして送らない）
+- 乱数は np.random.SeedSequence(seed).spawn() でチャンクごとに独立したストリームを作る。
+  チャンク分割はワーカー数に依存しないため、同じ seed なら結果も同じになる
+- 結果は app.bootstrap_correlation_ci と同じ形式（パーセンタイル信頼区間）で返す
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# 1チャンクあたりのリサンプリング回数（乱数ストリームの単位）
+REPLICATES_PER_CHUNK = 250
+# 1回のベクトル演算で展開するインデックス数の上限（メモリ使用量の制御）
+MAX_ELEMENTS_PER_BATCH = 4_000_000
+
+_executor = None
+_executor_workers = None
+
+
+def get_executor(n_workers=None):
+    """プロセスプールを作成（同じワーカー数なら再利用）"""
+    global _executor, _executor_workers
+
+    n_workers = n_workers or os.cpu_count() or 1
+    if _executor is None or _executor_workers != n_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        # fork はスレッド（先行スコアリング・ウォームアップなど）が動いているプロセスを複製するため、
+        # ロックを持ったまま複製されたワーカーが止まることがある。forkserver（なければ spawn）で起動する
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if context.get_start_method() == 'forkserver':
+            # ワーカーが使うのはこのモジュールと numpy だけなので、それだけを読み込んだプロセスから複製する
+            context.set_forkserver_preload(['numpy', __name__])
+        _executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=context)
+        _executor_workers = n_workers
+    return _executor
+
+
+def _bootstrap_correlation_chunk(shm_name, n, n_replicates, seed_seq, max_elements):
+    """ワーカー側: 共有メモリの (x, y) から n_replicates 回分の相関係数を計算"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray((2, n), dtype=np.float64, buffer=shm.buf)
+        rng = np.random.default_rng(seed_seq)
+        batch = max(1, max_elements // max(n, 1))
+        correlations = []
+
+        for start in range(0, n_replicates, batch):
+            size = min(batch, n_replicates - start)
+            indices = rng.integers(0, n, size=(size, n))
+            x_boot = data[0][indices]
+            y_boot = data[1][indices]
+
+            # 分散が0のリサンプルは除外（逐次版と同じ）
+            valid = (x_boot.max(axis=1) > x_boot.min(axis=1)) & (y_boot.max(axis=1) > y_boot.min(axis=1))
+            x_boot -= x_boot.mean(axis=1, keepdims=True)
+            y_boot -= y_boot.mean(axis=1, keepdims=True)
+            sxy = np.einsum('ij,ij->i', x_boot, y_boot)
+            sxx = np.einsum('ij,ij->i', x_boot, x_boot)
+            syy = np.einsum('ij,ij->i', y_boot, y_boot)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = sxy / np.sqrt(sxx * syy)
+            r = r[valid]
+            correlations.append(r[~np.isnan(r)])
+
+        del data
+        return np.concatenate(correlations) if correlations else np.empty(0)
+    finally:
+        shm.close()
+
+
+def parallel_bootstrap_correlation_ci(x_data, y_data, n_bootstrap=10000, confidence_level=0.95,
+                                      seed=None, n_workers=None, tolerance=None, block_size=1000,
+                                      min_replicates=2000):
+    """並列ブートストラップで相関係数の信頼区間を計算（bootstrap_correlation_ci と同じ出力）
+
+    tolerance を指定すると block_size 回ごとに信頼区間の変化を確認し、
+    許容差未満になった時点で残りのチャンクを打ち切る。
+    """
+    x = np.asarray(x_data, dtype=np.float64)
+    y = np.asarray(y_data, dtype=np.float64)
+    n = len(x)
+    alpha = 1 - confidence_level
+
+    # チャンク分割と乱数ストリーム（ワーカー数に依存しない）
+    chunk_sizes = [REPLICATES_PER_CHUNK] * (n_bootstrap // REPLICATES_PER_CHUNK)
+    if n_bootstrap % REPLICATES_PER_CHUNK:
+        chunk_sizes.append(n_bootstrap % REPLICATES_PER_CHUNK)
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    # 収束判定しない場合は全チャンクを一度に投入
+    chunks_per_block = len(chunk_sizes)
+    if tolerance is not None:
+        chunks_per_block = max(1, block_size // REPLICATES_PER_CHUNK)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(2 * n * 8, 1))
+    try:
+        shared = np.ndarray((2, n), dtype=np.float64, buffer=shm.buf)
+        shared[0] = x
+        shared[1] = y
+        del shared
+
+        executor = get_executor(n_workers)
+        results = []
+        n_replicates = 0
+        previous_ci = None
+        for block_start in range(0, len(chunk_sizes), chunks_per_block):
+            block = range(block_start, min(block_start + chunks_per_block, len(chunk_sizes)))
+            futures = [
+                executor.submit(_bootstrap_correlation_chunk, shm.name, n, chunk_sizes[i], seed_seqs[i],
+                                MAX_ELEMENTS_PER_BATCH)
+                for i in block
+            ]
+            results.extend(future.result() for future in futures)
+            n_replicates += sum(chunk_sizes[i] for i in block)
+
+            if tolerance is not None:
+                merged = np.concatenate(results)
+                current_ci = (np.percentile(merged, (alpha / 2) * 100),
+                              np.percentile(merged, (1 - alpha / 2) * 100))
+                if (previous_ci is not None and n_replicates >= min_replicates
+                        and max(abs(current_ci[0] - previous_ci[0]), abs(current_ci[1] - previous_ci[1])) < tolerance):
+                    print(f"並列ブートストラップ収束: {n_replicates}回で打ち切り")
+                    break
+                previous_ci = current_ci
+
+        bootstrap_correlations = np.concatenate(results)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    ci_lower = np.percentile(bootstrap_correlations, (alpha / 2) * 100)
+    ci_upper = np.percentile(bootstrap_correlations, (1 - alpha / 2) * 100)
+
+    return {
+        'ci_lower': ci_lower,
+        'ci_upper': ci_upper,
+        'correlations': bootstrap_correlations,
+        'n_replicates': n_replicates
+    }
@@ -0,0 +1,316 @@
+"""動物病院口コミ分析 - リクエスト単位のプロファイリング（cProfile / tracemalloc）
+
+本番環境で特定のリクエスト（遅い・メモリを大量に使う /analyze など）だけを、再デプロイせずに調べる。
+
+- 有効化: 環境変数 PROFILE_TOKEN を設定し、リクエストに X-Profile-Token ヘッダーを付ける。
+  トークンが一致したリクエストだけを計測する（クエリ文字列はアクセスログやリファラーに残るため受け付けない）
+- 計測: そのリクエストの処理（ストリーミングレスポンスの送信完了まで）を cProfile と tracemalloc で実行
+- 保存: フレームグラフ用の collapsed stacks（flamegraph.pl / speedscope で読める形式、単位はマイクロ秒）、
+  関数ごとの集計（pstats）、メモリ確保の上位（tracemalloc）を直近 PROFILE_MAX_ENTRIES 件まで保存。
+  collapsed stacks は時間の長い順に PROFILE_MAX_COLLAPSED_LINES 行まで（残りは1行にまとめる）、
+  保存全体は PROFILE_MAX_STORE_BYTES までで、超えたら古いものから削除する
+- 取得: 管理用エンドポイント /admin/profiles（同じトークンが必要）
+
+通常のリクエストはヘッダーの確認だけで、そのまま元のアプリに渡す（計測の処理は一切しない）。
+tracemalloc はプロセス全体の計測のため、同時にプロファイルできるのは1リクエストだけ（実行中は計測せずに処理）。
+cProfile はリクエストを処理するスレッドだけを計測する（先行スコア計算のスレッドやプロセスプールは含まない）。
+計測中は tracemalloc のため処理が数倍遅くなる。
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+
+PROFILE_SETTINGS = {
+    'token': os.environ.get('PROFILE_TOKEN', ''),
+    'max_entries': int(os.environ.get('PROFILE_MAX_ENTRIES', 10)),
+    # 保存するレポート本文の合計サイズの上限と、1件の collapsed stacks の行数の上限
+    'max_store_bytes': int(os.environ.get('PROFILE_MAX_STORE_BYTES', 32 * 1024 * 1024)),
+    'max_collapsed_lines': int(os.environ.get('PROFILE_MAX_COLLAPSED_LINES', 5000)),
+    # tracemalloc が記録するスタックの深さと、レポートに出すメモリ確保の件数
+    'traceback_frames': int(os.environ.get('PROFILE_TRACEBACK_FRAMES', 10)),
+    'top_allocations': int(os.environ.get('PROFILE_TOP_ALLOCATIONS', 25)),
+    'top_functions': 40
+}
+
+PROFILE_HEADER = 'HTTP_X_PROFILE_TOKEN'
+# 管理用エンドポイント（取得のリクエスト自体は計測しない）
+ADMIN_PREFIX = '/admin/profiles'
+
+# collapsed stacks: 全体の時間に対してこの割合未満の枝（最小1マイクロ秒）と、この深さより深いスタックは省略
+MIN_STACK_FRACTION = 1e-5
+MAX_STACK_DEPTH = 200
+# 行数の上限で省略したスタックをまとめる行の名前
+OMITTED_STACKS_LABEL = '[omitted]'
+REPORT_FIELDS = ('collapsed', 'functions', 'allocations')
+
+
+def token_matches(token, expected):
+    """トークンの比較（未設定なら常に不一致）"""
+    if not expected or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8'))
+
+
+def requested_token(environ):
+    """WSGI環境からプロファイル用のトークン（X-Profile-Token ヘッダーのみ）を取り出す"""
+    return environ.get(PROFILE_HEADER) or None
+
+
+def admin_authorized(environ):
+    """管理用エンドポイントの認可（プロファイル要求と同じトークン）"""
+    return token_matches(requested_token(environ), PROFILE_SETTINGS['token'])
+
+
+def _function_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name  # 組み込み関数（例: <built-in method numpy.core...>）
+    return f'{name} ({os.path.basename(filename)}:{lineno})'
+
+
+def collapsed_stacks(profiler, max_lines=None):
+    """cProfile の呼び出し元・呼び出し先の集計からスタックを復元し、collapsed 形式の行にする
+
+    cProfile は呼び出しの組（呼び出し元 → 呼び出し先）ごとの累積時間しか持たないため、
+    各関数の時間を呼び出し元ごとの累積時間の比率で按分してスタックを組み立てる（近似）。
+    max_lines を超える場合は時間の長いスタックだけを残し、残りの時間は OMITTED_STACKS_LABEL の1行にまとめる。
+    戻り値: "関数1;関数2;関数3 マイクロ秒" の行のリスト
+    """
+    stats = pstats.Stats(profiler).stats
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    roots = [func for func, (_, _, _, _, callers) in stats.items() if not callers]
+    min_seconds = max(1e-6, sum(stats[root][3] for root in roots) * MIN_STACK_FRACTION)
+    totals = {}
+
+    def walk(func, path, seconds):
+        _, _, own_time, cumulative, _ = stats[func]
+        ratio = seconds / cumulative if cumulative > 0 else 0.0
+        path = path + [func]
+        children = []
+        if len(path) < MAX_STACK_DEPTH:
+            # 再帰呼び出しは同じスタックに2回入れない
+            children = [(callee, edge_cumulative * ratio) for callee, edge_cumulative in callees.get(func, ())
+                        if callee not in path]
+        # 再帰を含む関数は呼び出しの組の累積時間が重複して数えられるため、子の合計を親の時間以内に収める
+        children_total = sum(child_seconds for _, child_seconds in children)
+        available = max(0.0, seconds - own_time * ratio)
+        scale = min(1.0, available / children_total) if children_total > 0 else 1.0
+        remaining = seconds
+        for callee, child_seconds in children:
+            if child_seconds * scale >= min_seconds:
+                walk(callee, path, child_seconds * scale)
+                remaining -= child_seconds * scale
+        # 省略した子（再帰・短い枝）の時間はこの関数の自己時間に含め、合計をリクエストの時間に合わせる
+        totals[tuple(path)] = totals.get(tuple(path), 0.0) + max(0.0, remaining)
+
+    for root in roots:
+        walk(root, [], stats[root][3])
+
+    stacks = [(path, int(round(seconds * 1e6))) for path, seconds in totals.items()]
+    stacks = [(path, microseconds) for path, microseconds in stacks if microseconds > 0]
+    omitted = 0
+    if max_lines is not None and len(stacks) > max_lines:
+        stacks.sort(key=lambda stack: stack[1], reverse=True)
+        omitted = sum(microseconds for _, microseconds in stacks[max_lines - 1:])
+        stacks = stacks[:max_lines - 1]
+    lines = sorted(';'.join(_function_label(func) for func in path) + f' {microseconds}'
+                   for path, microseconds in stacks)
+    if omitted:
+        lines.append(f'{OMITTED_STACKS_LABEL} {omitted}')
+    return lines
+
+
+def function_report(profiler, limit):
+    """関数ごとの集計（累積時間順の上位）"""
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
+
+def allocation_report(snapshot, limit, frames):
+    """メモリ確保の上位（確保元のスタックごと、サイズ順）"""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')
+    ])
+    statistics = snapshot.statistics('traceback')
+    total = sum(stat.size for stat in statistics)
+    lines = [f'確保中のメモリ合計: {total / 1024:.1f} KiB（{len(statistics)}箇所）', '']
+    for rank, stat in enumerate(statistics[:limit], start=1):
+        lines.append(f'#{rank}: {stat.size / 1024:.1f} KiB, {stat.count}ブロック')
+        for line in stat.traceback.format(limit=frames, most_recent_first=True):
+            lines.append(f'    {line}')
+    return '\n'.join(lines)
+
+
+def entry_nbytes(entry):
+    """保存する1件のレポート本文のサイズ（UTF-8）"""
+    return sum(len(entry.get(field, '').encode('utf-8')) for field in REPORT_FIELDS)
+
+
+class ProfileStore:
+    """計測結果の保存（直近 max_entries 件・合計 max_bytes まで、古いものから削除）"""
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries or PROFILE_SETTINGS['max_entries']
+        self.max_bytes = max_bytes or PROFILE_SETTINGS['max_store_bytes']
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def add(self, entry):
+        entry['nbytes'] = entry_nbytes(entry)
+        with self.lock:
+            self.entries[entry['id']] = entry
+            self.total_bytes += entry['nbytes']
+            # 最新の1件は上限を超えても残す
+            while len(self.entries) > 1 and (len(self.entries) > self.max_entries
+                                             or self.total_bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted['nbytes']
+
+    def get(self, profile_id):
+        with self.lock:
+            return self.entries.get(profile_id)
+
+    def summaries(self):
+        """一覧用（レポート本文を除く、新しい順）"""
+        with self.lock:
+            entries = list(self.entries.values())
+        return [
+            {key: value for key, value in entry.items() if key not in REPORT_FIELDS}
+            for entry in reversed(entries)
+        ]
+
+
+class ProfiledRequest:
+    """1リクエスト分の計測（start → レスポンス送信完了で finish）"""
+    def __init__(self, environ, settings):
+        self.id = uuid.uuid4().hex[:12]
+        self.settings = settings
+        self.method = environ.get('REQUEST_METHOD', '')
+        self.path = environ.get('PATH_INFO', '')
+        self.status = None
+        self.profiler = cProfile.Profile()
+        self.started_tracemalloc = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.settings['traceback_frames'])
+            self.started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self.started_at = time.time()
+        self.start_time = time.perf_counter()
+        self.profiler.enable()
+
+    def finish(self):
+        self.profiler.disable()
+        duration = time.perf_counter() - self.start_time
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+        settings = self.settings
+        entry = {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': round(duration * 1000, 1),
+            'peak_memory_bytes': peak,
+            'collapsed': '\n'.join(collapsed_stacks(self.profiler, settings['max_collapsed_lines'])) + '\n',
+            'functions': function_report(self.profiler, settings['top_functions']),
+            'allocations': allocation_report(snapshot, settings['top_allocations'], settings['traceback_frames'])
+        }
+        print(f"プロファイル保存: {self.id} {self.method} {self.path} ({entry['duration_ms']:.0f}ms, "
+              f"ピークメモリ {peak / 1024 / 1024:.1f}MB)")
+        return entry
+
+
+class ProfilingMiddleware:
+    """トークン付きのリクエストだけを計測する WSGI ミドルウェア（app.wsgi_app を包む）"""
+    def __init__(self, wsgi_app, store, settings=None):
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.settings = dict(PROFILE_SETTINGS, **(settings or {}))
+        self.busy = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        expected = self.settings['token']
+        if not expected:
+            return self.wsgi_app(environ, start_response)
+        token = requested_token(environ)
+        if token is None or environ.get('PATH_INFO', '').startswith(ADMIN_PREFIX):
+            return self.wsgi_app(environ, start_response)
+        if not token_matches(token, expected):
+            print(f"プロファイル要求のトークンが一致しません: {environ.get('PATH_INFO', '')}")
+            return self.wsgi_app(environ, start_response)
+        if not self.busy.acquire(blocking=False):
+            print(f"プロファイル実行中のため計測しません: {environ.get('PATH_INFO', '')}")
+            return self.wsgi_app(environ, self._with_headers(start_response, [('X-Profile-Status', 'busy')]))
+        return self._profile(environ, start_response)
+
+    @staticmethod
+    def _with_headers(start_response, extra_headers):
+        def wrapped(status, headers, exc_info=None):
+            return start_response(status, list(headers) + extra_headers, exc_info)
+        return wrapped
+
+    def _profile(self, environ, start_response):
+        request = ProfiledRequest(environ, self.settings)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            request.status = int(status.split(' ', 1)[0])
+            headers = list(headers) + [('X-Profile-Id', request.id)]
+            return start_response(status, headers, exc_info)
+
+        request.start()
+        try:
+            body = self.wsgi_app(environ, profiled_start_response)
+        except BaseException:
+            self._finish(request)
+            raise
+        return ProfiledBody(body, request, self._finish)
+
+    def _finish(self, request):
+        try:
+            self.store.add(request.finish())
+        finally:
+            self.busy.release()
+
+
+class ProfiledBody:
+    """レスポンス本体（ストリーミングを含む）を最後まで送ってから計測を終える"""
+    def __init__(self, body, request, on_close):
+        self.body = body
+        self.request = request
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.body:
+            yield chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.on_close(self.request)
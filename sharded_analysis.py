@@ -0,0 +1,310 @@
+"""動物病院口コミ分析 - シャード分割によるmap-reduce実行
+
+使い方:
+    # 1台で実行（分割 → プロセスごとにmap → reduce）
+    python sharded_analysis.py run reviews.csv --shards 8 --work-dir shards/
+
+    # 複数マシンで実行（work-dir は共有ディレクトリ）
+    python sharded_analysis.py split reviews.csv --shards 8 --work-dir /shared/shards
+    python sharded_analysis.py map --shard 3 --work-dir /shared/shards   # 各マシンで
+    python sharded_analysis.py reduce --work-dir /shared/shards --out report.json
+
+各シャードは病院ごとの十分統計量（件数・星評価スコア和・各モデルスコア和）、
+相関係数用のモーメント、ブートストラップ用のスコア配列を .npz として出力する。
+reduce はそれらを合算し、単一プロセス実行と同じ hospital_stats・性能指標・
+ブートストラップ検定を計算する。
+
+split はシャード数・入力ファイルの指紋（SHA-1）・入力の病院IDの型を manifest.json に書き、map は担当シャードの
+.npz にその指紋を記録する。reduce は manifest のシャードを過不足なく読み込み、欠けている・余分な・
+別の入力から作られたシャード統計があれば中止する（以前の実行の残りを混ぜない）。
+map はシャードの病院IDを文字列のまま読み（"001" を 1 にしない）、reduce は manifest の型に戻して
+単一プロセス実行（groupby）と同じ順に並べる。
+"""
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from batch_analyze import load_backend, iter_chunks, validate_chunk, assemble_report
+
+SHARD_PATTERN = 'shard-{:05d}.csv'
+STATS_PATTERN = 'shard-{:05d}.stats.npz'
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_fingerprint(path, block_size=1024 * 1024):
+    """入力ファイルの内容のSHA-1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_manifest(work_dir, n_shards, input_path, hospital_id_dtype='object'):
+    """シャード数・入力の指紋・病院IDの型を書き出す（一時ファイル → rename で置き換え）"""
+    manifest = {
+        'n_shards': n_shards,
+        'input': os.path.abspath(input_path),
+        'input_fingerprint': file_fingerprint(input_path),
+        'hospital_id_dtype': hospital_id_dtype
+    }
+    path = os.path.join(work_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def read_manifest(work_dir):
+    path = os.path.join(work_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        sys.exit(f"マニフェストが見つかりません（先に split を実行してください）: {path}")
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def split_input(input_path, n_shards, work_dir, chunk_size=10000):
+    """入力を病院IDのハッシュでシャードに分割（同じ病院は同じシャードに入る）"""
+    os.makedirs(work_dir, exist_ok=True)
+    paths = [os.path.join(work_dir, SHARD_PATTERN.format(i)) for i in range(n_shards)]
+    written = [False] * n_shards
+    id_dtypes = set()
+
+    for chunk in iter_chunks(input_path, chunk_size):
+        id_dtypes.add(chunk['hospital_id'].dtype)
+        shard_ids = pd.util.hash_array(chunk['hospital_id'].astype(str).to_numpy()) % n_shards
+        for shard_id, part in chunk.groupby(shard_ids):
+            part.to_csv(paths[shard_id], mode='a' if written[shard_id] else 'w',
+                        header=not written[shard_id], index=False)
+            written[shard_id] = True
+
+    # 空シャードも作っておく（mapの担当漏れを防ぐ）
+    for shard_id, path in enumerate(paths):
+        if not written[shard_id]:
+            pd.DataFrame(columns=['hospital_id', 'review_text', 'star_rating']).to_csv(path, index=False)
+
+    # 単一プロセス実行でチャンクを連結したときの病院IDの型（数値同士なら共通の型、文字列が混ざれば object）
+    if id_dtypes and all(pd.api.types.is_numeric_dtype(dtype) for dtype in id_dtypes):
+        hospital_id_dtype = str(np.result_type(*id_dtypes))
+    else:
+        hospital_id_dtype = 'object'
+    manifest = write_manifest(work_dir, n_shards, input_path, hospital_id_dtype)
+    print(f"✂️ {input_path} を {n_shards} シャードに分割しました: {work_dir}"
+          f"（指紋 {manifest['input_fingerprint'][:12]}）")
+    return paths
+
+
+def map_shard(shard_id, work_dir, backend='mock', chunk_size=2000):
+    """1シャードをスコア化し、合算可能な統計量を .npz に書き出す"""
+    manifest = read_manifest(work_dir)
+    if not 0 <= shard_id < manifest['n_shards']:
+        sys.exit(f"シャード番号が範囲外です: {shard_id}（シャード数 {manifest['n_shards']}）")
+    module = load_backend(backend)
+    display_names = list(module.MODELS.values())
+    score_columns = [f'{display_name}_score' for display_name in display_names]
+    shard_path = os.path.join(work_dir, SHARD_PATTERN.format(shard_id))
+
+    frames = []
+    # 病院IDは split が書いた文字列のまま読む（シャードごとの型推論で "001" が 1 にならないように）
+    for chunk in iter_chunks(shard_path, chunk_size, dtype={'hospital_id': str}):
+        chunk = validate_chunk(chunk)
+        if len(chunk):
+            scored = module.calculate_scores(chunk.reset_index(drop=True))
+            frames.append(scored[['hospital_id', 'star_score'] + score_columns])
+
+    if frames:
+        scored = pd.concat(frames, ignore_index=True)
+    else:
+        scored = pd.DataFrame(columns=['hospital_id', 'star_score'] + score_columns)
+
+    star_scores = scored['star_score'].to_numpy(dtype=np.float64)
+    model_scores = scored[score_columns].to_numpy(dtype=np.float64).reshape(len(scored), len(score_columns))
+
+    # 病院ごとの十分統計量
+    grouped = scored.assign(hospital_id=scored['hospital_id'].astype(str)).groupby('hospital_id')
+    sums = grouped[['star_score'] + score_columns].sum()
+
+    out_path = os.path.join(work_dir, STATS_PATTERN.format(shard_id))
+    # 書きかけのファイルを reduce が読まないように、一時ファイルに書いてから置き換える
+    with open(out_path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            input_fingerprint=np.array(manifest['input_fingerprint']),
+            shard_id=np.int64(shard_id),
+            n_shards=np.int64(manifest['n_shards']),
+            display_names=np.array(display_names),
+            hospital_ids=sums.index.to_numpy(dtype=str),
+            review_counts=grouped.size().to_numpy(dtype=np.int64),
+            star_sums=sums['star_score'].to_numpy(dtype=np.float64),
+            model_sums=sums[score_columns].to_numpy(dtype=np.float64),
+            # 相関係数用モーメント: n, Σx, Σx², Σy, Σy², Σxy（x=星評価スコア, y=各モデル）
+            n=np.int64(len(star_scores)),
+            sum_x=star_scores.sum(),
+            sum_xx=(star_scores ** 2).sum(),
+            sum_y=model_scores.sum(axis=0),
+            sum_yy=(model_scores ** 2).sum(axis=0),
+            sum_xy=(star_scores[:, None] * model_scores).sum(axis=0),
+            star_counts=np.bincount((star_scores + 3).astype(np.int64), minlength=6)[1:6],
+            # ブートストラップ入力（レビュー単位）
+            star_scores=star_scores,
+            model_scores=model_scores
+        )
+    os.replace(out_path + '.tmp', out_path)
+    print(f"🗺️ シャード {shard_id} 完了: {len(scored)} 件 → {out_path}")
+    return out_path
+
+
+def pearson_from_moments(n, sum_x, sum_xx, sum_y, sum_yy, sum_xy):
+    """合算モーメントからピアソン相関係数とp値を計算（scipy.stats.pearsonr と同じ検定）"""
+    cov = n * sum_xy - sum_x * sum_y
+    var_x = n * sum_xx - sum_x ** 2
+    var_y = n * sum_yy - sum_y ** 2
+    if var_x <= 0 or var_y <= 0:
+        return float('nan'), float('nan')
+    r = float(np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0))
+    if n <= 2 or abs(r) == 1.0:
+        return r, 0.0
+    t_stat = r * np.sqrt((n - 2) / (1 - r ** 2))
+    return r, float(2 * stats.t.sf(abs(t_stat), n - 2))
+
+
+def reduce_shards(work_dir, n_bootstrap=10000, seed=42):
+    """manifest のシャードの統計量を合算してレポートを作成（過不足・別の入力のシャードがあれば中止）"""
+    manifest = read_manifest(work_dir)
+    paths = [os.path.join(work_dir, STATS_PATTERN.format(i)) for i in range(manifest['n_shards'])]
+    missing = [os.path.basename(path) for path in paths if not os.path.exists(path)]
+    if missing:
+        sys.exit(f"シャード統計が不足しています（{len(missing)}件）: {', '.join(missing[:10])}")
+    found = glob.glob(os.path.join(work_dir, 'shard-*.stats.npz'))
+    extra = sorted(set(os.path.basename(path) for path in found) - set(os.path.basename(path) for path in paths))
+    if extra:
+        sys.exit(f"マニフェストにないシャード統計があります: {', '.join(extra[:10])}")
+
+    shards = [np.load(path) for path in paths]
+    for shard_id, (path, shard) in enumerate(zip(paths, shards)):
+        if ('input_fingerprint' not in shard
+                or str(shard['input_fingerprint']) != manifest['input_fingerprint']
+                or int(shard['n_shards']) != manifest['n_shards'] or int(shard['shard_id']) != shard_id):
+            sys.exit(f"シャード統計の入力がマニフェストと一致しません（以前の実行の残り？）: {path}")
+    display_names = [str(name) for name in shards[0]['display_names']]
+    score_columns = [f'{display_name}_score' for display_name in display_names]
+    for path, shard in zip(paths, shards):
+        if [str(name) for name in shard['display_names']] != display_names:
+            sys.exit(f"モデル構成が一致しません: {path}")
+
+    # 病院ごとの和を合算 → 平均（aggregate_by_hospital と同じ列構成）
+    per_hospital = pd.concat([
+        pd.DataFrame(
+            np.column_stack([shard['review_counts'], shard['star_sums'],
+                             shard['model_sums'].reshape(len(shard['hospital_ids']), len(display_names))]),
+            index=pd.Index(shard['hospital_ids'], name='hospital_id'),
+            columns=['review_count', 'star_score'] + score_columns
+        )
+        for shard in shards
+    ]).groupby(level=0).sum()
+    counts = per_hospital['review_count']
+    hospital_stats = per_hospital[['star_score'] + score_columns].div(counts, axis=0)
+    hospital_stats['review_count'] = counts.astype(int)
+    hospital_stats = hospital_stats.reset_index()
+    # 病院IDを入力の型に戻し、単一プロセス実行の groupby と同じ順に並べる（文字列のIDは文字列のまま）
+    hospital_id_dtype = manifest.get('hospital_id_dtype', 'object')
+    if hospital_id_dtype != 'object':
+        hospital_stats['hospital_id'] = hospital_stats['hospital_id'].astype(hospital_id_dtype)
+    hospital_stats = hospital_stats.sort_values('hospital_id', ignore_index=True)
+
+    # 相関係数はモーメントの合算から
+    n = int(sum(int(shard['n']) for shard in shards))
+    sum_x = sum(float(shard['sum_x']) for shard in shards)
+    sum_xx = sum(float(shard['sum_xx']) for shard in shards)
+    sum_y = np.sum([shard['sum_y'] for shard in shards], axis=0)
+    sum_yy = np.sum([shard['sum_yy'] for shard in shards], axis=0)
+    sum_xy = np.sum([shard['sum_xy'] for shard in shards], axis=0)
+    point_correlations = {
+        display_name: pearson_from_moments(n, sum_x, sum_xx, sum_y[m], sum_yy[m], sum_xy[m])
+        for m, display_name in enumerate(display_names)
+    }
+
+    star_counts = np.sum([shard['star_counts'] for shard in shards], axis=0)
+    star_distribution = {rating: int(count) for rating, count in zip(range(1, 6), star_counts) if count}
+
+    # ブートストラップ入力はシャード配列の連結
+    star_scores = np.concatenate([shard['star_scores'] for shard in shards])
+    model_matrix = np.concatenate([
+        shard['model_scores'].reshape(len(shard['star_scores']), len(display_names)) for shard in shards
+    ])
+    model_scores = {display_name: model_matrix[:, m] for m, display_name in enumerate(display_names)}
+
+    print(f"🧮 {len(paths)} シャードを集約: {n} 件, {len(hospital_stats)} 病院")
+    np.random.seed(seed)
+    report = assemble_report(hospital_stats, display_names, star_scores, model_scores,
+                             point_correlations, star_distribution, n_bootstrap)
+    report['n_shards'] = len(paths)
+    return report
+
+
+def write_report(report, out_path):
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ レポート出力: {out_path}")
+
+
+def _map_shard_star(args):
+    return map_shard(*args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='シャード分割による口コミ分析（map-reduce）')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_split = sub.add_parser('split', help='入力をシャードに分割')
+    p_split.add_argument('input')
+    p_split.add_argument('--shards', type=int, required=True)
+    p_split.add_argument('--work-dir', required=True)
+
+    p_map = sub.add_parser('map', help='1シャードを処理')
+    p_map.add_argument('--shard', type=int, required=True)
+    p_map.add_argument('--work-dir', required=True)
+    p_map.add_argument('--backend', choices=['mock', 'bert'], default='mock')
+
+    p_reduce = sub.add_parser('reduce', help='シャード統計を集約')
+    p_reduce.add_argument('--work-dir', required=True)
+    p_reduce.add_argument('--out', default='report.json')
+    p_reduce.add_argument('--n-bootstrap', type=int, default=10000)
+    p_reduce.add_argument('--seed', type=int, default=42)
+
+    p_run = sub.add_parser('run', help='1台で split → map（プロセス並列）→ reduce')
+    p_run.add_argument('input')
+    p_run.add_argument('--shards', type=int, default=os.cpu_count() or 1)
+    p_run.add_argument('--work-dir', required=True)
+    p_run.add_argument('--backend', choices=['mock', 'bert'], default='mock')
+    p_run.add_argument('--workers', type=int, default=None)
+    p_run.add_argument('--out', default=None)
+    p_run.add_argument('--n-bootstrap', type=int, default=10000)
+    p_run.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'split':
+        split_input(args.input, args.shards, args.work_dir)
+    elif args.command == 'map':
+        map_shard(args.shard, args.work_dir, args.backend)
+    elif args.command == 'reduce':
+        write_report(reduce_shards(args.work_dir, args.n_bootstrap, args.seed), args.out)
+    elif args.command == 'run':
+        split_input(args.input, args.shards, args.work_dir)
+        with Pool(args.workers or os.cpu_count() or 1) as pool:
+            pool.map(_map_shard_star, [(i, args.work_dir, args.backend) for i in range(args.shards)])
+        report = reduce_shards(args.work_dir, args.n_bootstrap, args.seed)
+        write_report(report, args.out or os.path.join(args.work_dir, 'report.json'))
+
+
+if __name__ == '__main__':
+    main()
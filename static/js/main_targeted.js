@@ -156,7 +156,7 @@ function resetUpload() {
         <i class="fas fa-cloud-upload-alt fa-3x text-muted mb-3"></i>
         <h5>CSVファイルをアップロード</h5>
         <p class="text-muted">ファイルをドラッグ&ドロップするか、クリックして選択してください</p>
-        <input type="file" id="fileInput" accept=".csv" class="d-none">
+        <input type="file" id="fileInput" accept=".csv,.csv.gz,.parquet,.arrow,.feather,.ipc,.ndjson,.jsonl,.ndjson.gz,.jsonl.gz" class="d-none">
         <button class="btn btn-outline-primary me-2" onclick="document.getElementById('fileInput').click()">
             <i class="fas fa-folder-open me-1"></i>ファイルを選択
         </button>
@@ -184,6 +184,35 @@ function resetUpload() {
 
 
 
+// アップロードできるファイルの拡張子（upload_formats.py と同じ）
+const UPLOAD_EXTENSIONS = ['.csv', '.csv.gz', '.parquet', '.arrow', '.feather', '.ipc', '.ndjson', '.jsonl', '.ndjson.gz', '.jsonl.gz'];
+
+function uploadFileToServer(file) {
+    const formData = new FormData();
+    formData.append('file', file);
+    
+    fetch('/upload', {
+        method: 'POST',
+        body: formData
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                alert('ファイルの読み込みに失敗しました: ' + data.error);
+                return;
+            }
+            uploadedData = data.data;
+            console.log('Uploaded data:', uploadedData.length, 'records');
+            
+            showFileSelectionState('uploaded', file.name);
+            document.getElementById('analyzeBtn').disabled = false;
+        })
+        .catch(error => {
+            console.error('Upload error:', error);
+            alert('ファイルのアップロードに失敗しました: ' + error.message);
+        });
+}
+
 function handleFileSelect() {
     console.log('handleFileSelect called');
     const fileInput = document.getElementById('fileInput');
@@ -196,8 +225,15 @@ function handleFileSelect() {
         return;
     }
     
-    if (!file.name.toLowerCase().endsWith('.csv')) {
-        alert('CSVファイルを選択してください。');
+    const fileName = file.name.toLowerCase();
+    if (!UPLOAD_EXTENSIONS.some(extension => fileName.endsWith(extension))) {
+        alert('CSV / Parquet / Arrow IPC / NDJSON ファイルを選択してください。');
+        return;
+    }
+    
+    // CSV以外（gzip CSV・Parquet・Arrow IPC・NDJSON）はサーバーで読み込む
+    if (!fileName.endsWith('.csv')) {
+        uploadFileToServer(file);
         return;
     }
 
@@ -312,6 +348,12 @@ function runAnalysis() {
         bodySize: JSON.stringify(requestBody).length
     });
     
+    // ストリーミング対応ブラウザでは完了したステージから順に表示
+    if (window.ReadableStream && window.TextDecoder) {
+        runAnalysisStream(requestBody);
+        return;
+    }
+    
     fetch('/analyze', {
         method: 'POST',
         headers: {
@@ -359,6 +401,7 @@ function runAnalysis() {
                 }, 500);
                 
                 document.getElementById('runTestBtn').disabled = false;
+                createDropdownMenus();  // 分析したモデルを検定のプルダウンに反映
                 showProgressIndicator('complete', '分析完了');
                 console.log('✅ Display completed successfully');
             } catch (displayError) {
@@ -391,6 +434,134 @@ function runAnalysis() {
     });
 }
 
+/**
+ * 分析結果のストリーミング受信（/analyze_stream, Server-Sent Events）
+ * 基本統計 → モデルごとの性能 → 病院別分析 → 信頼区間 → 性能検定 の順に表示を更新
+ */
+function runAnalysisStream(requestBody) {
+    let partialRendered = false;
+    analysisResults = {
+        basic_stats: {},
+        model_comparison: {},
+        star_rating_distribution: {},
+        sentiment_correlation: { scatter_data: {}, correlations: {} },
+        hospital_analysis: {},
+        model_performance_tests: {}
+    };
+    
+    function handleEvent(eventName, payload) {
+        console.log(`📨 Stream event: ${eventName}`, payload);
+        const correlations = analysisResults.sentiment_correlation.correlations;
+        
+        try {
+            if (eventName === 'queued') {
+                showProgressIndicator('analysis', `混雑のため順番待ちです（${payload.position}番目）...`);
+            } else if (eventName === 'basic_stats') {
+                Object.assign(analysisResults, payload);
+                document.getElementById('resultsSection').style.display = 'block';
+                displayBasicStats(payload.basic_stats);
+                displayStarRatingChart(payload.star_rating_distribution);
+                partialRendered = true;
+                showProgressIndicator('analysis', '基本統計を表示しました - 感情分析を実行中...');
+            } else if (eventName === 'model') {
+                const metrics = payload.metrics;
+                analysisResults.model_comparison[payload.model] = metrics;
+                analysisResults.sentiment_correlation.scatter_data[payload.model] = payload.scatter_data;
+                // 信頼区間は後続の correlation イベントで追加
+                correlations[payload.model] = Object.assign(correlations[payload.model] || {}, {
+                    correlation: metrics.correlation,
+                    p_value: metrics.p_value,
+                    significant: metrics.p_value < 0.05
+                });
+                displayModelComparisonChart(analysisResults.model_comparison);
+                displayModelComparisonTable(analysisResults.model_comparison);
+                displaySentimentDistributionChart(analysisResults.sentiment_correlation);
+                showProgressIndicator('analysis', `${payload.model} の分析完了`);
+            } else if (eventName === 'hospital_analysis') {
+                // 病院別テーブルはサーバーに分析結果が保存される complete 後に /hospitals から取得
+                analysisResults.hospital_analysis = payload.hospital_analysis;
+                showProgressIndicator('analysis', 'ブートストラップ検定を実行中...');
+            } else if (eventName === 'correlation') {
+                correlations[payload.model] = payload.result;
+                const completed = {};
+                Object.entries(correlations).forEach(([model, data]) => {
+                    if (data.ci_lower !== undefined) completed[model] = data;
+                });
+                displayCorrelationResults(completed);
+            } else if (eventName === 'performance_test') {
+                analysisResults.model_performance_tests[payload.comparison] = payload.result;
+                displayPerformanceTestResults(analysisResults.model_performance_tests);
+            } else if (eventName === 'complete') {
+                analysisResults = payload.results;
+                if (partialRendered) {
+                    displayHospitalAnalysis();
+                    generateAnalysisInterpretation(analysisResults);
+                } else {
+                    // キャッシュ済みの結果は一度に表示
+                    displayAnalysisResults(analysisResults);
+                }
+                document.getElementById('runTestBtn').disabled = false;
+                createDropdownMenus();  // 分析したモデルを検定のプルダウンに反映
+                showProgressIndicator('complete', '分析完了');
+            } else if (eventName === 'error') {
+                showProgressIndicator('error', payload.error || '分析に失敗しました');
+                console.error('Analysis failed:', payload.error);
+            }
+        } catch (displayError) {
+            console.error(`❌ Display error (${eventName}):`, displayError);
+        }
+    }
+    
+    fetch('/analyze_stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(requestBody)
+    })
+    .then(response => {
+        if (response.status === 429) {
+            // 受付制御による拒否（Retry-After 秒後に再試行できる）
+            return response.json().then(data => {
+                showProgressIndicator('error', data.error || 'サーバーが混雑しています');
+            });
+        }
+        if (!response.ok || !response.body) {
+            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        function read() {
+            return reader.read().then(({ done, value }) => {
+                if (done) return;
+                buffer += decoder.decode(value, { stream: true });
+                
+                // イベントは空行区切り（"event: 名前" と "data: JSON"）
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let eventName = 'message';
+                    const dataLines = [];
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                    });
+                    if (dataLines.length) handleEvent(eventName, JSON.parse(dataLines.join('\n')));
+                }
+                return read();
+            });
+        }
+        return read();
+    })
+    .catch(error => {
+        console.error('❌ STREAM ERROR:', error);
+        showProgressIndicator('error', 'ネットワークエラー: ' + error.message);
+    });
+}
+
 /**
  * 問題2の修正: チャート表示の切れ問題
  */
@@ -458,9 +629,9 @@ function displayAnalysisResults(results) {
         }
         
         // 病院別分析
-        console.log('🏥 Displaying hospital analysis...', results.hospital_analysis);
+        console.log('🏥 Displaying hospital analysis...');
         try {
-            displayHospitalAnalysis(results.hospital_analysis);
+            displayHospitalAnalysis();
             console.log('✅ Hospital analysis displayed');
         } catch (e) {
             console.error('❌ Hospital analysis error:', e);
@@ -1038,9 +1209,8 @@ function runStatisticalTest() {
 function createDropdownMenus() {
     console.log('Creating dropdown menus...');
     
-    const models = ['cl-tohoku/bert-base-japanese-whole-word-masking', 
-                   'llm-book/bert-base-japanese-v3', 
-                   'Mizuiro-sakura/luke-japanese-base-finetuned-vet'];
+    // 分析済みのモデル（/statistical_test はバックエンドの表示名で指定する）
+    const models = analyzedModelNames();
     
     // Model 1 dropdown
     let model1Select = document.getElementById('model1Select');
@@ -1222,69 +1392,342 @@ function displayBasicStats(stats) {
     `;
 }
 
-function displayHospitalAnalysis(hospitalData) {
+// 分析結果のモデル名（バックエンドのモデル設定の順）
+function analyzedModelNames() {
+    return analysisResults && analysisResults.model_comparison ? Object.keys(analysisResults.model_comparison) : [];
+}
+
+// 病院別・口コミテーブルのモデル列（バックエンドのキー名, 表示名）。表示名は括弧内の短い名前
+function modelColumns() {
+    return analyzedModelNames().map(model => {
+        const match = model.match(/\(([^)]+)\)/);
+        return [model, match ? match[1] : model];
+    });
+}
+
+function escapeHtml(value) {
+    return String(value === null || value === undefined ? '' : value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+function formatScore(value, digits = 3) {
+    return typeof value === 'number' ? value.toFixed(digits) : '-';
+}
+
+/**
+ * ページ単位のJSON取得（エラー時はサーバーのメッセージで reject）
+ */
+function fetchTablePage(url) {
+    return fetch(url).then(response => response.json().then(data => {
+        if (!response.ok || data.error) {
+            throw new Error(data.error || `HTTP ${response.status}`);
+        }
+        return data;
+    }));
+}
+
+/**
+ * 仮想スクロールのテーブル（表示範囲の行だけDOMに作成）
+ * 行はサーバーからページ単位で取得し、並べ替え・絞り込みもサーバー側で行う
+ * 保持するページ数に上限があるため、データ件数が増えてもブラウザのメモリ使用量は一定
+ *
+ * options:
+ *   columns: [{ label, width, sortKey（省略時は並べ替え不可）, render(row) → HTML }]
+ *   fetchPage(page, perPage, query) → Promise<{ total, rows }>
+ *   initialQuery: { sort, order, ...絞り込み条件 }
+ *   rowHeight, pageSize, height, maxCachedPages, onRowClick(row)
+ */
+function createVirtualTable(container, options) {
+    const rowHeight = options.rowHeight || 40;
+    const pageSize = options.pageSize || 100;
+    const viewportHeight = options.height || 480;
+    const maxCachedPages = options.maxCachedPages || 10;
+    const overscan = 10;
+    
+    const state = {
+        query: Object.assign({}, options.initialQuery || {}),
+        total: null,
+        pages: new Map(),    // ページ番号 → 行の配列
+        pending: new Set(),  // 取得中のページ番号
+        generation: 0,       // 並べ替え・絞り込みの変更で増やし、古いレスポンスを捨てる
+        renderScheduled: false,
+        error: null
+    };
+    
+    const colgroup = `<colgroup>${options.columns.map(column =>
+        `<col style="width: ${column.width || 'auto'}">`).join('')}</colgroup>`;
+    container.innerHTML = `
+        <div class="virtual-table-status small text-muted mb-1"></div>
+        <div class="virtual-table-head">
+            <table class="table table-dark virtual-table virtual-table-header mb-0">
+                ${colgroup}
+                <thead><tr>${options.columns.map((column, i) => `
+                    <th data-column="${i}" class="${column.sortKey ? 'sortable' : ''}">${column.label}</th>`).join('')}
+                </tr></thead>
+            </table>
+        </div>
+        <div class="virtual-table-viewport" style="height: ${viewportHeight}px;">
+            <div class="virtual-table-spacer"></div>
+            <table class="table table-striped table-hover virtual-table virtual-table-body mb-0">
+                ${colgroup}
+                <tbody></tbody>
+            </table>
+        </div>
+    `;
+    const status = container.querySelector('.virtual-table-status');
+    const headerCells = container.querySelectorAll('.virtual-table-header th');
+    const viewport = container.querySelector('.virtual-table-viewport');
+    const spacer = container.querySelector('.virtual-table-spacer');
+    const bodyTable = container.querySelector('.virtual-table-body');
+    const tbody = bodyTable.querySelector('tbody');
+    
+    function visibleRange() {
+        const total = state.total || 0;
+        const first = Math.max(0, Math.floor(viewport.scrollTop / rowHeight) - overscan);
+        const last = Math.min(total, Math.ceil((viewport.scrollTop + viewportHeight) / rowHeight) + overscan);
+        return [first, last];
+    }
+    
+    function evictPages() {
+        // 表示位置から遠いページから破棄
+        const centerPage = Math.floor(viewport.scrollTop / rowHeight / pageSize) + 1;
+        while (state.pages.size > maxCachedPages) {
+            let farthest = null;
+            state.pages.forEach((_, page) => {
+                if (farthest === null || Math.abs(page - centerPage) > Math.abs(farthest - centerPage)) {
+                    farthest = page;
+                }
+            });
+            state.pages.delete(farthest);
+        }
+    }
+    
+    function ensurePage(page) {
+        // エラー後は自動で再取得しない（並べ替え・絞り込みの変更で再開）
+        if (state.error || state.pages.has(page) || state.pending.has(page)) return;
+        const generation = state.generation;
+        state.pending.add(page);
+        options.fetchPage(page, pageSize, state.query)
+            .then(result => {
+                if (generation !== state.generation) return;
+                state.total = result.total;
+                state.pages.set(page, result.rows);
+                evictPages();
+            })
+            .catch(error => {
+                if (generation !== state.generation) return;
+                console.error('❌ Table page fetch error:', error);
+                state.error = error.message;
+            })
+            .finally(() => {
+                if (generation !== state.generation) return;
+                state.pending.delete(page);
+                scheduleRender();
+            });
+    }
+    
+    function render() {
+        state.renderScheduled = false;
+        if (state.total === null) {
+            status.textContent = state.error ? `読み込みエラー: ${state.error}` : '読み込み中...';
+            ensurePage(1);
+            return;
+        }
+        
+        spacer.style.height = `${state.total * rowHeight}px`;
+        const [first, last] = visibleRange();
+        bodyTable.style.transform = `translateY(${first * rowHeight}px)`;
+        
+        let html = '';
+        for (let index = first; index < last; index++) {
+            const page = Math.floor(index / pageSize) + 1;
+            const rows = state.pages.get(page);
+            const row = rows ? rows[index % pageSize] : undefined;
+            if (row === undefined) {
+                ensurePage(page);
+                html += `<tr><td colspan="${options.columns.length}" class="text-muted">読み込み中...</td></tr>`;
+            } else {
+                html += `<tr data-index="${index}">${options.columns.map(column =>
+                    `<td>${column.render(row)}</td>`).join('')}</tr>`;
+            }
+        }
+        tbody.innerHTML = html;
+        
+        if (state.error) {
+            status.textContent = `読み込みエラー: ${state.error}`;
+        } else if (state.total === 0) {
+            status.textContent = '該当するデータがありません';
+        } else {
+            const shownLast = Math.min(state.total, Math.ceil((viewport.scrollTop + viewportHeight) / rowHeight));
+            status.textContent = `${state.total}件中 ${Math.floor(viewport.scrollTop / rowHeight) + 1}〜${shownLast}件目`;
+        }
+    }
+    
+    function scheduleRender() {
+        if (state.renderScheduled) return;
+        state.renderScheduled = true;
+        requestAnimationFrame(render);
+    }
+    
+    function updateSortIndicators() {
+        headerCells.forEach(cell => {
+            const column = options.columns[Number(cell.dataset.column)];
+            const active = column.sortKey && column.sortKey === state.query.sort;
+            cell.textContent = column.label + (active ? (state.query.order === 'desc' ? ' ▼' : ' ▲') : '');
+        });
+    }
+    
+    function setQuery(changes) {
+        Object.assign(state.query, changes);
+        Object.keys(state.query).forEach(key => {
+            if (state.query[key] === '' || state.query[key] === null) delete state.query[key];
+        });
+        state.generation += 1;
+        state.pages.clear();
+        state.pending.clear();
+        state.total = null;
+        state.error = null;
+        viewport.scrollTop = 0;
+        tbody.innerHTML = '';
+        spacer.style.height = '0px';
+        updateSortIndicators();
+        scheduleRender();
+    }
+    
+    viewport.addEventListener('scroll', scheduleRender, { passive: true });
+    headerCells.forEach(cell => {
+        const column = options.columns[Number(cell.dataset.column)];
+        if (!column.sortKey) return;
+        cell.addEventListener('click', () => {
+            const order = state.query.sort === column.sortKey && state.query.order !== 'desc' ? 'desc' : 'asc';
+            setQuery({ sort: column.sortKey, order: order });
+        });
+    });
+    if (options.onRowClick) {
+        tbody.addEventListener('click', event => {
+            const tr = event.target.closest('tr[data-index]');
+            if (!tr) return;
+            const index = Number(tr.dataset.index);
+            const rows = state.pages.get(Math.floor(index / pageSize) + 1);
+            if (rows && rows[index % pageSize]) options.onRowClick(rows[index % pageSize]);
+        });
+    }
+    
+    updateSortIndicators();
+    scheduleRender();
+    return { setQuery: setQuery, refresh: () => setQuery({}) };
+}
+
+/**
+ * 入力が止まってから絞り込み条件を反映（キー入力ごとにリクエストしない）
+ */
+function bindTableFilter(input, table, key, delay = 300) {
+    let timer = null;
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(() => table.setQuery({ [key]: input.value.trim() }), delay);
+    });
+}
+
+function displayHospitalAnalysis() {
     const container = document.getElementById('hospitalAnalysis');
     if (!container) return;
     
-    // テーブル形式で1病院1行表示
-    let html = `
+    // 1病院1行の仮想スクロールテーブル（/hospitals からページ単位で取得）
+    container.innerHTML = `
         <div class="card">
             <div class="card-header">
                 <h6 class="mb-0"><i class="fas fa-hospital me-2"></i>病院別分析結果</h6>
             </div>
             <div class="card-body">
-                <div class="table-responsive">
-                    <table class="table table-striped table-hover">
-                        <thead class="table-dark">
-                            <tr>
-                                <th>病院ID</th>
-                                <th>レビュー数</th>
-                                <th>平均星評価</th>
-                                <th>Koheiduck</th>
-                                <th>LLM-book</th>
-                                <th>Mizuiro</th>
-                                <th>平均感情スコア</th>
-                            </tr>
-                        </thead>
-                        <tbody>
+                <div class="row g-2 mb-2">
+                    <div class="col-md-6">
+                        <input type="search" id="hospitalFilter" class="form-control form-control-sm" placeholder="病院IDで絞り込み">
+                    </div>
+                    <div class="col-md-3">
+                        <input type="number" id="hospitalMinReviews" class="form-control form-control-sm" min="0" placeholder="最小レビュー数">
+                    </div>
+                    <div class="col-md-3 small text-muted align-self-center">
+                        列名クリックで並べ替え・行クリックで口コミ表示
+                    </div>
+                </div>
+                <div id="hospitalTable"></div>
+                <div id="hospitalReviews" class="mt-4"></div>
+            </div>
+        </div>
     `;
     
-    Object.entries(hospitalData).forEach(([hospitalId, data]) => {
-        // デバッグ: データ構造確認
-        console.log(`Hospital ${hospitalId} data keys:`, Object.keys(data));
-        console.log(`Hospital ${hospitalId} data:`, data);
-        
-        // モデルスコアの取得（バックエンドのキー名に合わせる）
-        const koheiduck = data['Model A (Koheiduck)'] || 0;
-        const llmbook = data['Model B (LLM-book)'] || 0;
-        const mizuiro = data['Model C (Mizuiro)'] || 0;
-        console.log(`Model scores - Koheiduck: ${koheiduck}, LLM-book: ${llmbook}, Mizuiro: ${mizuiro}`);
-        
-        // 星評価の取得（複数のキーパターンに対応）
-        const avgRating = data.avg_rating || 0;
-        
-        html += `
-            <tr>
-                <td><strong>${hospitalId}</strong></td>
-                <td>${data.review_count}件</td>
-                <td>${avgRating.toFixed(2)}点</td>
-                <td>${(koheiduck || 0).toFixed(3)}</td>
-                <td>${(llmbook || 0).toFixed(3)}</td>
-                <td>${(mizuiro || 0).toFixed(3)}</td>
-                <td><strong>${data.avg_sentiment.toFixed(3)}</strong></td>
-            </tr>
-        `;
+    const models = modelColumns();
+    const modelWidth = `${Math.max(6, Math.floor(39 / Math.max(models.length, 1)))}%`;
+    const table = createVirtualTable(document.getElementById('hospitalTable'), {
+        columns: [
+            { label: '病院ID', width: '20%', sortKey: 'hospital_id', render: row => `<strong>${escapeHtml(row.hospital_id)}</strong>` },
+            { label: 'レビュー数', width: '12%', sortKey: 'review_count', render: row => `${row.review_count}件` },
+            { label: '平均星評価', width: '13%', sortKey: 'star_score', render: row => `${formatScore(row.star_score, 2)}点` },
+            ...models.map(([model, label]) => ({
+                label: label, width: modelWidth, sortKey: model, render: row => formatScore(row.scores[model])
+            })),
+            { label: '平均感情スコア', width: '16%', sortKey: 'avg_sentiment', render: row => `<strong>${formatScore(row.avg_sentiment)}</strong>` }
+        ],
+        initialQuery: { sort: 'hospital_id', order: 'asc' },
+        fetchPage: (page, perPage, query) => fetchTablePage(
+            '/hospitals?' + new URLSearchParams(Object.assign({ page: page, per_page: perPage }, query))
+        ).then(data => ({ total: data.total, rows: data.hospitals })),
+        onRowClick: row => displayHospitalReviews(row.hospital_id)
     });
+    bindTableFilter(document.getElementById('hospitalFilter'), table, 'q');
+    bindTableFilter(document.getElementById('hospitalMinReviews'), table, 'min_reviews');
+}
+
+function displayHospitalReviews(hospitalId) {
+    const container = document.getElementById('hospitalReviews');
+    if (!container) return;
     
-    html += `
-                        </tbody>
-                    </table>
-                </div>
+    // 選択した病院の口コミ（/hospitals/<id>/reviews からページ単位で取得）
+    container.innerHTML = `
+        <h6><i class="fas fa-comments me-2"></i>${escapeHtml(hospitalId)} の口コミ</h6>
+        <div class="row g-2 mb-2">
+            <div class="col-md-6">
+                <input type="search" id="reviewFilter" class="form-control form-control-sm" placeholder="キーワードで絞り込み（空白区切りでAND）">
+            </div>
+            <div class="col-md-3">
+                <select id="reviewStarFilter" class="form-select form-select-sm">
+                    <option value="">すべての星評価</option>
+                    ${[1, 2, 3, 4, 5].map(star => `<option value="${star}">★${star}</option>`).join('')}
+                </select>
             </div>
         </div>
+        <div id="reviewTable"></div>
     `;
     
-    container.innerHTML = html;
+    const models = modelColumns();
+    const modelWidth = `${Math.max(6, Math.floor(36 / Math.max(models.length, 1)))}%`;
+    const table = createVirtualTable(document.getElementById('reviewTable'), {
+        columns: [
+            { label: '#', width: '8%', sortKey: 'row', render: row => row.row + 1 },
+            { label: '星評価', width: '10%', sortKey: 'star_rating', render: row => row.star_rating ? `★${row.star_rating}` : '-' },
+            { label: '口コミ', width: '46%', render: row =>
+                `<span title="${escapeHtml(row.review_text)}">${escapeHtml(row.review_text)}</span>` },
+            ...models.map(([model, label]) => ({
+                label: label, width: modelWidth, sortKey: model, render: row => formatScore(row.scores[model])
+            }))
+        ],
+        initialQuery: { sort: 'row', order: 'asc' },
+        height: 360,
+        fetchPage: (page, perPage, query) => fetchTablePage(
+            `/hospitals/${encodeURIComponent(hospitalId)}/reviews?` +
+            new URLSearchParams(Object.assign({ page: page, per_page: perPage }, query))
+        ).then(data => ({ total: data.total, rows: data.reviews }))
+    });
+    bindTableFilter(document.getElementById('reviewFilter'), table, 'q');
+    document.getElementById('reviewStarFilter').addEventListener('change', event => {
+        table.setQuery({ star: event.target.value });
+    });
+    container.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
 }
 
 // サンプルCSVダウンロード機能は削除済み
@@ -0,0 +1,210 @@
+"""動物病院口コミ分析 - 静的ファイルの事前圧縮と長期キャッシュ配信
+
+- ビルド: static/ 以下のファイルを内容ハッシュ付きの名前（例: js/main_targeted.3f2a9c1b7d4e.js）で
+  static_build/ に書き出し、gzip / brotli（brotli パッケージがある場合）版も作成する
+- 配信: Accept-Encoding に応じて圧縮版を選び、immutable の長期キャッシュヘッダーと ETag（304対応）を付ける
+- HTML: テンプレートのレスポンスは ETag で再検証（304）し、gzip 圧縮して返す
+
+ビルドはデプロイ時の手順（Dockerfile / render.yaml の python static_assets.py）で行い、
+使われなくなった古いハッシュのファイルもそこで削除する。実行時はマニフェストを読むだけで書き込まない
+（読み取り専用のファイルシステムでも動く）。マニフェストが無い場合に限り、初回の配信時にビルドする。
+static/ を変更したら python static_assets.py で作り直す。
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+BUILD_DIR = os.environ.get('STATIC_BUILD_DIR', os.path.join(BASE_DIR, 'static_build'))
+MANIFEST_NAME = 'manifest.json'
+
+# 圧縮するファイル（画像などは圧縮済みなので対象外）と最小サイズ
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.html', '.svg', '.json', '.txt', '.map')
+MIN_COMPRESS_BYTES = 512
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Accept-Encoding で優先する順（値: 圧縮ファイルの拡張子）
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def fingerprint(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def _write_atomic(path, content):
+    """一時ファイルに書いてから置き換え（複数ワーカーの同時ビルドでも壊れたファイルを残さない）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+def build_assets(static_dir=STATIC_DIR, build_dir=BUILD_DIR, prune=False):
+    """static/ の全ファイルを内容ハッシュ付きで書き出し、マニフェスト（元のパス → ハッシュ付きパス）を返す
+
+    prune=True ならマニフェストに無いファイル（以前の内容のハッシュ付きファイル・圧縮版）を削除する。
+    """
+    manifest = {}
+    written = 0
+    for root, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                content = f.read()
+
+            base, ext = os.path.splitext(relative)
+            hashed = f'{base}.{fingerprint(content)}{ext}'
+            manifest[relative] = hashed
+            target = os.path.join(build_dir, hashed)
+            if os.path.exists(target):
+                continue  # 同じ内容は書き出し済み
+
+            _write_atomic(target, content)
+            if ext.lower() in COMPRESSIBLE_EXTENSIONS and len(content) >= MIN_COMPRESS_BYTES:
+                # mtime=0 で同じ内容から同じ圧縮結果にする
+                _write_atomic(target + '.gz', gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write_atomic(target + '.br', brotli.compress(content, quality=11))
+            written += 1
+
+    _write_atomic(os.path.join(build_dir, MANIFEST_NAME),
+                  json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8'))
+    removed = prune_build(build_dir, manifest) if prune else 0
+    print(f"静的ファイルのビルド: {len(manifest)}件（新規 {written}件、削除 {removed}件）→ {build_dir}"
+          f"{'' if brotli is not None else '（brotli 未インストールのため gzip のみ）'}")
+    return manifest
+
+
+def prune_build(build_dir, manifest):
+    """マニフェストから参照されないファイルを build_dir から削除し、削除した件数を返す"""
+    keep = {MANIFEST_NAME}
+    for hashed in manifest.values():
+        keep.update(hashed + suffix for suffix in ('', '.gz', '.br'))
+    removed = 0
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.relpath(path, build_dir).replace(os.sep, '/') not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def load_manifest(build_dir=BUILD_DIR):
+    """ビルド済みのマニフェストを読む（無ければ None）"""
+    try:
+        with open(os.path.join(build_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class AssetStore:
+    """ビルド済みの静的ファイルの配信（内容ハッシュ付きのパスのみ受け付ける）
+
+    マニフェストは初回の使用時に読み込む（import 時にはファイルシステムに触れない）。
+    """
+    def __init__(self, static_dir=STATIC_DIR, build_dir=BUILD_DIR):
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+        self._manifest = None
+        self._hashed_paths = set()
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._manifest is None:
+            with self._lock:
+                if self._manifest is None:
+                    self._load()
+
+    @property
+    def manifest(self):
+        self._ensure_loaded()
+        return self._manifest
+
+    @property
+    def hashed_paths(self):
+        self._ensure_loaded()
+        return self._hashed_paths
+
+    def _load(self):
+        manifest = load_manifest(self.build_dir)
+        if manifest is None:
+            # デプロイ時のビルドが無い環境（開発時など）だけ、その場でビルドする
+            try:
+                manifest = build_assets(self.static_dir, self.build_dir)
+            except OSError as e:
+                # 書き込めない場合はハッシュ付きの配信をせず、通常の /static/ を使う
+                print(f"静的ファイルのビルドに失敗しました（/static/ から配信）: {e}")
+                manifest = {}
+        self._hashed_paths = set(manifest.values())
+        self._manifest = manifest
+
+    def hashed_path(self, filename):
+        return self.manifest.get(filename)
+
+    def choose_encoding(self, hashed, accept_encodings):
+        """クライアントが受け付ける圧縮形式のうち、圧縮版があるもの（なければ None = 無圧縮）"""
+        for encoding, suffix in ENCODINGS:
+            if accept_encodings[encoding] > 0 and os.path.exists(os.path.join(self.build_dir, hashed + suffix)):
+                return encoding, suffix
+        return None, ''
+
+    def response(self, hashed, request):
+        """Flask のレスポンス（未知のパスは None）"""
+        from flask import send_file
+
+        if hashed not in self.hashed_paths:
+            return None
+        encoding, suffix = self.choose_encoding(hashed, request.accept_encodings)
+        mimetype = mimetypes.guess_type(hashed)[0] or 'application/octet-stream'
+        if mimetype.startswith('text/') or mimetype == 'application/javascript':
+            mimetype += '; charset=utf-8'
+
+        response = send_file(
+            os.path.join(self.build_dir, hashed + suffix), mimetype=mimetype,
+            etag=f"{hashed}-{encoding or 'identity'}", conditional=True
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers.pop('Last-Modified', None)  # 再検証は ETag のみ（内容ハッシュ）
+        return response
+
+
+def compress_html_response(response, request):
+    """テンプレートのHTML: ETag を付けて再検証（304）し、受け付けられれば gzip 圧縮"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype != 'text/html' or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    use_gzip = len(body) >= MIN_COMPRESS_BYTES and request.accept_encodings['gzip'] > 0
+    # 圧縮の有無で別の ETag にする（同じ ETag で異なるバイト列を返さない）
+    response.set_etag(hashlib.md5(body).hexdigest() + ('-gzip' if use_gzip else ''))
+    response.headers['Cache-Control'] = 'no-cache'  # 毎回再検証（内容が同じなら304）
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    if use_gzip:
+        response.set_data(gzip.compress(body, compresslevel=6, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+if __name__ == '__main__':
+    build_assets(prune=True)
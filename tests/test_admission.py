@@ -0,0 +1,71 @@
+"""受付制御（ラウンドロビンの待ち行列・クライアントごとの上限・429 + Retry-After）"""
+import pytest
+
+import app
+from admission import AdmissionController, AdmissionRejected
+
+
+@pytest.fixture
+def controller():
+    # 同時実行1件、待ち時間の見積もりでは拒否しない
+    return AdmissionController({
+        'max_concurrent': 1,
+        'max_concurrent_per_client': 1,
+        'max_queue': 16,
+        'max_queue_per_client': 3,
+        'max_wait': 60,
+        'initial_rate': 1e9
+    })
+
+
+def test_queue_is_round_robin_across_clients(controller):
+    running = controller.submit('x', 10)
+    assert running.admitted
+    tickets = [controller.submit(client_id, 10) for client_id in ('a', 'a', 'a', 'b', 'c')]
+    assert not any(ticket.admitted for ticket in tickets)
+    assert [ticket.position() for ticket in tickets] == [1, 2, 3, 4, 5]
+
+    order = []
+    current = running
+    for _ in tickets:
+        current.release()
+        current = next(ticket for ticket in tickets if ticket.admitted and not ticket.released)
+        order.append((current.client_id, tickets.index(current)))
+    # a の3件目までが先に入ったが、実行は a → b → c → a → a の順
+    assert order == [('a', 0), ('b', 3), ('c', 4), ('a', 1), ('a', 2)]
+
+
+def test_rejects_beyond_max_queue_per_client(controller):
+    controller.submit('x', 10)
+    for _ in range(3):
+        controller.submit('a', 10)
+    with pytest.raises(AdmissionRejected, match='待ち件数') as excinfo:
+        controller.submit('a', 10)
+    assert excinfo.value.retry_after >= 1
+    # 他のクライアントはまだ並べる
+    assert not controller.submit('b', 10).admitted
+    assert controller.status()['counters']['rejected'] == 1
+
+
+def test_cancel_removes_ticket_from_queue(controller):
+    running = controller.submit('x', 10)
+    first = controller.submit('a', 10)
+    second = controller.submit('b', 10)
+    controller.cancel(first)
+    assert second.position() == 1
+    running.release()
+    assert second.admitted and not first.admitted
+
+
+def test_analyze_returns_429_with_retry_after(monkeypatch):
+    busy = AdmissionController({'max_concurrent': 1, 'max_queue': 0})
+    busy.submit('other', 1000)
+    monkeypatch.setattr(app, 'admission', busy)
+    rows = [{'hospital_id': f'R{i % 3}', 'review_text': f'受付制御のテスト口コミ {i}', 'star_rating': 1 + i % 5}
+            for i in range(12)]
+
+    response = app.app.test_client().post('/analyze', json={'data': rows})
+    assert response.status_code == 429
+    body = response.get_json()
+    assert int(response.headers['Retry-After']) == body['retry_after'] >= 1
+    assert '混雑' in body['error']
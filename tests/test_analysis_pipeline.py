@@ -0,0 +1,98 @@
+"""分析パイプライン（メモ化されたステージグラフ・DataFrameの解放）と /analyze の入力検証"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+TEXTS = [
+    '先生がとても親切で丁寧でした。', '待ち時間が長いのが不便です。', '院内が清潔で安心できます。',
+    '料金が高いと感じました。', '看護師さんが優しい病院です。', '駐車場が狭くて古い建物でした。'
+]
+
+
+@pytest.fixture
+def reviews():
+    return pd.DataFrame({
+        'hospital_id': ['001', '002', '001', '0012', '002', '0012', '001', '002'],
+        'review_text': [TEXTS[i % len(TEXTS)] + str(i) for i in range(8)],
+        'star_rating': [5, 2, 4, 1, 5, 3, 4, 2]
+    })
+
+
+def request_rows(reviews, row, value):
+    """row 行目の星評価だけを value にした /analyze のリクエスト"""
+    rows = reviews.to_dict('records')
+    rows[row]['star_rating'] = value
+    return {'data': rows}
+
+
+@pytest.mark.parametrize('value', [4.5, 300, -1, 0, None, 'abc'])
+def test_parse_rejects_ratings_that_are_not_integers_1_to_5(reviews, value):
+    with pytest.raises(ValueError, match='star_rating'):
+        app.parse_analysis_request(request_rows(reviews, 3, value))
+
+
+def test_parse_accepts_integral_numbers_and_strings(reviews):
+    rows = reviews.to_dict('records')
+    rows[0]['star_rating'] = '5'
+    rows[1]['star_rating'] = 2.0
+    data = app.parse_analysis_request({'data': rows})
+    assert data['star_rating'].tolist() == reviews['star_rating'].tolist()
+
+
+def test_analyze_returns_400_for_fractional_rating(reviews):
+    response = app.app.test_client().post('/analyze', json=request_rows(reviews, 2, 4.5))
+    assert response.status_code == 400
+    assert 'star_rating' in response.get_json()['error']
+
+
+def test_recompute_after_release_frames_matches_first_run(reviews):
+    data = app.parse_analysis_request({'data': reviews.to_dict('records')})
+    pipeline = app.AnalysisPipeline(data)
+    _, first = pipeline.aggregate()
+    first = first.copy()
+    metrics = pipeline.performance_metrics()
+
+    pipeline.release_frames()
+    assert pipeline.data is None
+    # preprocess / scored を使うステージのメモを捨てると、compact から作り直した入力で再計算される。
+    # その結果が最初の計算と一致する（星評価が int8 で変わっていない）
+    for name in list(pipeline.memo):
+        if name == 'aggregate' or name.startswith('metrics:'):
+            pipeline.memo.pop(name)
+    _, again = pipeline.aggregate()
+    pd.testing.assert_frame_equal(first, again)
+    assert pipeline.performance_metrics() == metrics
+    np.testing.assert_array_equal(pipeline.compact()[1].input_frame()['star_rating'], reviews['star_rating'])
+
+
+def test_stage_graph_memoizes_and_recomputes_only_downstream(reviews, monkeypatch):
+    calls = []
+
+    def counting(name):
+        original = getattr(app, name)
+        def wrapper(*args, **kwargs):
+            calls.append(name)
+            return original(*args, **kwargs)
+        monkeypatch.setattr(app, name, wrapper)
+
+    counting('aggregate_by_hospital')
+    counting('pairwise_mae_difference_tests')
+    data = app.parse_analysis_request({'data': reviews.to_dict('records')})
+    pipeline = app.AnalysisPipeline(data)
+    settings = app.bootstrap_settings({'n_bootstrap': 200})
+
+    _, first = pipeline.aggregate()
+    tests_key, tests = pipeline.pairwise_mae_tests(settings)
+    # 同じ上流・パラメータのノードは計算し直さない
+    assert pipeline.aggregate()[1] is first
+    assert pipeline.pairwise_mae_tests(settings)[1] is tests
+    assert calls == ['aggregate_by_hospital', 'pairwise_mae_difference_tests']
+
+    # ブートストラップ設定を変えると検定のノードだけを計算し直す
+    scored_key = pipeline.scored_key()
+    other_key, _ = pipeline.pairwise_mae_tests(app.bootstrap_settings({'n_bootstrap': 300}))
+    assert other_key != tests_key
+    assert pipeline.scored_key() == scored_key and pipeline.aggregate()[1] is first
+    assert calls == ['aggregate_by_hospital', 'pairwise_mae_difference_tests', 'pairwise_mae_difference_tests']
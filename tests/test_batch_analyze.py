@@ -0,0 +1,26 @@
+"""バッチ実行CLI（batch_analyze.py）"""
+import json
+
+import pandas as pd
+
+import app
+from batch_analyze import main
+
+
+def test_report_uses_clamped_n_bootstrap(tmp_path):
+    path = tmp_path / 'reviews.csv'
+    pd.DataFrame({
+        'hospital_id': [f'H{i % 4}' for i in range(40)],
+        'review_text': [f'先生が親切でした（{i}）' if i % 2 else f'待ち時間が長かった（{i}）' for i in range(40)],
+        'star_rating': [1 + i % 5 for i in range(40)],
+    }).to_csv(path, index=False)
+
+    main([str(path), '--out-dir', str(tmp_path / 'out'), '--workers', '1', '--n-bootstrap', '5'])
+
+    with open(tmp_path / 'out' / 'report.json', encoding='utf-8') as f:
+        report = json.load(f)
+    low = app.BOOTSTRAP_LIMITS['n_bootstrap'][0]
+    assert report['n_bootstrap'] == low
+    assert report['bootstrap_settings']['n_bootstrap'] == low
+    for correlation in report['sentiment_correlation']['correlations'].values():
+        assert correlation['n_replicates'] <= low
@@ -0,0 +1,60 @@
+"""フルBERT版のバッチ推論（calculate_scores → analyze_batch）"""
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def afb():
+    spec = importlib.util.spec_from_file_location('app_full_bert', os.path.join(ROOT, 'app-full-bert.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reviews(n):
+    texts = ['先生が親切で安心しました。', '待ち時間が長く説明も不十分でした。', '', '清潔で設備も良い病院です。']
+    return pd.DataFrame({
+        'hospital_id': [f'H{i % 3}' for i in range(n)],
+        'review_text': [texts[i % len(texts)] + ('！' * (i // len(texts))) for i in range(n)],
+        'star_rating': [1 + i % 5 for i in range(n)],
+    })
+
+
+def test_calculate_scores_runs_model_batches(afb, monkeypatch):
+    calls = {}
+    original = afb.analyzer.analyze_batch
+
+    def record(texts, model_name, return_embedding=False):
+        calls.setdefault(model_name, []).append(len(texts))
+        return original(texts, model_name, return_embedding)
+
+    monkeypatch.setattr(afb.analyzer, 'analyze_batch', record)
+    n = 37
+    afb.calculate_scores(reviews(n))
+    assert set(calls) == set(afb.MODELS)
+    for model_name, sizes in calls.items():
+        batch_size = afb.MODEL_SPECS[model_name].batch_size
+        assert sum(sizes) == n
+        assert all(size == batch_size for size in sizes[:-1])
+        assert 0 < sizes[-1] <= batch_size
+
+
+def test_batch_matches_single_text_analysis(afb, tmp_path):
+    data = afb.calculate_scores(reviews(11), collect_embeddings=True, embeddings_dir=str(tmp_path))
+    dataset_key = afb.dataset_content_key(reviews(11))
+    for model_name, display_name in afb.MODELS.items():
+        expected = []
+        for text in data['review_text']:
+            sentiment = afb.analyzer.analyze_sentiment(text, model_name)
+            expected.append(sentiment['positive'] * 2 - sentiment['negative'] * 2)
+        np.testing.assert_allclose(data[f'{display_name}_score'], expected)
+        # 空の口コミは中立（スコア0）で、埋め込みは書き込まれない
+        assert data[f'{display_name}_score'].iloc[2] == 0.0
+        matrix = afb.load_embeddings(model_name, dataset_key, str(tmp_path))
+        assert matrix is not None and matrix.shape[0] == len(data)
@@ -0,0 +1,99 @@
+"""近似重複クラスタと代表スコアの流用（NEAR_DUPLICATE_COLLAPSE）"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+from near_duplicates import cluster_near_duplicates
+
+BASE_TEXTS = [
+    '先生がとても親切で丁寧に説明してくれました。待ち時間も短く安心して任せられる動物病院です。',
+    '受付の対応が悪い上に料金が高いと感じました。駐車場も狭いので次は別の病院にしようと思います。',
+    '院内が清潔で、看護師さんも優しい。夜間の急患にも的確に対応してくれて本当に頼りになりました。',
+    '診察までの待ち時間が長い。説明も不十分で、薬の飲ませ方がよくわからず不安が残りました。',
+    '設備は古いけれど先生の腕は確かです。うちの猫も怖がらずに診てもらえて、よい病院だと思います。',
+]
+# 句読点・空白だけが違う近似重複
+VARIANTS = [lambda t: t, lambda t: t + '！', lambda t: ' ' + t.replace('。', '。 '), lambda t: t + '。']
+# 代表スコアを流用したときの許容差（モックのハッシュノイズは確率で±0.05 = スコアで±0.2）
+REVIEW_TOLERANCE = 0.4
+HOSPITAL_TOLERANCE = 0.2
+
+
+@pytest.fixture
+def reviews():
+    rows = []
+    for i, text in enumerate(BASE_TEXTS):
+        for j, variant in enumerate(VARIANTS):
+            rows.append({'hospital_id': f'H{(i + j) % 3}', 'review_text': variant(text), 'star_rating': 1 + (i + j) % 5})
+    return pd.DataFrame(rows)
+
+
+def score_all(monkeypatch, data, collapse):
+    monkeypatch.setitem(app.NEAR_DUPLICATE_SETTINGS, 'collapse', collapse)
+    pipeline = app.AnalysisPipeline(data.copy())
+    return pipeline, {model_name: pipeline.score(model_name)[1] for model_name in app.MODELS}
+
+
+def test_variants_cluster_together(reviews):
+    labels = app.near_duplicate_labels(reviews['review_text'])
+    assert len(np.unique(labels)) == len(BASE_TEXTS)
+    # 代表はクラスタ内の最小の行番号
+    assert all(labels[row] <= row for row in range(len(labels)))
+
+
+def test_distinct_texts_are_not_clustered():
+    texts = [f'{text}{i}' * 2 for i, text in enumerate(BASE_TEXTS)]
+    labels = cluster_near_duplicates(texts, threshold=0.9)
+    assert list(labels) == list(range(len(texts)))
+
+
+@pytest.mark.skipif('NEAR_DUPLICATE_COLLAPSE' in os.environ, reason='環境変数で上書きされている')
+def test_collapse_is_opt_in():
+    assert app.NEAR_DUPLICATE_SETTINGS['collapse'] is False
+
+
+def test_collapse_disabled_scores_every_review(monkeypatch, reviews):
+    pipeline, scores = score_all(monkeypatch, reviews, collapse=False)
+    assert pipeline.collapse_summary() == {'enabled': False}
+    for model_name, model_scores in scores.items():
+        expected = [app.score_review(text, model_name) for text in reviews['review_text']]
+        np.testing.assert_allclose(model_scores, expected)
+
+
+def test_collapsed_scores_stay_within_tolerance_of_full_scoring(monkeypatch, reviews):
+    _, full = score_all(monkeypatch, reviews, collapse=False)
+    pipeline, collapsed = score_all(monkeypatch, reviews, collapse=True)
+
+    summary = pipeline.collapse_summary()
+    assert summary['enabled'] is True
+    assert summary['n_clusters'] == len(BASE_TEXTS)
+    assert summary['n_collapsed'] == len(reviews) - len(BASE_TEXTS)
+
+    hospitals = reviews['hospital_id']
+    for model_name in app.MODELS:
+        assert np.max(np.abs(collapsed[model_name] - full[model_name])) <= REVIEW_TOLERANCE
+        full_means = pd.Series(full[model_name]).groupby(hospitals).mean()
+        collapsed_means = pd.Series(collapsed[model_name]).groupby(hospitals).mean()
+        assert np.max(np.abs(collapsed_means - full_means)) <= HOSPITAL_TOLERANCE
+
+        # /near_duplicates?verify=1 の抽出確認も同じ許容差に収まる
+        check = pipeline.near_duplicate_check(model_name)[1]
+        assert check['sample_size'] == min(summary['n_collapsed'], app.NEAR_DUPLICATE_SETTINGS['verify_sample'])
+        assert check['max_abs_difference'] <= REVIEW_TOLERANCE
+
+
+def test_analyze_reports_collapse_counts(monkeypatch, reviews):
+    monkeypatch.setitem(app.NEAR_DUPLICATE_SETTINGS, 'collapse', True)
+    monkeypatch.setattr(app, 'analysis_cache', app.AnalysisCache())
+    client = app.app.test_client()
+    response = client.post('/analyze', json={
+        'data': reviews.to_dict('records'),
+        'bootstrap': {'n_bootstrap': 200, 'mode': 'fixed'}
+    })
+    assert response.status_code == 200
+    summary = response.get_json()['results']['score_collapse']
+    assert summary['n_clusters'] == len(BASE_TEXTS)
+    assert summary['n_collapsed'] == len(reviews) - len(BASE_TEXTS)
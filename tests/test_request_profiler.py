@@ -0,0 +1,68 @@
+"""リクエスト単位のプロファイリング（X-Profile-Token ヘッダーが正しい場合だけ計測・取得できる）"""
+import pytest
+
+import app
+import request_profiler
+from request_profiler import ProfileStore
+
+TOKEN = 'profile-test-token'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    store = ProfileStore()
+    middleware = app.app.wsgi_app
+    monkeypatch.setitem(middleware.settings, 'token', TOKEN)
+    monkeypatch.setitem(request_profiler.PROFILE_SETTINGS, 'token', TOKEN)
+    monkeypatch.setattr(middleware, 'store', store)
+    monkeypatch.setattr(app, 'profiles', store)
+    return app.app.test_client(), store
+
+
+def get(client, path, headers=None, **kwargs):
+    response = client.get(path, headers=headers or {}, **kwargs)
+    # 計測はレスポンスを閉じたときに保存される
+    response.close()
+    return response
+
+
+@pytest.mark.parametrize('headers,query', [
+    (None, None),
+    ({'X-Profile-Token': 'wrong'}, None),
+    (None, {'profile_token': TOKEN}),   # クエリ文字列のトークンは受け付けない
+])
+def test_not_profiled_without_correct_header(client, headers, query):
+    client, store = client
+    response = get(client, '/healthz', headers, query_string=query)
+    assert response.status_code == 200
+    assert 'X-Profile-Id' not in response.headers
+    assert store.summaries() == []
+
+
+def test_profile_returned_only_with_correct_token(client):
+    client, store = client
+    response = get(client, '/healthz', {'X-Profile-Token': TOKEN})
+    profile_id = response.headers['X-Profile-Id']
+    assert [entry['id'] for entry in store.summaries()] == [profile_id]
+
+    for headers in (None, {'X-Profile-Token': 'wrong'}):
+        assert get(client, '/admin/profiles', headers).status_code == 403
+        assert get(client, f'/admin/profiles/{profile_id}', headers).status_code == 403
+    assert get(client, f'/admin/profiles/{profile_id}', query_string={'profile_token': TOKEN}).status_code == 403
+
+    listed = get(client, '/admin/profiles', {'X-Profile-Token': TOKEN})
+    assert [entry['id'] for entry in listed.get_json()['profiles']] == [profile_id]
+    entry = get(client, f'/admin/profiles/{profile_id}', {'X-Profile-Token': TOKEN}).get_json()
+    assert entry['path'] == '/healthz' and entry['status'] == 200
+    collapsed = get(client, f'/admin/profiles/{profile_id}/collapsed', {'X-Profile-Token': TOKEN})
+    assert collapsed.status_code == 200 and collapsed.get_data(as_text=True).strip()
+    # 取得のリクエスト自体は計測しない
+    assert len(store.summaries()) == 1
+
+
+def test_store_evicts_oldest_over_byte_budget():
+    store = ProfileStore(max_entries=10, max_bytes=100)
+    for i in range(3):
+        store.add({'id': str(i), 'collapsed': 'x' * 60, 'functions': '', 'allocations': ''})
+    assert [entry['id'] for entry in store.summaries()] == ['2']
+    assert store.total_bytes == 60
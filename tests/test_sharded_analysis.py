@@ -0,0 +1,67 @@
+"""シャード分割（split → map → reduce）と単一プロセス実行の一致"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+from batch_analyze import build_report, iter_chunks, validate_chunk
+from sharded_analysis import map_shard, reduce_shards, split_input
+
+TEXTS = [
+    '先生がとても親切で安心しました。',
+    '待ち時間が長く、説明も不十分でした。',
+    '院内が清潔で看護師さんも優しいです。',
+    '料金が高いと感じました。',
+    '夜間の急患にも対応してくれて助かりました。',
+]
+
+
+def write_reviews(path, hospital_ids, n=60):
+    pd.DataFrame({
+        'hospital_id': [hospital_ids[i % len(hospital_ids)] for i in range(n)],
+        'review_text': [f'{TEXTS[i % len(TEXTS)]}（{i}）' for i in range(n)],
+        'star_rating': [1 + (i * 7) % 5 for i in range(n)],
+    }).to_csv(path, index=False)
+
+
+def single_process_report(path):
+    chunks = [validate_chunk(chunk) for chunk in iter_chunks(str(path), 25)]
+    scored = pd.concat([app.calculate_scores(chunk.reset_index(drop=True)) for chunk in chunks], ignore_index=True)
+    return build_report(app, scored, n_bootstrap=200), scored
+
+
+def sharded_report(path, work_dir, n_shards):
+    split_input(str(path), n_shards, str(work_dir), chunk_size=25)
+    for shard_id in range(n_shards):
+        map_shard(shard_id, str(work_dir), chunk_size=10)
+    return reduce_shards(str(work_dir), n_bootstrap=200)
+
+
+@pytest.mark.parametrize('hospital_ids', [
+    ['001', '002', '010', 'A-7'],   # 文字列のID（ゼロ埋めを保持）
+    ['1', '2', '10', '30'],          # 数値のID（数値順）
+])
+def test_sharded_report_matches_single_process(tmp_path, hospital_ids):
+    path = tmp_path / 'reviews.csv'
+    write_reviews(path, hospital_ids)
+    expected, scored = single_process_report(path)
+    actual = sharded_report(path, tmp_path / 'shards', n_shards=3)
+
+    assert actual['n_shards'] == 3
+    assert list(actual['hospital_analysis']) == list(expected['hospital_analysis'])
+    for hospital_id, stats in expected['hospital_analysis'].items():
+        assert actual['hospital_analysis'][hospital_id]['review_count'] == stats['review_count']
+        for key, value in stats.items():
+            assert actual['hospital_analysis'][hospital_id][key] == pytest.approx(value)
+    assert actual['basic_stats'] == pytest.approx(expected['basic_stats'])
+    assert actual['star_rating_distribution'] == expected['star_rating_distribution']
+    for display_name, metrics in expected['model_comparison'].items():
+        assert actual['model_comparison'][display_name] == pytest.approx(metrics)
+
+
+def test_string_ids_keep_leading_zeros(tmp_path):
+    path = tmp_path / 'reviews.csv'
+    write_reviews(path, ['001', '002', 'B12'])
+    report = sharded_report(path, tmp_path / 'shards', n_shards=2)
+    assert list(report['hospital_analysis']) == ['001', '002', 'B12']
+    assert np.sum([stats['review_count'] for stats in report['hospital_analysis'].values()]) == 60
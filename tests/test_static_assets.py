@@ -0,0 +1,59 @@
+"""静的ファイルのビルド（デプロイ時）と実行時の読み込み"""
+import json
+import os
+
+import static_assets
+from static_assets import AssetStore, build_assets, load_manifest
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_build_prunes_outputs_of_old_content(tmp_path):
+    static_dir, build_dir = tmp_path / 'static', tmp_path / 'build'
+    write(str(static_dir / 'js' / 'app.js'), 'console.log(1);' * 100)
+    old = build_assets(str(static_dir), str(build_dir))['js/app.js']
+
+    write(str(static_dir / 'js' / 'app.js'), 'console.log(2);' * 100)
+    manifest = build_assets(str(static_dir), str(build_dir), prune=True)
+
+    assert manifest['js/app.js'] != old
+    assert not (build_dir / old).exists() and not (build_dir / (old + '.gz')).exists()
+    assert (build_dir / manifest['js/app.js']).exists()
+    assert load_manifest(str(build_dir)) == manifest
+
+
+def test_store_reads_existing_manifest_without_writing(tmp_path, monkeypatch):
+    build_dir = tmp_path / 'build'
+    write(str(build_dir / 'manifest.json'), json.dumps({'css/a.css': 'css/a.0123456789ab.css'}))
+    monkeypatch.setattr(static_assets, 'build_assets', lambda *args, **kwargs: fail_build())
+
+    store = AssetStore(static_dir=str(tmp_path / 'static'), build_dir=str(build_dir))
+    assert store.hashed_path('css/a.css') == 'css/a.0123456789ab.css'
+    assert sorted(os.listdir(build_dir)) == ['manifest.json']
+
+
+def test_store_does_not_touch_filesystem_until_used(tmp_path):
+    build_dir = tmp_path / 'build'
+    write(str(tmp_path / 'static' / 'a.css'), 'body {}')
+    store = AssetStore(static_dir=str(tmp_path / 'static'), build_dir=str(build_dir))
+    assert not build_dir.exists()
+    # マニフェストが無い場合だけ、初回の使用時にビルドする
+    assert store.hashed_path('a.css').startswith('a.')
+    assert (build_dir / 'manifest.json').exists()
+
+
+def test_unwritable_build_dir_falls_back_to_static(tmp_path, monkeypatch):
+    def read_only(*args, **kwargs):
+        raise PermissionError('read-only file system')
+    monkeypatch.setattr(static_assets, 'build_assets', read_only)
+    store = AssetStore(static_dir=str(tmp_path / 'static'), build_dir=str(tmp_path / 'build'))
+    assert store.hashed_path('a.css') is None
+    assert store.hashed_paths == set()
+
+
+def fail_build():
+    raise AssertionError('マニフェストがあるのにビルドされた')
@@ -0,0 +1,48 @@
+"""病院ごとの上位k件（grouped_top_k）と並べ替えによる参照実装の一致"""
+import numpy as np
+import pytest
+
+from top_reviews import grouped_top_k
+
+
+def group_index(group_ids, n_groups):
+    """HospitalRowIndex と同じ形の order / offsets"""
+    order = np.argsort(group_ids, kind='stable')
+    offsets = np.searchsorted(group_ids[order], np.arange(n_groups + 1))
+    return order, offsets
+
+
+def reference_top_k(criteria, order, offsets, k):
+    """グループごとに全件を並べ替えて上位 k 行（NaN は除外、足りない分は -1）"""
+    n_groups = len(offsets) - 1
+    result = np.full((n_groups, len(criteria), k), -1, dtype=np.int64)
+    for g in range(n_groups):
+        rows = order[offsets[g]:offsets[g + 1]]
+        for c, values in enumerate(criteria):
+            rows_c = rows[~np.isnan(values[rows])]
+            ranked = rows_c[np.argsort(-values[rows_c], kind='stable')][:k]
+            result[g, c, :len(ranked)] = ranked
+    return result
+
+
+@pytest.mark.parametrize('k', [1, 3, 10])
+@pytest.mark.parametrize('block_cells', [7, 4000000])
+def test_matches_sort_reference(k, block_cells):
+    rng = np.random.default_rng(0)
+    n_rows, n_groups = 500, 40
+    # 件数の偏ったグループ（0件・1件・同じ件数の病院を含む）
+    group_ids = np.minimum(rng.geometric(0.08, size=n_rows) - 1, n_groups - 1)
+    criteria = rng.normal(size=(3, n_rows))
+    criteria[rng.random(size=criteria.shape) < 0.1] = np.nan
+    order, offsets = group_index(group_ids, n_groups)
+
+    actual = grouped_top_k(criteria, order, offsets, k, block_cells=block_cells)
+    np.testing.assert_array_equal(actual, reference_top_k(criteria, order, offsets, k))
+
+
+def test_empty_groups_and_k_zero():
+    criteria = np.array([[0.5, -1.0, 2.0]])
+    order, offsets = group_index(np.array([0, 0, 2]), 3)
+    result = grouped_top_k(criteria, order, offsets, 2)
+    np.testing.assert_array_equal(result[:, 0], [[0, 1], [-1, -1], [2, -1]])
+    assert grouped_top_k(criteria, order, offsets, 0).shape == (3, 1, 0)
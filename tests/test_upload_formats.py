@@ -0,0 +1,106 @@
+"""アップロードファイルの読み込み（CSV / gzip CSV / NDJSON / Parquet / Arrow IPC）と展開サイズの上限"""
+import gzip
+import io
+import json
+
+import pandas as pd
+import pytest
+
+import upload_formats
+from upload_formats import (
+    MissingColumnsError, UploadFormatError, _gunzip, detect_format, read_reviews
+)
+
+ROWS = [
+    {'hospital_id': 'H001', 'review_text': '先生が親切でした', 'star_rating': 5, 'extra': 'x'},
+    {'hospital_id': 'H002', 'review_text': '待ち時間が長い', 'star_rating': '2', 'extra': 'y'},
+    {'hospital_id': 'H001', 'review_text': '範囲外の評価', 'star_rating': 9, 'extra': 'z'},
+]
+
+
+def csv_bytes(encoding='utf-8'):
+    return pd.DataFrame(ROWS).to_csv(index=False).encode(encoding)
+
+
+def ndjson_bytes():
+    return '\n'.join(json.dumps(row, ensure_ascii=False) for row in ROWS).encode('utf-8')
+
+
+def assert_valid_reviews(df):
+    assert list(df.columns) == upload_formats.REQUIRED_COLUMNS
+    # 範囲外の星評価（9）は除外され、文字列の評価は数値になる
+    assert df['hospital_id'].tolist() == ['H001', 'H002']
+    assert df['star_rating'].tolist() == [5, 2]
+
+
+@pytest.mark.parametrize('filename,content', [
+    ('reviews.csv', csv_bytes()),
+    ('reviews.csv', csv_bytes('shift_jis')),
+    ('reviews.csv.gz', gzip.compress(csv_bytes())),
+    ('reviews.ndjson', ndjson_bytes()),
+    ('reviews.jsonl.gz', gzip.compress(ndjson_bytes())),
+])
+def test_text_formats(filename, content):
+    assert_valid_reviews(read_reviews(filename, content))
+
+
+def test_arrow_formats():
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(pd.DataFrame(ROWS).astype({'star_rating': str}), preserve_index=False)
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    assert_valid_reviews(read_reviews('upload', buffer.getvalue()))
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    assert_valid_reviews(read_reviews('reviews.arrow', sink.getvalue().to_pybytes()))
+
+
+def test_missing_columns():
+    content = pd.DataFrame([{'hospital_id': 'H1', 'text': 'x'}]).to_csv(index=False).encode('utf-8')
+    with pytest.raises(MissingColumnsError) as excinfo:
+        read_reviews('reviews.csv', content)
+    assert excinfo.value.missing == ['review_text', 'star_rating']
+
+
+@pytest.mark.parametrize('filename,content', [
+    ('reviews.csv', csv_bytes()),
+    ('reviews.ndjson', ndjson_bytes()),
+])
+def test_max_rows(filename, content):
+    with pytest.raises(UploadFormatError, match='2件まで'):
+        read_reviews(filename, content, max_rows=2)
+    assert len(read_reviews(filename, content, max_rows=3)) == 2
+
+
+def test_unknown_format():
+    with pytest.raises(UploadFormatError, match='無効なファイル形式'):
+        detect_format('reviews.xlsx', b'PK\x03\x04')
+    assert detect_format('upload', b'PAR1....') == 'parquet'
+
+
+def test_gzip_bomb_rejected_at_limit(monkeypatch):
+    limit = 64 * 1024
+    # 圧縮後は数百バイトで、展開すると上限を1バイト超える
+    bomb = gzip.compress(b'0' * (limit + 1))
+    assert len(bomb) < 1024
+    with pytest.raises(UploadFormatError, match='展開後のファイルサイズ'):
+        _gunzip(bomb, limit)
+    assert len(_gunzip(gzip.compress(b'0' * limit), limit)) == limit
+
+    # read_reviews は MAX_DECOMPRESSED_BYTES を上限に展開する
+    monkeypatch.setattr(upload_formats, 'MAX_DECOMPRESSED_BYTES', limit)
+    header = b'hospital_id,review_text,star_rating\n'
+    content = gzip.compress(header + b'H1,' + b'a' * limit + b',5\n')
+    for filename in ('reviews.csv.gz', 'reviews.ndjson.gz'):
+        with pytest.raises(UploadFormatError, match='展開後のファイルサイズ'):
+            read_reviews(filename, content)
+
+
+def test_corrupt_gzip():
+    with pytest.raises(UploadFormatError, match='gzipの展開に失敗'):
+        _gunzip(gzip.compress(csv_bytes())[:20])
@@ -0,0 +1,101 @@
+"""動物病院口コミ分析 - 病院ごとの上位k件の口コミ（部分選択）
+
+スコア計算後に一度だけ、全病院・全モデルについて
+最もポジティブ / 最もネガティブ / 星評価とのずれが最も大きい口コミ k 件を求める。
+
+- 口コミを「病院の件数 → 病院」の順に一度だけ並べ替える。同じ件数の病院は連続するので、
+  その範囲は（基準 × 病院 × 件数）の行列としてコピーなしで見られる
+- 行列の最後の軸に沿って np.argpartition で上位 k 件だけを選び、k 件だけを並べ替える
+  （病院ごとの全件ソートをしない。同じ件数の病院・全基準を1回の argpartition でまとめて処理）
+"""
+import numpy as np
+
+KINDS = ('most_positive', 'most_negative', 'largest_disagreement')
+# 1回の argpartition で処理する要素数の上限（基準数 × 病院数 × 件数）
+BLOCK_CELLS = 4000000
+
+
+def grouped_top_k(criteria, order, offsets, k, block_cells=BLOCK_CELLS):
+    """グループごとに各基準の値が大きい順に k 行を選ぶ（NaN の行は選ばない）
+
+    criteria: 基準 × 行の配列（基準ごとに連続したメモリだと並べ替えが速い）
+    order, offsets: グループ順に並べた行番号と各グループの開始位置（HospitalRowIndex と同じ形）
+    戻り値: グループ × 基準 × k の行番号（大きい順、足りない分は -1）
+    """
+    criteria = np.asarray(criteria)
+    counts = np.diff(offsets)
+    n_groups = len(counts)
+    n_criteria = len(criteria)
+    result = np.full((n_groups, n_criteria, k), -1, dtype=np.int64)
+    if n_groups == 0 or k == 0:
+        return result
+
+    # グループを件数順に並べ、行もその順に並べ替える（入力は変更しない）
+    by_size = np.argsort(counts, kind='stable')
+    sizes = counts[by_size]
+    size_offsets = np.concatenate([[0], np.cumsum(sizes)])
+    rows = order[np.arange(size_offsets[-1]) + np.repeat(offsets[by_size] - size_offsets[:-1], sizes)]
+    sorted_values = np.take(criteria, rows, axis=1)
+    sorted_values[np.isnan(sorted_values)] = -np.inf
+
+    # 件数が同じグループの範囲ごとに処理
+    run_starts = np.flatnonzero(np.concatenate([[True], sizes[1:] != sizes[:-1]]))
+    run_ends = np.concatenate([run_starts[1:], [n_groups]])
+    for run_start, run_end in zip(run_starts, run_ends):
+        width = int(sizes[run_start])
+        if width == 0:
+            continue
+        kk = min(k, width)
+        step = max(1, block_cells // (n_criteria * width))
+        for first in range(run_start, run_end, step):
+            last = min(first + step, run_end)
+            lo, hi = size_offsets[first], size_offsets[last]
+            block = sorted_values[:, lo:hi].reshape(n_criteria, last - first, width)
+            block_rows = rows[lo:hi].reshape(last - first, width)
+            if width > kk:
+                selected = np.argpartition(block, width - kk, axis=2)[:, :, width - kk:]
+                top_values = np.take_along_axis(block, selected, axis=2)
+            else:
+                selected = np.broadcast_to(np.arange(width), block.shape)
+                top_values = block
+            # 選んだ k 件だけを大きい順に並べる
+            ranking = np.argsort(-top_values, axis=2, kind='stable')
+            selected = np.take_along_axis(selected, ranking, axis=2)
+            top_values = np.take_along_axis(top_values, ranking, axis=2)
+            top_rows = np.take_along_axis(np.broadcast_to(block_rows, block.shape), selected, axis=2)
+            top_rows[np.isneginf(top_values)] = -1
+            result[by_size[first:last], :, :kk] = top_rows.transpose(1, 0, 2)
+    return result
+
+
+class HospitalTopReviews:
+    """病院 × 種類（KINDS）× モデル × k の行番号（-1 は該当なし）"""
+    def __init__(self, scored_data, hospital_index, k):
+        scores = np.ascontiguousarray(scored_data.scores.T)  # モデル × 口コミ（float32）
+        star_scores = scored_data.star_scores
+        # 基準: ポジティブ（スコア）/ ネガティブ（-スコア）/ 星評価とのずれ（星評価の欠損はNaN）
+        criteria = np.concatenate([scores, -scores, np.abs(scores - star_scores[None, :])])
+        n_models = len(scores)
+        top = grouped_top_k(criteria, hospital_index.order, hospital_index.offsets, k)
+        self.rows = top.reshape(len(top), len(KINDS), n_models, k)
+        self.k = k
+        self.display_names = list(scored_data.display_names)
+        self.lookup = hospital_index.lookup
+
+    def hospital(self, hospital_id, k=None):
+        """1病院分: {種類: {モデル表示名: 行番号のリスト}}。未登録の病院は None"""
+        code = self.lookup.get(str(hospital_id))
+        if code is None:
+            return None
+        k = self.k if k is None else min(k, self.k)
+        return {
+            kind: {
+                display_name: [int(row) for row in self.rows[code, i, m, :k] if row >= 0]
+                for m, display_name in enumerate(self.display_names)
+            }
+            for i, kind in enumerate(KINDS)
+        }
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
@@ -0,0 +1,203 @@
+"""動物病院口コミ分析 - アップロードファイルの読み込み（CSV / gzip CSV / Parquet / Arrow IPC / NDJSON）
+
+どの形式も必要な3列（hospital_id, review_text, star_rating）だけを読み込み、
+CSVと同じ検証（星評価の数値化・1-5の範囲）をした DataFrame にする。
+
+- CSV / gzip CSV: pandas の usecols で必要な列だけ解析（UTF-8 → Shift_JIS → CP932 の順に試す）
+- Parquet: pyarrow で必要な列だけ読み込む（他の列はデコードしない）
+- Arrow IPC（ファイル形式 / ストリーム形式）: pyarrow で必要な列だけ pandas に変換
+- NDJSON（.ndjson / .jsonl、gzip も可）: チャンクごとに読み込み、必要な列だけ残す
+
+Parquet / Arrow IPC には pyarrow が必要（未インストールなら UploadFormatError）。
+gzip は展開後のサイズ（UPLOAD_MAX_DECOMPRESSED_BYTES）を超えた時点で読み込みをやめる。
+行数が max_rows を超えるファイルも UploadFormatError。
+"""
+import gzip
+import io
+import os
+import zlib
+
+import pandas as pd
+
+REQUIRED_COLUMNS = ['hospital_id', 'review_text', 'star_rating']
+CSV_ENCODINGS = ('utf-8', 'shift_jis', 'cp932')
+NDJSON_CHUNK_ROWS = 10000
+# gzip 展開後の上限（圧縮率の高いファイルでメモリを使い切らないように少しずつ展開して確認する）
+MAX_DECOMPRESSED_BYTES = int(os.environ.get('UPLOAD_MAX_DECOMPRESSED_BYTES', 64 * 1024 * 1024))
+
+# 拡張子 → 形式（長いものから判定する）
+EXTENSIONS = (
+    ('.csv.gz', 'csv'),
+    ('.csv', 'csv'),
+    ('.parquet', 'parquet'),
+    ('.arrow', 'arrow'),
+    ('.feather', 'arrow'),
+    ('.ipc', 'arrow'),
+    ('.ndjson.gz', 'ndjson'),
+    ('.jsonl.gz', 'ndjson'),
+    ('.ndjson', 'ndjson'),
+    ('.jsonl', 'ndjson')
+)
+ACCEPTED_EXTENSIONS = [extension for extension, _ in EXTENSIONS]
+
+GZIP_MAGIC = b'\x1f\x8b'
+PARQUET_MAGIC = b'PAR1'
+ARROW_FILE_MAGIC = b'ARROW1'
+
+
+class UploadFormatError(ValueError):
+    """読み込めないファイル（形式不明・pyarrow 未インストール・列不足など）"""
+
+
+class MissingColumnsError(UploadFormatError):
+    """必要な列が不足している"""
+    def __init__(self, missing, found):
+        super().__init__(f'必要な列が不足しています: {", ".join(missing)}')
+        self.missing = list(missing)
+        self.found = list(found)
+
+
+def detect_format(filename, content):
+    """ファイル名の拡張子（不明なら先頭のマジックバイト）から形式を判定"""
+    name = (filename or '').lower()
+    for extension, file_format in EXTENSIONS:
+        if name.endswith(extension):
+            return file_format
+    if content[:4] == PARQUET_MAGIC:
+        return 'parquet'
+    if content[:6] == ARROW_FILE_MAGIC:
+        return 'arrow'
+    raise UploadFormatError(
+        f'無効なファイル形式です。対応形式: {", ".join(ACCEPTED_EXTENSIONS)}'
+    )
+
+
+def _gunzip(content, limit=None):
+    """gzip なら展開する（展開後が limit バイトを超えたら UploadFormatError）"""
+    if content[:2] != GZIP_MAGIC:
+        return content
+    limit = MAX_DECOMPRESSED_BYTES if limit is None else limit
+    try:
+        with gzip.GzipFile(fileobj=io.BytesIO(content)) as f:
+            data = f.read(limit + 1)
+    except (OSError, EOFError, zlib.error) as e:
+        raise UploadFormatError(f'gzipの展開に失敗しました: {str(e)}')
+    if len(data) > limit:
+        raise UploadFormatError(f'展開後のファイルサイズが上限（{limit // (1024 * 1024)}MB）を超えています')
+    return data
+
+
+def _check_rows(n_rows, max_rows):
+    if max_rows is not None and n_rows > max_rows:
+        raise UploadFormatError(f'一度に処理できるデータは{max_rows:,}件までです')
+
+
+def _check_columns(found):
+    missing = [col for col in REQUIRED_COLUMNS if col not in found]
+    if missing:
+        raise MissingColumnsError(missing, found)
+
+
+def _import_pyarrow(file_format):
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise UploadFormatError(f'{file_format} の読み込みには pyarrow が必要です: pip install pyarrow')
+
+
+def read_csv_content(content, max_rows=None):
+    """CSV（gzip も可）の必要な列だけを読み込む（max_rows + 1 行で読み込みをやめる）"""
+    content = _gunzip(content)
+    found = []
+
+    def wanted(col):
+        found.append(col)
+        return col in REQUIRED_COLUMNS
+
+    for encoding in CSV_ENCODINGS:
+        try:
+            found.clear()
+            df = pd.read_csv(io.BytesIO(content), usecols=wanted, encoding=encoding,
+                             nrows=None if max_rows is None else max_rows + 1)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise UploadFormatError('CSVの文字コードを判定できません（UTF-8 / Shift_JIS / CP932）')
+    _check_columns(list(dict.fromkeys(found)))
+    _check_rows(len(df), max_rows)
+    return df.reindex(columns=REQUIRED_COLUMNS)
+
+
+def read_parquet_content(content, max_rows=None):
+    """Parquet の必要な列だけを読み込む"""
+    _import_pyarrow('Parquet')
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(io.BytesIO(content))
+    _check_columns(parquet_file.schema_arrow.names)
+    _check_rows(parquet_file.metadata.num_rows, max_rows)
+    return parquet_file.read(columns=REQUIRED_COLUMNS).to_pandas()
+
+
+def read_arrow_content(content, max_rows=None):
+    """Arrow IPC（ファイル形式 / ストリーム形式）の必要な列だけを pandas に変換"""
+    pa = _import_pyarrow('Arrow IPC')
+    import pyarrow.ipc
+    source = pa.BufferReader(content)
+    if content[:6] == ARROW_FILE_MAGIC:
+        reader = pa.ipc.open_file(source)
+    else:
+        reader = pa.ipc.open_stream(source)
+    _check_columns(reader.schema.names)
+    # IPC のバッファはコピーせずに参照されるため、変換するのは必要な列だけ
+    table = reader.read_all()
+    _check_rows(table.num_rows, max_rows)
+    return table.select(REQUIRED_COLUMNS).to_pandas()
+
+
+def read_ndjson_content(content, max_rows=None):
+    """NDJSON（1行1レコード、gzip も可）をチャンクごとに読み込み、必要な列だけ残す"""
+    content = _gunzip(content)
+    chunks = []
+    found = set()
+    n_rows = 0
+    try:
+        reader = pd.read_json(io.BytesIO(content), lines=True, dtype=False, chunksize=NDJSON_CHUNK_ROWS)
+        for chunk in reader:
+            found.update(chunk.columns)
+            chunks.append(chunk[[col for col in REQUIRED_COLUMNS if col in chunk.columns]])
+            n_rows += len(chunk)
+            _check_rows(n_rows, max_rows)
+    except UploadFormatError:
+        raise
+    except ValueError as e:
+        raise UploadFormatError(f'NDJSONの解析に失敗しました: {str(e)}')
+    _check_columns(sorted(found))
+    df = pd.concat(chunks, ignore_index=True)
+    # 一部のレコードにしかない列は欠損値として扱う
+    return df.reindex(columns=REQUIRED_COLUMNS)
+
+
+READERS = {
+    'csv': read_csv_content,
+    'parquet': read_parquet_content,
+    'arrow': read_arrow_content,
+    'ndjson': read_ndjson_content
+}
+
+
+def validate_reviews(df):
+    """星評価のチェック（数値化・欠損を除外・1-5の範囲）"""
+    df['star_rating'] = pd.to_numeric(df['star_rating'], errors='coerce')
+    df = df.dropna(subset=['star_rating'])
+    df['star_rating'] = df['star_rating'].astype(int)
+    return df[(df['star_rating'] >= 1) & (df['star_rating'] <= 5)]
+
+
+def read_reviews(filename, content, max_rows=None):
+    """アップロードされたファイルを形式に応じて読み込み、検証済みの DataFrame にする（max_rows: 行数の上限）"""
+    file_format = detect_format(filename, content)
+    df = READERS[file_format](content, max_rows=max_rows)
+    print(f"アップロード読み込み: {filename} ({file_format}, {len(df)}行)")
+    return validate_reviews(df.reset_index(drop=True))